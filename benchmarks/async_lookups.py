@@ -0,0 +1,117 @@
+"""Event loop latency during 1,000 concurrent lookups, with
+`GitlabPypi.aget_credential` and with `get_credential` wrapped in
+`asyncio.to_thread`.
+
+A task that sleeps for 1 ms at a time measures how late the loop wakes it up
+while the lookups run. Each round starts with cold caches (every config file
+is parsed) or warm ones (every config file is only checked for changes).
+There are five config directories and only the lowest-precedence one has a
+token for the index, like in benchmarks/daemon.py.
+
+Run with `python benchmarks/async_lookups.py` on Linux.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+from keyring.credentials import Credential
+from suite import write_config
+
+from keyrings.gitlab_pypi import GitlabPypi, clear_config_cache
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+HOSTS_PER_FILE = 200
+LOOKUPS = 1000
+ROUNDS = 5
+TICK = 0.001
+
+
+async def measure(
+    lookup: Callable[[], Awaitable[Credential | None]],
+) -> tuple[float, list[float]]:
+    """Return the time taken by the lookups and how late each tick was."""
+    lags: list[float] = []
+    done = False
+
+    async def tick() -> None:
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    credentials = await asyncio.gather(*(lookup() for _ in range(LOOKUPS)))
+    elapsed = time.perf_counter() - start
+    done = True
+    await ticker
+    assert all(
+        credential is not None and credential.password == "token"
+        for credential in credentials
+    )
+    return elapsed, lags
+
+
+def main() -> None:
+    backend = GitlabPypi()
+
+    def native() -> Awaitable[Credential | None]:
+        return backend.aget_credential(SERVICE, None)
+
+    def to_thread() -> Awaitable[Credential | None]:
+        return asyncio.to_thread(backend.get_credential, SERVICE, None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        system_dirs = [root / f"xdg{i}" for i in range(4)]
+        for i, config_dir in enumerate(system_dirs):
+            write_config(
+                config_dir / "gitlab-pypi",
+                HOSTS_PER_FILE,
+                name=f"system{i}",
+                token=None if i else "token",
+            )
+        write_config(root / "home", HOSTS_PER_FILE, name="user", token=None)
+        os.environ["XDG_CONFIG_HOME"] = str(root / "home")
+        os.environ["XDG_CONFIG_DIRS"] = os.pathsep.join(map(str, system_dirs))
+        os.environ["XDG_CACHE_HOME"] = str(root / "cache")
+
+        print(
+            f"{'':>21} {'total (ms)':>11} {'lag p50 (ms)':>13} "
+            f"{'lag p99 (ms)':>13} {'lag max (ms)':>13}"
+        )
+        for cache in ["cold", "warm"]:
+            for name, lookup in [("aget_credential", native), ("to_thread", to_thread)]:
+                totals = []
+                lags: list[float] = []
+                for _ in range(ROUNDS):
+                    if cache == "cold":
+                        clear_config_cache()
+                    else:
+                        backend.get_credential(SERVICE, None)
+                    elapsed, round_lags = asyncio.run(measure(lookup))
+                    totals.append(elapsed)
+                    lags.extend(round_lags)
+                lags.sort()
+                p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+                print(
+                    f"{cache + ' ' + name:>21} "
+                    f"{statistics.median(totals) * 1e3:>11.1f} "
+                    f"{statistics.median(lags) * 1e3:>13.2f} "
+                    f"{p99 * 1e3:>13.2f} {lags[-1] * 1e3:>13.2f}"
+                )
+
+
+if __name__ == "__main__":
+    if sys.platform != "linux":
+        sys.exit("Config directories are set with XDG variables, so run on Linux.")
+    main()
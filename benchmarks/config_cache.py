@@ -0,0 +1,52 @@
+"""Per-lookup cost of GitlabPypi.get_password with and without the parsed
+config cache.
+
+Run with `python benchmarks/config_cache.py`.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from suite import write_config
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+CALLS = [1, 10, 1000]
+
+
+def per_lookup(calls: int, *, cached: bool) -> float:
+    from keyrings.gitlab_pypi import GitlabPypi, clear_config_cache
+
+    backend = GitlabPypi()
+    clear_config_cache()
+    start = time.perf_counter()
+    for _ in range(calls):
+        if not cached:
+            clear_config_cache()
+        assert backend.get_password(SERVICE, "__token__") == "token"
+    return (time.perf_counter() - start) / calls
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        config_home = Path(tmp, "config")
+        config_home.mkdir()
+        os.environ["XDG_CONFIG_HOME"] = str(config_home)
+        os.environ["XDG_CONFIG_DIRS"] = str(Path(tmp, "empty"))
+
+        print(f"{'hosts':>6} {'calls':>6} {'uncached (us)':>14} {'cached (us)':>12}")
+        for hosts in [1, 100]:
+            write_config(config_home, hosts + 1, name="gitlab")
+            for calls in CALLS:
+                uncached = per_lookup(calls, cached=False)
+                cached = per_lookup(calls, cached=True)
+                print(
+                    f"{hosts:>6} {calls:>6} {uncached * 1e6:>14.1f} {cached * 1e6:>12.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
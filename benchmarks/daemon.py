@@ -0,0 +1,80 @@
+"""Cold `keyring-gitlab-pypi get` latency with and without the daemon started
+by `keyring-gitlab-pypi serve`.
+
+Each lookup runs in a new process, like uv's subprocess keyring provider.
+There are five config directories and only the lowest-precedence one has a
+token for the index, like in benchmarks/snapshot.py.
+
+Run with `python benchmarks/daemon.py` on Linux.
+"""
+
+from __future__ import annotations
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from suite import write_config
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+HOSTS_PER_FILE = 200
+RUNS = 20
+
+GET = [sys.executable, "-m", "keyrings.gitlab_pypi.cli", "get", SERVICE, "__token__"]
+
+
+def cold_get(env: dict[str, str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(GET, env=env, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        system_dirs = [root / f"xdg{i}" for i in range(4)]
+        for i, config_dir in enumerate(system_dirs):
+            write_config(
+                config_dir / "gitlab-pypi",
+                HOSTS_PER_FILE,
+                name=f"system{i}",
+                token=None if i else "token",
+            )
+        write_config(root / "home", HOSTS_PER_FILE, name="user", token=None)
+
+        env = {
+            **os.environ,
+            "PYTHONDONTWRITEBYTECODE": "",
+            "XDG_CONFIG_HOME": str(root / "home"),
+            "XDG_CONFIG_DIRS": os.pathsep.join(map(str, system_dirs)),
+            "XDG_CACHE_HOME": str(root / "cache"),
+            "XDG_RUNTIME_DIR": str(root / "run"),
+        }
+        (root / "run").mkdir(mode=0o700)
+
+        without = [cold_get(env) for _ in range(RUNS)]
+
+        socket_file = root / "run" / "gitlab-pypi" / "daemon.sock"
+        with subprocess.Popen(
+            [sys.executable, "-m", "keyrings.gitlab_pypi.cli", "serve"],
+            env=env,
+            stderr=subprocess.DEVNULL,
+        ) as daemon:
+            try:
+                while not socket_file.exists():
+                    time.sleep(0.01)
+                with_daemon = [cold_get(env) for _ in range(RUNS)]
+            finally:
+                daemon.terminate()
+
+    print(f"{'':>14} {'process (ms)':>13}")
+    for name, times in [("without daemon", without), ("with daemon", with_daemon)]:
+        print(f"{name:>14} {statistics.median(times) * 1e3:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
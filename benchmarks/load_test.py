@@ -0,0 +1,221 @@
+"""Fan-out load test that does what uv's subprocess keyring provider does.
+
+uv runs `keyring get <url> <username>` in a new process for every index, and
+on a shared build host many jobs do that at the same time. This starts
+`--lookups` of those processes, `--concurrency` at a time, against generated
+config trees and a fake GitLab CI job environment, and reports:
+
+- the latency of each process (p50, p95 and p99),
+- throughput in lookups per second,
+- the peak RSS of each process (p50 and max).
+
+The config trees have several system config directories (XDG_CONFIG_DIRS)
+and a user one (XDG_CONFIG_HOME), each with a config file with
+`--hosts-per-file` other hosts and a fragment directory. Only the
+lowest-precedence system directory has the token that's looked up. Every
+other lookup is for the CI job's GitLab instance, with the `gitlab-ci-token`
+username.
+
+Run it with `nox -s load_test -- --lookups 500 --concurrency 32`, or directly
+on Linux with `python benchmarks/load_test.py`. `--command
+keyring-gitlab-pypi` runs the lighter entry point instead of `keyring`, and
+`--compile` saves the config snapshot first.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from suite import write_config
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple/foo/"
+CI_SERVICE = "https://ci.example.com/api/v4/projects/2/packages/pypi/simple/foo/"
+TOKEN = "glpat-load-test"
+CI_JOB_TOKEN = "ci-job-token"
+
+
+class Result(NamedTuple):
+    seconds: float
+    # Peak resident set size in bytes.
+    rss: int
+    ok: bool
+
+
+def write_config_dir(
+    config_dir: Path, name: str, hosts: int, *, with_token: bool
+) -> None:
+    """Write a config file and a fragment for a team to config_dir."""
+    write_config(config_dir, hosts, name=name, token=TOKEN if with_token else None)
+    fragments = config_dir / "gitlab-pypi.d"
+    fragments.mkdir(exist_ok=True)
+    (fragments / "team.toml").write_text(
+        f'["https://{name}-team.example.com/api/v4/groups/1"]\ntoken = "team"\n'
+    )
+
+
+def environment(root: Path, system_dirs: int, hosts: int) -> dict[str, str]:
+    """Generate config trees under root, and return the environment of a CI
+    job that uses them.
+    """
+    xdg_dirs = [root / f"xdg{i}" for i in range(system_dirs)]
+    for i, xdg_dir in enumerate(xdg_dirs):
+        write_config_dir(
+            xdg_dir / "gitlab-pypi",
+            f"system{i}",
+            hosts,
+            with_token=i == system_dirs - 1,
+        )
+    write_config_dir(root / "home", "user", hosts, with_token=False)
+    (root / "run").mkdir(mode=0o700)
+
+    return {
+        **os.environ,
+        "XDG_CONFIG_HOME": str(root / "home"),
+        "XDG_CONFIG_DIRS": os.pathsep.join(map(str, xdg_dirs)),
+        "XDG_CACHE_HOME": str(root / "cache"),
+        "XDG_RUNTIME_DIR": str(root / "run"),
+        "GITLAB_CI": "true",
+        "CI_API_V4_URL": "https://ci.example.com/api/v4",
+        "CI_JOB_TOKEN": CI_JOB_TOKEN,
+    }
+
+
+def command(name: str) -> list[str]:
+    if path := shutil.which(name, path=os.path.dirname(sys.executable)):
+        return [path]
+    if name == "keyring":
+        return [sys.executable, "-m", "keyring"]
+    return [sys.executable, "-m", "keyrings.gitlab_pypi.cli"]
+
+
+def get(argv: list[str], env: dict[str, str], i: int) -> Result:
+    """Run one lookup like uv does, and wait for it with wait4 to get its
+    resource usage.
+    """
+    if i % 2:
+        args, expected = [CI_SERVICE, "gitlab-ci-token"], CI_JOB_TOKEN
+    else:
+        args, expected = [SERVICE, "__token__"], TOKEN
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [*argv, "get", *args],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    assert process.stdout is not None
+    output = process.stdout.read()
+    process.stdout.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux.
+    rss = usage.ru_maxrss * 1024
+    ok = process.returncode == 0 and output.decode().strip() == expected
+    return Result(seconds, rss, ok)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Return the nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    argv = command(args.command)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = environment(Path(tmp), args.system_dirs, args.hosts_per_file)
+        if args.compile:
+            subprocess.run(
+                [*command("keyring-gitlab-pypi"), "compile"],
+                env=env,
+                check=True,
+                capture_output=True,
+            )
+        for i in range(args.warmup):
+            get(argv, env, i)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(
+                executor.map(lambda i: get(argv, env, i), range(args.lookups))
+            )
+        elapsed = time.perf_counter() - start
+
+    latencies = [result.seconds for result in results]
+    rss = [float(result.rss) for result in results]
+    return {
+        "command": argv,
+        "python": sys.version.split()[0],
+        "lookups": args.lookups,
+        "concurrency": args.concurrency,
+        "failures": sum(not result.ok for result in results),
+        "latency_ms": {f"p{p}": percentile(latencies, p) * 1e3 for p in (50, 95, 99)},
+        "throughput_per_s": args.lookups / elapsed,
+        "rss_mib": {
+            "p50": statistics.median(rss) / 2**20,
+            "max": max(rss) / 2**20,
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--command",
+        default="keyring",
+        choices=["keyring", "keyring-gitlab-pypi"],
+        help="Executable that uv would run. Default is keyring",
+    )
+    parser.add_argument("--system-dirs", type=int, default=4)
+    parser.add_argument("--hosts-per-file", type=int, default=200)
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Save the config snapshot before the lookups",
+    )
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--output", type=Path, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    latency = report["latency_ms"]
+    print(
+        f"{report['lookups']} lookups with {' '.join(report['command'])}, "
+        f"{report['concurrency']} at a time"
+    )
+    print(
+        f"latency (ms): p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  "
+        f"p99 {latency['p99']:.1f}"
+    )
+    print(f"throughput: {report['throughput_per_s']:.1f} lookups/s")
+    print(
+        f"RSS (MiB): p50 {report['rss_mib']['p50']:.1f}  "
+        f"max {report['rss_mib']['max']:.1f}"
+    )
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    if report["failures"]:
+        sys.exit(f"{report['failures']} lookups failed")
+
+
+if __name__ == "__main__":
+    if sys.platform != "linux":
+        sys.exit("Config directories are set with XDG variables, so run on Linux.")
+    main()
@@ -0,0 +1,104 @@
+"""Credential lookups for a project with many GitLab indexes, with uv's
+subprocess keyring provider and with a netrc file written by
+`keyring-gitlab-pypi netrc`.
+
+uv isn't needed: the subprocess provider is simulated by running
+`keyring-gitlab-pypi get` once per index, like uv does for each index it
+needs credentials for, and the netrc file is read with the netrc module once
+and then looked up for each index. Writing the netrc file is timed as well,
+since it would run once per CI job.
+
+Run with `python benchmarks/netrc_file.py` on Linux.
+"""
+
+from __future__ import annotations
+
+import netrc
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from suite import write_config
+
+INDEXES = [1, 10, 50]
+RUNS = 3
+COMMAND = [sys.executable, "-m", "keyrings.gitlab_pypi.cli"]
+
+
+def service(i: int) -> str:
+    return f"https://gitlab-{i}.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+def subprocess_provider(indexes: int, env: dict[str, str]) -> float:
+    start = time.perf_counter()
+    for i in range(indexes):
+        output = subprocess.run(
+            [*COMMAND, "get", service(i), "__token__"],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        assert output == f"token-{i}\n"
+    return time.perf_counter() - start
+
+
+def write_netrc(indexes: int, env: dict[str, str], path: Path) -> float:
+    path.unlink(missing_ok=True)
+    start = time.perf_counter()
+    subprocess.run(
+        [*COMMAND, "netrc", *map(service, range(indexes)), "--file", str(path)],
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    return time.perf_counter() - start
+
+
+def read_netrc(indexes: int, path: Path) -> float:
+    start = time.perf_counter()
+    hosts = netrc.netrc(path)
+    for i in range(indexes):
+        entry = hosts.authenticators(f"gitlab-{i}.example.com")
+        assert entry is not None and entry[2] == f"token-{i}"
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    print(
+        f"{'indexes':>8} {'mode':>10} {'processes':>10} {'time (ms)':>10} "
+        f"{'write (ms)':>11}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        env = {
+            **os.environ,
+            "XDG_CONFIG_HOME": str(root / "home"),
+            "XDG_CONFIG_DIRS": str(root / "xdg"),
+            "XDG_CACHE_HOME": str(root / "cache"),
+            "XDG_RUNTIME_DIR": str(root / "run"),
+        }
+        path = root / ".netrc"
+
+        for indexes in INDEXES:
+            write_config(root / "home", indexes, name="gitlab", token=None)
+            times = [subprocess_provider(indexes, env) for _ in range(RUNS)]
+            print(
+                f"{indexes:>8} {'subprocess':>10} {indexes:>10} "
+                f"{statistics.median(times) * 1e3:>10.2f} {'':>11}"
+            )
+            writes = [write_netrc(indexes, env, path) for _ in range(RUNS)]
+            times = [read_netrc(indexes, path) for _ in range(RUNS)]
+            print(
+                f"{indexes:>8} {'netrc':>10} {0:>10} "
+                f"{statistics.median(times) * 1e3:>10.2f} "
+                f"{statistics.median(writes) * 1e3:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
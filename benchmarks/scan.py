@@ -0,0 +1,77 @@
+"""Cold lookup time and peak memory for config files of increasing size, when
+they are scanned for the host being looked up and when they are parsed.
+
+Each lookup starts with an empty cache, like the first lookup in a new
+process. Peak memory is measured with tracemalloc, so it only includes
+allocations made by Python.
+
+Run with `python benchmarks/scan.py` on Linux.
+"""
+
+from __future__ import annotations
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from suite import write_config
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import GitlabPypi, clear_config_cache
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+HOSTS = [100, 1_000, 10_000, 100_000]
+RUNS = 5
+
+
+def cold_time(backend: GitlabPypi) -> float:
+    clear_config_cache()
+    start = time.perf_counter()
+    assert backend.get_password(SERVICE, "__token__") == "token"
+    return time.perf_counter() - start
+
+
+def cold_peak_memory(backend: GitlabPypi) -> int:
+    # tracemalloc slows allocation down, so this is measured separately.
+    clear_config_cache()
+    tracemalloc.start()
+    try:
+        assert backend.get_password(SERVICE, "__token__") == "token"
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> None:
+    backend = GitlabPypi()
+    scan_min_size = keyrings.gitlab_pypi._SCAN_MIN_SIZE
+
+    print(
+        f"{'hosts':>8} {'size (KiB)':>11} {'mode':>6} {'time (ms)':>10} "
+        f"{'peak (KiB)':>11}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["XDG_CONFIG_HOME"] = tmp
+        os.environ["XDG_CONFIG_DIRS"] = str(Path(tmp) / "empty")
+        os.environ["XDG_CACHE_HOME"] = str(Path(tmp) / "cache")
+
+        for hosts in HOSTS:
+            size = write_config(Path(tmp), hosts).stat().st_size
+            for mode, min_size in [("scan", 0), ("parse", sys.maxsize)]:
+                keyrings.gitlab_pypi._SCAN_MIN_SIZE = min_size
+                times = [cold_time(backend) for _ in range(RUNS)]
+                peak = cold_peak_memory(backend)
+                print(
+                    f"{hosts:>8} {size / 1024:>11.0f} {mode:>6} "
+                    f"{statistics.median(times) * 1e3:>10.2f} {peak / 1024:>11.0f}"
+                )
+
+    keyrings.gitlab_pypi._SCAN_MIN_SIZE = scan_min_size
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Cold lookup latency with and without the config snapshot written by
+`keyring-gitlab-pypi compile`.
+
+Each lookup runs in a new process, like uv's subprocess keyring provider.
+Medians are reported for the whole process and for get_password alone. There
+are five config directories (XDG_CONFIG_HOME and four XDG_CONFIG_DIRS
+entries) and only the lowest-precedence one has a token for the index, so
+every config file has to be checked.
+
+Run with `python benchmarks/snapshot.py` on Linux.
+"""
+
+from __future__ import annotations
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from suite import write_config
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+HOSTS_PER_FILE = 200
+RUNS = 20
+
+
+# Report the lookup separately, since interpreter startup and importing keyring
+# are the same with and without the snapshot.
+LOOKUP_CODE = f"""
+import time
+from keyrings.gitlab_pypi import GitlabPypi
+start = time.perf_counter()
+assert GitlabPypi().get_password({SERVICE!r}, "__token__") == "token"
+print(time.perf_counter() - start)
+"""
+
+
+def cold_get(env: dict[str, str]) -> tuple[float, float]:
+    """Return the wall time of a new process that looks up a token, and the
+    time spent in get_password.
+    """
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", LOOKUP_CODE],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return time.perf_counter() - start, float(output)
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        system_dirs = [root / f"xdg{i}" for i in range(4)]
+        for i, config_dir in enumerate(system_dirs):
+            write_config(
+                config_dir / "gitlab-pypi",
+                HOSTS_PER_FILE,
+                name=f"system{i}",
+                token=None if i else "token",
+            )
+        write_config(root / "home", HOSTS_PER_FILE, name="user", token=None)
+
+        env = {
+            **os.environ,
+            # Don't count compiling this package's bytecode in every run.
+            "PYTHONDONTWRITEBYTECODE": "",
+            "XDG_CONFIG_HOME": str(root / "home"),
+            "XDG_CONFIG_DIRS": os.pathsep.join(map(str, system_dirs)),
+            "XDG_CACHE_HOME": str(root / "cache"),
+        }
+
+        without = [cold_get(env) for _ in range(RUNS)]
+
+        subprocess.run(
+            [sys.executable, "-m", "keyrings.gitlab_pypi.cli", "compile"],
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+        with_snapshot = [cold_get(env) for _ in range(RUNS)]
+
+    print(f"{'':>16} {'process (ms)':>13} {'get_password (ms)':>18}")
+    for name, times in [
+        ("without snapshot", without),
+        ("with snapshot", with_snapshot),
+    ]:
+        process = statistics.median(t for t, _ in times) * 1e3
+        lookup = statistics.median(t for _, t in times) * 1e3
+        print(f"{name:>16} {process:>13.1f} {lookup:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
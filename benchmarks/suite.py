@@ -0,0 +1,559 @@
+"""Benchmarks for the lookup hot paths, with machine-readable results.
+
+Each benchmark reports the median and minimum time per call over several
+repeats. Results are written as JSON so that runs on different commits can be
+compared, and a run fails if any benchmark is slower than the baseline by more
+than the given factor:
+
+    nox -s benchmarks -- --output before.json
+    git switch my-branch
+    nox -s benchmarks -- --compare before.json --max-slowdown 1.25
+
+The time spent importing this package can also be held to a fixed budget,
+which doesn't need an earlier run:
+
+    nox -s benchmarks -- -k import --max-import-us 5000
+
+Config directories are set with XDG_CONFIG_HOME and XDG_CONFIG_DIRS, so
+run it on Linux.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import Any
+
+from keyrings.gitlab_pypi import GitlabPypi, clear_config_cache
+
+RESULTS_VERSION = 1
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+CI_SERVICE = "https://ci.example.com/api/v4/projects/1/packages/pypi/simple"
+
+INDEX_SERVICES = [
+    SERVICE,
+    "https://gitlab.example.com/api/v4/groups/1/-/packages/pypi/simple/foo/",
+    "https://gitlab.example.com/api/v4/packages/pypi/simple/foo/",
+]
+
+NON_GITLAB_SERVICES = [
+    "https://pypi.org/simple/requests/",
+    "https://files.pythonhosted.org/packages/f9/9b/"
+    "335f9764261e915ed497fcdeb11df5dfd6f7bf257d4a6a2a686d80da4d54/"
+    "requests-2.32.3-py3-none-any.whl",
+    "https://download.pytorch.org/whl/cpu/torch/",
+    "https://artifactory.example.com/artifactory/api/pypi/pypi-remote/simple/foo",
+]
+
+
+class Suite:
+    def __init__(self, root: Path, *, keyword: str, repeat: int) -> None:
+        self.root = root
+        self.keyword = keyword
+        self.repeat = repeat
+        self.results: dict[str, dict[str, Any]] = {}
+
+    def time(
+        self,
+        name: str,
+        func: Callable[[], object],
+        *,
+        number: int,
+        repeat: int | None = None,
+    ) -> None:
+        """Time `number` calls of func, `repeat` times."""
+        if self.keyword not in name:
+            return
+
+        repeat = repeat or self.repeat
+        func()  # warm up
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            times.append((time.perf_counter() - start) / number)
+        self.record(name, times, number=number)
+
+    def record(self, name: str, times: list[float], *, number: int = 1) -> None:
+        """Record times (in seconds per call) measured by a benchmark."""
+        self.results[name] = {
+            "median": statistics.median(times),
+            "min": min(times),
+            "number": number,
+            "repeat": len(times),
+        }
+        print(
+            f"{name:<40} {statistics.median(times) * 1e6:>12.1f} us",
+            file=sys.stderr,
+        )
+
+
+def write_config(
+    config_dir: Path, hosts: int, *, name: str = "host", token: str | None = "token"
+) -> Path:
+    """Write a config file with `hosts` tables for `<name>-<i>.example.com`
+    and return its path. Unless token is None, the last table is for
+    gitlab.example.com, the host that is looked up, with that token.
+
+    The other benchmark scripts import this from here.
+    """
+    lines = []
+    for i in range(hosts if token is None else hosts - 1):
+        lines.append(f'["https://{name}-{i}.example.com"]\ntoken = "token-{i}"\n')
+    if token is not None:
+        lines.append(f'["https://gitlab.example.com"]\ntoken = "{token}"\n')
+    config_dir.mkdir(parents=True, exist_ok=True)
+    file = config_dir / "gitlab-pypi.toml"
+    file.write_text("\n".join(lines))
+    return file
+
+
+@contextmanager
+def environ(env: Mapping[str, str]) -> Iterator[None]:
+    saved = dict(os.environ)
+    os.environ.update(env)
+    clear_config_cache()
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+        clear_config_cache()
+
+
+def config_env(root: Path, *, config_dirs: int = 1) -> dict[str, str]:
+    """Return the environment for a user config directory and config_dirs
+    system config directories below root.
+    """
+    return {
+        "XDG_CONFIG_HOME": str(root / "home"),
+        "XDG_CONFIG_DIRS": os.pathsep.join(
+            str(root / f"xdg{i}") for i in range(config_dirs)
+        ),
+        # Keep snapshots and the daemon of the user running the suite out of it.
+        "XDG_CACHE_HOME": str(root / "cache"),
+        "XDG_RUNTIME_DIR": str(root / "run"),
+    }
+
+
+def bench_config_size(suite: Suite) -> None:
+    backend = GitlabPypi()
+    for hosts in [1, 100, 10_000]:
+        root = suite.root / f"hosts-{hosts}"
+        write_config(root / "home", hosts)
+        with environ(config_env(root)):
+
+            def warm() -> None:
+                assert backend.get_password(SERVICE, "__token__") == "token"
+
+            def cold() -> None:
+                clear_config_cache()
+                warm()
+
+            suite.time(f"warm_token[hosts={hosts}]", warm, number=1000)
+            suite.time(
+                f"parse_config[hosts={hosts}]", cold, number=max(1, 1000 // hosts)
+            )
+
+
+def bench_path_prefixes(suite: Suite) -> None:
+    backend = GitlabPypi()
+    for prefixes in [0, 100, 10_000]:
+        root = suite.root / f"prefixes-{prefixes}"
+        config_dir = root / "home"
+        config_dir.mkdir(parents=True)
+        lines = ['["https://gitlab.example.com"]\ntoken = "token"\n']
+        for i in range(prefixes):
+            lines.append(
+                f'["https://gitlab.example.com/api/v4/projects/{i + 2}"]\n'
+                f'token = "token-{i}"\n'
+            )
+        (config_dir / "gitlab-pypi.toml").write_text("\n".join(lines))
+        scoped_service = SERVICE.replace("/projects/1/", f"/projects/{prefixes + 1}/")
+        expected = f"token-{prefixes - 1}" if prefixes else "token"
+        with environ(config_env(root)):
+
+            def host() -> None:
+                assert backend.get_password(SERVICE, "__token__") == "token"
+
+            def scoped() -> None:
+                assert backend.get_password(scoped_service, "__token__") == expected
+
+            suite.time(f"warm_host_token[prefixes={prefixes}]", host, number=1000)
+            suite.time(f"warm_prefix_token[prefixes={prefixes}]", scoped, number=1000)
+
+
+def bench_ci(suite: Suite) -> None:
+    backend = GitlabPypi()
+    env = {
+        **config_env(suite.root / "ci"),
+        "GITLAB_CI": "true",
+        "CI_API_V4_URL": "https://ci.example.com/api/v4",
+        "CI_JOB_TOKEN": "ci-token",
+    }
+    with environ(env):
+
+        def lookup() -> None:
+            assert backend.get_password(CI_SERVICE, "gitlab-ci-token") == "ci-token"
+
+        suite.time("warm_ci_job_token", lookup, number=1000)
+
+
+def bench_config_dirs(suite: Suite) -> None:
+    backend = GitlabPypi()
+    for config_dirs in [10, 100]:
+        root = suite.root / f"dirs-{config_dirs}"
+        # Only the lowest-precedence directory has the token, so every config
+        # file is checked.
+        for i in range(config_dirs):
+            write_config(
+                root / f"xdg{i}" / "gitlab-pypi", 10, token=None if i else "token"
+            )
+        with environ(config_env(root, config_dirs=config_dirs)):
+
+            def lookup() -> None:
+                assert backend.get_password(SERVICE, "__token__") == "token"
+
+            suite.time(f"warm_token[config_dirs={config_dirs}]", lookup, number=100)
+
+
+def bench_fragments(suite: Suite) -> None:
+    """500 hosts in fragments or in one config file, where the file with the
+    token changes between lookups.
+    """
+    backend = GitlabPypi()
+    hosts = 500
+    root = suite.root / "fragments"
+    fragments_dir = root / "fragments" / "home" / "gitlab-pypi.d"
+    fragments_dir.mkdir(parents=True)
+    for i in range(hosts - 1):
+        (fragments_dir / f"{i:03}.toml").write_text(
+            f'["https://host-{i}.example.com"]\ntoken = "token-{i}"\n'
+        )
+    fragment = fragments_dir / f"{hosts - 1:03}.toml"
+    single_file = root / "single_file" / "home" / "gitlab-pypi.toml"
+    write_config(single_file.parent, hosts)
+
+    def rewrite(file: Path, old: str, new: str) -> None:
+        # Same size, so bump the modification time to tell them apart.
+        st = file.stat()
+        file.write_text(file.read_text().replace(old, new))
+        os.utime(file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+    fragment.write_text('["https://gitlab.example.com"]\ntoken = "token"\n')
+    # Like a directory that config management last changed a while ago, so
+    # that its listing is cached.
+    old = time.time_ns() - 3_600_000_000_000
+    os.utime(fragments_dir, ns=(old, old))
+
+    for name, file in [("fragments", fragment), ("single_file", single_file)]:
+        tokens = ["token", "nekot"]
+        with environ(config_env(root / name)):
+
+            def warm() -> None:
+                assert backend.get_password(SERVICE, "__token__") == tokens[0]
+
+            def changed(file: Path = file) -> None:
+                rewrite(file, f'"{tokens[0]}"', f'"{tokens[1]}"')
+                tokens.reverse()
+                warm()
+
+            clear_config_cache()
+            suite.time(f"warm_token[{name}={hosts}]", warm, number=100)
+            suite.time(f"changed_token[{name}={hosts}]", changed, number=20)
+
+
+def bench_threads(suite: Suite) -> None:
+    """The same number of warm lookups split between 1 and 4 threads. With a
+    GIL they shouldn't take longer with more threads, and on free-threaded
+    builds they should take less.
+    """
+    backend = GitlabPypi()
+    lookups = 400
+    root = suite.root / "threads"
+    write_config(root / "home", 100)
+    with environ(config_env(root)):
+
+        def run(count: int) -> None:
+            for _ in range(count):
+                assert backend.get_password(SERVICE, "__token__") == "token"
+
+        for threads in [1, 4]:
+            with ThreadPoolExecutor(threads) as executor:
+
+                def lookup(executor: ThreadPoolExecutor = executor) -> None:
+                    futures = [
+                        executor.submit(run, lookups // threads) for _ in range(threads)
+                    ]
+                    for future in futures:
+                        future.result()
+
+                suite.time(
+                    f"warm_token[threads={threads},lookups={lookups}]",
+                    lookup,
+                    number=10,
+                )
+
+
+def bench_authoritative(suite: Suite) -> None:
+    """What keyring does in a `keyring get` process for an index with no
+    token: pick a backend and ask it. Another installed backend takes 10 ms to
+    find nothing, like Secret Service waiting for D-Bus activation, and is
+    only asked if the host isn't authoritative.
+    """
+    from keyring.backend import KeyringBackend, get_all_keyring
+    from keyring.backends.chainer import ChainerBackend
+    from keyring.core import _detect_backend
+
+    from keyrings.gitlab_pypi import backend
+
+    class SlowKeyring(KeyringBackend):
+        priority = 5
+
+        def get_password(self, service: str, username: str) -> str | None:
+            time.sleep(0.01)
+            return None
+
+        def set_password(self, service: str, username: str, password: str) -> None:
+            raise NotImplementedError
+
+        def delete_password(self, service: str, username: str) -> None:
+            raise NotImplementedError
+
+    def viable(keyring: KeyringBackend) -> bool:
+        return isinstance(keyring, (GitlabPypi, SlowKeyring, ChainerBackend))
+
+    argv = sys.argv
+    sys.argv = ["keyring", "get", SERVICE, "__token__"]
+    try:
+        for authoritative in [False, True]:
+            root = suite.root / f"authoritative-{authoritative}"
+            config_dir = root / "home"
+            config_dir.mkdir(parents=True)
+            value = "true" if authoritative else "false"
+            (config_dir / "gitlab-pypi.toml").write_text(
+                f'["https://gitlab.example.com"]\nauthoritative = {value}\n'
+            )
+            with environ(config_env(root)):
+
+                def get() -> None:
+                    backend._priority.cache_clear()
+                    # Raises KeyError if the backends haven't been found yet.
+                    with suppress(KeyError):
+                        get_all_keyring.reset()
+                    keyring = _detect_backend(viable)
+                    assert keyring.get_password(SERVICE, "__token__") is None
+
+                suite.time(
+                    f"keyring_get[authoritative={authoritative}]", get, number=10
+                )
+    finally:
+        sys.argv = argv
+        backend._priority.cache_clear()
+
+
+def bench_non_gitlab(suite: Suite) -> None:
+    backend = GitlabPypi()
+    root = suite.root / "non-gitlab"
+    write_config(root / "home", 100)
+    with environ(config_env(root)):
+
+        def lookup() -> None:
+            for service in NON_GITLAB_SERVICES:
+                assert backend.get_password(service, "__token__") is None
+
+        suite.time(
+            f"reject_non_gitlab[urls={len(NON_GITLAB_SERVICES)}]", lookup, number=1000
+        )
+
+
+def bench_url_matcher(suite: Suite) -> None:
+    from keyrings.gitlab_pypi import _gitlab_url_from_service
+
+    def match() -> None:
+        for service in INDEX_SERVICES:
+            assert _gitlab_url_from_service(service) is not None
+
+    suite.time(f"match_index_url[urls={len(INDEX_SERVICES)}]", match, number=10_000)
+
+
+def bench_subprocess(suite: Suite) -> None:
+    root = suite.root / "subprocess"
+    write_config(root / "home", 100)
+    env = {**os.environ, **config_env(root)}
+    commands = {
+        "keyring": [sys.executable, "-m", "keyring"],
+        "keyring-gitlab-pypi": [sys.executable, "-m", "keyrings.gitlab_pypi.cli"],
+    }
+    for name, command in commands.items():
+
+        def get(command: list[str] = command) -> None:
+            output = subprocess.run(
+                [*command, "get", SERVICE, "__token__"],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            assert output == "token\n"
+
+        suite.time(f"cold_get[{name}]", get, number=1, repeat=10)
+
+
+def bench_import(suite: Suite) -> None:
+    """The time spent importing this package's own modules when keyring loads
+    the backend, from -X importtime.
+    """
+    name = "import_self_time"
+    if suite.keyword not in name:
+        return
+
+    # Import keyring first so that only the cost of this package is measured.
+    code = "import keyring.backend, keyring.credentials; "
+    code += "import keyrings.gitlab_pypi.backend"
+    times = []
+    for _ in range(suite.repeat):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stderr
+        # Lines look like "import time:   self [us] | cumulative | imported package"
+        self_us = 0
+        for line in stderr.splitlines():
+            self_time, _, package = line.split("|")
+            if package.strip().startswith("keyrings.gitlab_pypi"):
+                self_us += int(self_time.rpartition(":")[2])
+        times.append(self_us / 1e6)
+    suite.record(name, times)
+
+
+BENCHMARKS = [
+    bench_config_size,
+    bench_path_prefixes,
+    bench_ci,
+    bench_config_dirs,
+    bench_fragments,
+    bench_threads,
+    bench_authoritative,
+    bench_non_gitlab,
+    bench_url_matcher,
+    bench_subprocess,
+    bench_import,
+]
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    results: Mapping[str, Mapping[str, Any]],
+    baseline: Mapping[str, Mapping[str, Any]],
+    max_slowdown: float | None,
+) -> bool:
+    """Print the ratio of each median to the baseline, and return whether all
+    of them are within max_slowdown.
+    """
+    ok = True
+    print(f"\n{'benchmark':<40} {'ratio':>8}", file=sys.stderr)
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["median"] / baseline[name]["median"]
+        slower = max_slowdown is not None and ratio > max_slowdown
+        ok = ok and not slower
+        print(
+            f"{name:<40} {ratio:>8.2f}{'  SLOWER' if slower else ''}",
+            file=sys.stderr,
+        )
+    return ok
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--output", type=Path, help="write results as JSON to this file"
+    )
+    parser.add_argument("--compare", type=Path, help="JSON results to compare with")
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        help="fail if a median is this many times the one in --compare",
+    )
+    parser.add_argument(
+        "--max-import-us",
+        type=float,
+        help="fail if the median import_self_time is more microseconds than this",
+    )
+    parser.add_argument(
+        "-k", dest="keyword", default="", help="only run benchmarks containing this"
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.max_slowdown is not None and args.compare is None:
+        parser.error("--max-slowdown requires --compare")
+    if args.max_import_us is not None and args.keyword not in "import_self_time":
+        parser.error("--max-import-us requires the import_self_time benchmark")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        suite = Suite(Path(tmp), keyword=args.keyword, repeat=args.repeat)
+        for benchmark in BENCHMARKS:
+            benchmark(suite)
+
+    data = {
+        "version": RESULTS_VERSION,
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "benchmarks": suite.results,
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(data, indent=2) + "\n")
+
+    ok = True
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("version") != RESULTS_VERSION:
+            parser.error(f"{args.compare} was written by a different version")
+        ok = compare(suite.results, baseline["benchmarks"], args.max_slowdown)
+
+    if args.max_import_us is not None:
+        import_us = suite.results["import_self_time"]["median"] * 1e6
+        if import_us > args.max_import_us:
+            print(
+                f"\nimport_self_time of {import_us:.1f} us is over the budget of "
+                f"{args.max_import_us:.1f} us",
+                file=sys.stderr,
+            )
+            ok = False
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
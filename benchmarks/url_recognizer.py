@@ -0,0 +1,88 @@
+"""Cost of recognising GitLab package index URLs, compared with building a
+yarl.URL for every service string.
+
+Every service string is unique, like the file URLs that installers look up,
+because yarl caches URLs it has already parsed. The "group" corpus has group
+and instance index URLs, which the yarl-based recognizer rejected after
+parsing them.
+
+Run with `python benchmarks/url_recognizer.py`.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from collections.abc import Callable
+
+from yarl import URL
+
+from keyrings.gitlab_pypi import _gitlab_url_from_service
+
+GITLAB = [
+    "https://gitlab.com/api/v4/projects/1234/packages/pypi/simple/pkg{i}/",
+    "https://gitlab.example.com/api/v4/projects/group%2Fproject/packages/pypi/simple/pkg{i}",
+    "https://gitlab.example.com:8443/api/v4/projects/42/packages/pypi/simple/pkg{i}",
+    "http://gitlab.internal:8080/api/v4/projects/7/packages/pypi/files/"
+    "0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef/"
+    "pkg{i}-1.0.0-py3-none-any.whl",
+]
+
+GROUP_AND_INSTANCE = [
+    "https://gitlab.com/api/v4/groups/1234/-/packages/pypi/simple/pkg{i}/",
+    "https://gitlab.example.com/api/v4/groups/group%2Fsubgroup/-/packages/pypi/simple/pkg{i}",
+    "https://gitlab.example.com:8443/api/v4/packages/pypi/simple/pkg{i}",
+    "http://gitlab.internal:8080/api/v4/groups/7/-/packages/pypi/files/"
+    "0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef/"
+    "pkg{i}-1.0.0-py3-none-any.whl",
+]
+
+OTHER = [
+    "https://pypi.org/simple/pkg{i}/",
+    "https://files.pythonhosted.org/packages/f9/9b/"
+    "335f9764261e915ed497fcdeb11df5dfd6f7bf257d4a6a2a686d80da4d54/"
+    "pkg{i}-2.32.3-py3-none-any.whl",
+    "https://download.pytorch.org/whl/cpu/pkg{i}/",
+    "https://artifactory.example.com/artifactory/api/pypi/pypi-remote/simple/pkg{i}",
+]
+
+N = 5000
+
+
+def yarl_recognizer(service: str) -> URL | None:
+    """The implementation before the fast recognizer was added."""
+    try:
+        url = URL(service)
+    except ValueError:
+        return None
+
+    if not re.match(r"^/api/v4/projects/[^/]+/packages/pypi", url.path):
+        return None
+
+    if url.scheme not in ("http", "https"):
+        return None
+
+    return url
+
+
+def per_call(
+    func: Callable[[str], object], templates: list[str], *, offset: int
+) -> float:
+    corpus = [t.format(i=i) for i in range(offset, offset + N) for t in templates]
+    start = time.perf_counter()
+    for service in corpus:
+        func(service)
+    return (time.perf_counter() - start) / len(corpus)
+
+
+def main() -> None:
+    print(f"{'corpus':>8} {'yarl (ns)':>10} {'fast (ns)':>10}")
+    corpora = [("gitlab", GITLAB), ("group", GROUP_AND_INSTANCE), ("other", OTHER)]
+    for name, templates in corpora:
+        slow = per_call(yarl_recognizer, templates, offset=0)
+        fast = per_call(_gitlab_url_from_service, templates, offset=N)
+        print(f"{name:>8} {slow * 1e9:>10.0f} {fast * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -45,3 +45,27 @@ def typing(session: nox.Session) -> None:
         # explicit_package_bases in pyproject.toml so that namespace packages work.
         env={"MYPYPATH": "src"},
     )
+
+
+@nox.session(python="3.13")
+def benchmarks(session: nox.Session) -> None:
+    session.run_install(
+        "uv",
+        "sync",
+        "--no-dev",
+        f"--python={session.virtualenv.location}",
+        env={"UV_PROJECT_ENVIRONMENT": session.virtualenv.location},
+    )
+    session.run("python", "benchmarks/suite.py", *session.posargs)
+
+
+@nox.session(python="3.13")
+def load_test(session: nox.Session) -> None:
+    session.run_install(
+        "uv",
+        "sync",
+        "--no-dev",
+        f"--python={session.virtualenv.location}",
+        env={"UV_PROJECT_ENVIRONMENT": session.virtualenv.location},
+    )
+    session.run("python", "benchmarks/load_test.py", *session.posargs)
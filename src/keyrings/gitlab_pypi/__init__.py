@@ -1,28 +1,37 @@
 from __future__ import annotations
 
+import functools
+import logging
 import os
 import re
 import sys
-from collections.abc import Iterator
-from itertools import product
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, NamedTuple, Union
 
-import platformdirs
-from keyring.backend import KeyringBackend
-from keyring.credentials import SimpleCredential
-from yarl import URL
+from . import _trace
 
-if sys.version_info < (3, 11):
-    import tomli as tomllib
-else:
-    import tomllib
+# keyring imports every backend to read its priority, so dependencies that are
+# only needed to look up a token (platformdirs, yarl, tomllib) are imported
+# when they're first used.
+#
+# The backend itself is defined in keyrings.gitlab_pypi.backend, which is the
+# module keyring loads. This module doesn't import keyring, so that the
+# keyring-gitlab-pypi command can look up tokens without paying for it.
+if TYPE_CHECKING:
+    from .backend import GitlabPypi as GitlabPypi
 
+log = logging.getLogger(__name__)
 
 CONFIG_APPNAME = "gitlab-pypi"
 
 
 def user_config_path() -> Path:
+    import platformdirs
+
     if sys.platform == "darwin":
         # Use ~/Library/Application Support/gitlab-pypi if it exists
         path = platformdirs.user_config_path(CONFIG_APPNAME)
@@ -39,6 +48,8 @@ def user_config_path() -> Path:
 
 
 def system_config_paths() -> list[Path]:
+    import platformdirs
+
     dirs = platformdirs.site_config_dir(
         CONFIG_APPNAME, appauthor=False, multipath=True
     ).split(os.pathsep)
@@ -51,114 +62,1108 @@ def system_config_paths() -> list[Path]:
 
 CONFIG_FILENAME = "gitlab-pypi.toml"
 
+# Directory next to each config file whose *.toml files ("fragments") are
+# config files too, e.g. for config management to drop in one file per team.
+CONFIG_FRAGMENTS_DIRNAME = "gitlab-pypi.d"
+
+
+# (scheme, host, port) of a GitLab instance.
+_Origin = tuple[str, str, int]
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class _ServiceURL(NamedTuple):
+    scheme: str
+    host: str
+    port: int
+    path: str
+
+    @property
+    def origin(self) -> _Origin:
+        return self.scheme, self.host, self.port
+
+
+# Matches the path of GitLab's PyPI endpoints for:
+# - a project: /api/v4/projects/<id>/packages/pypi
+# - a group: /api/v4/groups/<id>/-/packages/pypi
+# - the instance: /api/v4/packages/pypi
+# A group can be given by its full path (group%2Fsubgroup), which becomes
+# several segments once percent-decoded. The same pattern recognises URLs for
+# config file tokens and for the CI job token.
+_GITLAB_PYPI_PATH_PATTERN = (
+    r"/api/v4/(?:projects/[^/]+/|groups/[^/]+(?:/[^/]+)*?/-/)?packages/pypi"
+)
+
+
+@functools.cache
+def _compile(pattern: str) -> re.Pattern[str]:
+    """Compile a pattern the first time it is used instead of at import."""
+    return re.compile(pattern)
+
+
+def _parse_url_slow(value: str) -> _ServiceURL | None:
+    from yarl import URL
 
-def _gitlab_url_from_service(service: str) -> URL | None:
     try:
-        url = URL(service)
+        url = URL(value)
     except ValueError:
         return None
 
-    if not re.match(r"^/api/v4/projects/[^/]+/packages/pypi", url.path):
+    if url.scheme not in ("http", "https") or not url.host:
+        return None
+
+    assert url.port is not None
+    return _ServiceURL(url.scheme, url.host, url.port, url.path)
+
+
+def _parse_url(value: str) -> _ServiceURL | None:
+    """Split an http(s) URL into the parts we need, agreeing with yarl's
+    normalisation of the scheme, host, port and path.
+
+    Plain ASCII URLs are split with string methods. Anything that yarl might
+    normalise (percent-encoding, whitespace and control characters, IPv6 and
+    IDNA hosts, dot segments) falls back to yarl.
+    """
+    scheme, sep, rest = value.partition("://")
+    scheme = scheme.lower()
+
+    if scheme not in _DEFAULT_PORTS or not value.isascii():
+        # yarl removes leading spaces, and tabs and newlines anywhere, but if
+        # there are none of those we can already tell that it isn't an http(s)
+        # URL.
+        if value.isprintable() and not value.lstrip(" ")[:8].lower().startswith(
+            ("http://", "https://")
+        ):
+            return None
+        return _parse_url_slow(value)
+
+    authority, _, path = rest.partition("/")
+    path = "/" + path.partition("?")[0].partition("#")[0]
+    userinfo, _, hostport = authority.rpartition("@")
+    host, _, port = hostport.partition(":")
+    host = host.lower()
+
+    if (
+        not value.isprintable()
+        or " " in value
+        or "%" in value
+        or "\\" in value
+        or "/." in path
+        or "?" in authority
+        or "#" in authority
+        or "@" in userinfo
+        or not host.replace(".", "").replace("-", "").isalnum()
+        or "xn--" in host
+        or (port and not port.isdigit())
+    ):
+        return _parse_url_slow(value)
+
+    port_number = int(port) if port else _DEFAULT_PORTS[scheme]
+    if port_number > 65535:
+        return None
+
+    return _ServiceURL(scheme, host, port_number, path)
+
+
+def _gitlab_url_from_service(service: str) -> _ServiceURL | None:
+    # Any URL that can match contains "pypi", unless it is percent-encoded or
+    # split by tabs or newlines (which are removed when parsing).
+    if "pypi" not in service and "%" not in service and service.isprintable():
         return None
 
-    if url.scheme not in ("http", "https"):
+    url = _parse_url(service)
+    if url is None or not _compile(_GITLAB_PYPI_PATH_PATTERN).match(url.path):
         return None
 
     return url
 
 
+@functools.lru_cache(maxsize=1)
+def _parse_ci_api_url(value: str) -> _ServiceURL | None:
+    return _parse_url(value)
+
+
 def iter_config_paths() -> Iterator[Path]:
     """Yields config paths in order of lowest to highest precedence."""
     yield from system_config_paths()
     yield user_config_path()
 
 
-def _load_access_token(service: str) -> str | None:
+# Environment variables that platformdirs reads to find config directories.
+_CONFIG_PATH_ENV_VARS = (
+    "XDG_CONFIG_HOME",
+    "XDG_CONFIG_DIRS",
+    "HOME",
+    "APPDATA",
+    "LOCALAPPDATA",
+    "PROGRAMDATA",
+    "ALLUSERSPROFILE",
+)
+
+# The directory that user_config_path prefers on macOS if it exists.
+_MACOS_USER_CONFIG_DIR = "~/Library/Application Support/" + CONFIG_APPNAME
+
+
+@functools.lru_cache(maxsize=16)
+def _find_config_files(environ: tuple[object, ...]) -> tuple[tuple[Path, Path], ...]:
+    return tuple(
+        (path / CONFIG_FRAGMENTS_DIRNAME, path / CONFIG_FILENAME)
+        for path in reversed(list(iter_config_paths()))
+    )
+
+
+def _config_files() -> tuple[tuple[Path, Path], ...]:
+    """Return the fragment directory and config file of each config path in
+    order of highest to lowest precedence.
+
+    Discovering the config directories is memoized on the environment
+    variables that they depend on.
+    """
+    environ: tuple[object, ...] = tuple(map(os.environ.get, _CONFIG_PATH_ENV_VARS))
+    if sys.platform == "darwin":
+        environ += (os.path.isdir(os.path.expanduser(_MACOS_USER_CONFIG_DIR)),)
+    return _find_config_files(environ)
+
+
+def set_trace_hook(hook: _trace.TraceHook | None) -> None:
+    """Call hook with a dict describing each lookup, or stop if hook is None.
+
+    See `keyrings.gitlab_pypi._trace` for what the dict contains. Lookups can
+    also be traced by setting the KEYRING_GITLAB_PYPI_TRACE environment
+    variable.
+    """
+    _trace.set_hook(hook)
+
+
+def _trace_service(service: str) -> _ServiceURL | None:
+    trace = _trace.current()
+    if trace is None:
+        return _gitlab_url_from_service(service)
+
+    start = trace.now()
     url = _gitlab_url_from_service(service)
+    trace.phase("url_parse", start)
+    if url is not None:
+        trace.urls.add(url)
+    return url
+
+
+def _load_access_token(service: str) -> str | None:
+    url = _trace_service(service)
 
     if url is None:
         return None
 
+    if token := _env_token(url):
+        return token
+
     # Since we don't need to merge config files, we can start with the
     # highest-precedence file and return the first token we find.
-    for path in reversed(list(iter_config_paths())):
-        if token := _load_access_token_from_config_path(path, url):
-            return token
+    trace = _trace.current()
+    with _config_snapshot():
+        for file, index in _iter_configs(url.origin):
+            if token := _find_token(index, url, trace):
+                if trace is not None:
+                    trace.found("config", file)
+                return token
 
     return None
 
 
-def _load_access_token_from_config_path(path: Path, url: URL) -> str | None:
-    try:
-        with open(path / CONFIG_FILENAME, "rb") as f:
-            config = tomllib.load(f)
-    except (FileNotFoundError, tomllib.TOMLDecodeError):
-        return None
+# (st_mtime_ns, st_size, st_ino) of a config file when it was last parsed.
+_StatSignature = tuple[int, int, int]
 
-    # Transform a URL like https://gitlab.com/api/v4/projects/0/packages/pypi/simple
-    # into some keys that can be used:
-    # - https://gitlab.com
-    # - https://gitlab.com:443
-    # - gitlab.com
-    # - gitlab.com/
 
-    prefixes = [f"{url.scheme}://"]
-    if url.scheme == "https":
-        prefixes.append("")
+class _TokenCommand(NamedTuple):
+    """A command that prints a token, and how many seconds to cache it for."""
 
-    assert url.port is not None
-    portstrs = [f":{url.port}"]
-    if url.is_default_port():
-        portstrs.insert(0, "")
+    argv: tuple[str, ...]
+    ttl: float
+
+
+class _TokenPool(NamedTuple):
+    """Tokens to rotate between, with the weight of each."""
+
+    tokens: tuple[str, ...]
+    weights: tuple[int, ...]
+
+
+# A token, the command that prints it, or tokens to choose from.
+_Token = Union[str, _TokenCommand, _TokenPool]
+
+# Seconds to cache the output of token_command for if token_ttl isn't set.
+_DEFAULT_TOKEN_TTL = 900
+
+# Seconds a token from `tokens` is skipped for by cool_down_token().
+_DEFAULT_COOL_DOWN = 60.0
 
-    suffixes = ["", "/"]
 
-    keys = []
-    for prefix, portstr, suffix in product(prefixes, portstrs, suffixes):
-        keys.append(f"{prefix}{url.host}{portstr}{suffix}")
+class _PathTrie:
+    """Tokens for one origin keyed by path prefix, split into segments.
 
-    for key in keys:
+    The token at the root is for the host as a whole. A lookup walks the
+    segments of the URL path and returns the token of the deepest node that
+    has one, so it costs the same however many prefixes are configured.
+
+    A node is authoritative if its config table has `authoritative = true`,
+    which claims every URL under its prefix, with or without a token.
+    """
+
+    __slots__ = ("token", "authoritative", "children")
+
+    def __init__(self, token: _Token | None = None) -> None:
+        self.token = token
+        self.authoritative = False
+        self.children: dict[str, _PathTrie] = {}
+
+    def _node(self, segments: Iterable[str]) -> _PathTrie:
+        node = self
+        for segment in segments:
+            node = node.children.setdefault(segment, _PathTrie())
+        return node
+
+    def insert(self, segments: Iterable[str], token: _Token) -> None:
+        self._node(segments).token = token
+
+    def claim(self, segments: Iterable[str]) -> None:
+        self._node(segments).authoritative = True
+
+    def match(self, path: str) -> _Token | None:
+        """Return the token for the longest prefix of path."""
+        token = self.token
+        if not self.children:
+            return token
+
+        node = self
+        for segment in path.split("/"):
+            if not segment:
+                continue
+            child = node.children.get(segment)
+            if child is None:
+                break
+            node = child
+            if node.token is not None:
+                token = node.token
+        return token
+
+    def claims(self, path: str) -> bool:
+        """Return whether path is under an authoritative prefix."""
+        node = self
+        if node.authoritative:
+            return True
+        for segment in path.split("/"):
+            if not segment:
+                continue
+            child = node.children.get(segment)
+            if child is None:
+                return False
+            node = child
+            if node.authoritative:
+                return True
+        return False
+
+    def items(self) -> Iterator[tuple[str, _Token]]:
+        """Yields the path of each prefix that has a token, and the token."""
+        stack = [("", self)]
+        while stack:
+            path, node = stack.pop()
+            if node.token is not None:
+                yield path, node.token
+            for segment, child in node.children.items():
+                stack.append((f"{path}/{segment}", child))
+
+    def claimed(self) -> Iterator[str]:
+        """Yields the path of each authoritative prefix."""
+        stack = [("", self)]
+        while stack:
+            path, node = stack.pop()
+            if node.authoritative:
+                yield path
+            for segment, child in node.children.items():
+                stack.append((f"{path}/{segment}", child))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, _PathTrie):
+            return NotImplemented
+        return (
+            self.token == other.token
+            and self.authoritative == other.authoritative
+            and self.children == other.children
+        )
+
+    def __repr__(self) -> str:
+        claimed = sorted(self.claimed())
+        if claimed:
+            return f"_PathTrie({dict(self.items())!r}, claimed={claimed!r})"
+        return f"_PathTrie({dict(self.items())!r})"
+
+
+# Tokens from a single config file keyed by the origin they apply to.
+_ConfigIndex = dict[_Origin, _PathTrie]
+
+# Parsed config files keyed by file path.
+#
+# Lookups can run in several threads at once (without a GIL on free-threaded
+# builds), so the caches below are only changed by replacing whole entries,
+# and nothing they hold (including tries) is changed once it's in a cache.
+# Readers get either the old entry or the new one, never a partial update.
+_config_cache: dict[Path, tuple[_StatSignature, _ConfigIndex]] = {}
+
+# Held while a config file is read again, so that threads that find it changed
+# at the same time parse it once between them, without waiting for other
+# files.
+_reload_locks: dict[Path, threading.Lock] = {}
+
+# Matches the config keys we accept for a host:
+# - https://gitlab.com
+# - https://gitlab.com:443
+# - gitlab.com
+# - gitlab.com/
+# and for a path prefix on a host:
+# - https://gitlab.com/api/v4/projects/123
+# - gitlab.com/api/v4/projects/123/
+# The scheme defaults to https and the port to the default port for the scheme.
+# The pattern is compiled (and cached by re) when a config file is first
+# loaded rather than at import time.
+_CONFIG_KEY_PATTERN = (
+    r"(?:(?P<scheme>https?)://)?"
+    r"(?:\[(?P<ipv6>[^\]/]+)\]|(?P<host>[^:/\[\]]+))"
+    r"(?::(?P<port>[0-9]+))?"
+    r"(?P<path>(?:/[^/?#]+)*)"
+    r"(?P<slash>/?)"
+)
+
+
+# Tokens found by scanning config files that are too large to parse for a
+# single lookup, keyed by file path. Each file has the stat signature it had
+# when it was scanned and the tokens (or None) for each origin it was scanned
+# for, or None if it can't be scanned.
+_scanned_configs: dict[
+    Path, tuple[_StatSignature, dict[_Origin, _PathTrie | None] | None]
+] = {}
+
+# Config files at least this large are scanned for the origin being looked up
+# instead of being parsed, unless they are in the snapshot.
+_SCAN_MIN_SIZE = 64 * 1024
+
+# After this many different origins have been looked up in the same file, the
+# whole file is parsed.
+_MAX_SCANS_PER_FILE = 4
+
+# (st_mtime_ns, st_ino) of a directory.
+_DirSignature = tuple[int, int]
+
+# Config files that didn't exist, keyed by file path. Each one has the nearest
+# ancestor directory that did exist and its signature when the file was
+# found to be missing. Creating the file (or a missing directory on the way to
+# it) changes the signature, so as long as it matches, the file is still
+# missing and a single stat of a directory that exists is enough to tell.
+_missing_config_files: dict[Path, tuple[Path, _DirSignature]] = {}
+
+# Fragments in each fragment directory in order of highest to lowest
+# precedence, with the directory's signature (None if it doesn't exist) when
+# it was listed.
+_fragment_listings: dict[Path, tuple[_DirSignature | None, tuple[Path, ...]]] = {}
+
+# The listing of each fragment directory that its fragments were last loaded
+# for, their indexes, and the position, path and index of the fragments with a
+# key for each origin. Updated when a fragment is parsed again.
+_fragment_origins: dict[
+    Path,
+    tuple[
+        tuple[Path, ...],
+        tuple[_ConfigIndex, ...],
+        dict[_Origin, list[tuple[int, Path, _ConfigIndex]]],
+    ],
+] = {}
+
+# Directories modified this recently aren't used for _missing_config_files or
+# _fragment_listings, because a file created in the same timestamp tick
+# wouldn't change their modification time.
+_RACY_DIR_NS = 2_000_000_000
+
+# Whether the config snapshot exists (None if it hasn't been read yet in this
+# process), and whether _config_cache has changed since it was read.
+_snapshot_exists: bool | None = None
+_config_cache_changed = False
+
+
+def clear_config_cache() -> None:
+    """Forget all parsed config files and config directories so that they are
+    found and read again on the next lookup.
+    """
+    global _snapshot_exists, _config_cache_changed
+    _find_config_files.cache_clear()
+    _config_cache.clear()
+    _missing_config_files.clear()
+    _fragment_listings.clear()
+    _fragment_origins.clear()
+    _scanned_configs.clear()
+    _snapshot_exists = None
+    _config_cache_changed = False
+
+
+@contextmanager
+def _config_snapshot() -> Iterator[None]:
+    """Load parsed config files from the on-disk snapshot if it exists and
+    this process hasn't parsed them yet, and write back any changes.
+    """
+    global _snapshot_exists, _config_cache_changed
+    from . import _snapshot
+
+    if _snapshot_exists is None:
+        trace = _trace.current()
+        start = 0 if trace is None else trace.now()
+        entries = _snapshot.read(_snapshot.snapshot_path())
+        _snapshot_exists = entries is not None
+        if entries:
+            for file, entry in entries.items():
+                _config_cache.setdefault(file, entry)
+        if trace is not None:
+            trace.phase("snapshot_load", start)
+
+    yield
+
+    if _snapshot_exists and _config_cache_changed:
+        # Cleared first so that a change made by another thread while the
+        # snapshot is written is saved by its next lookup.
+        _config_cache_changed = False
+        snapshot_path = _snapshot.snapshot_path()
         try:
-            host_config = config[key]
-        except KeyError:
-            continue
+            _snapshot.write(snapshot_path, _live_config_cache())
+        except OSError:
+            log.warning("Unable to update %s", snapshot_path, exc_info=True)
+
+
+def _live_config_cache() -> dict[Path, tuple[_StatSignature, _ConfigIndex]]:
+    """Return the parsed config files that are still config files, for the
+    snapshot. Files that were deleted, fragments that are no longer listed in
+    their directory and files outside the current config directories are
+    left out, so that their tokens don't outlive them.
+    """
+    live = set()
+    for fragments_dir, file in _config_files():
+        live.add(file)
+        live.update(_list_fragments(fragments_dir))
+    return {
+        file: entry
+        for file, entry in _config_cache.copy().items()
+        if file in live and os.path.exists(file)
+    }
+
+
+def compile_config_snapshot() -> Path:
+    """Parse every config file and write the on-disk snapshot, which makes
+    lookups in new processes use it. Returns the snapshot path.
+    """
+    global _snapshot_exists, _config_cache_changed
+    from . import _snapshot
+
+    clear_config_cache()
+    for path in iter_config_paths():
+        for fragment in _list_fragments(path / CONFIG_FRAGMENTS_DIRNAME):
+            _load_config(fragment)
+        _load_config(path / CONFIG_FILENAME)
+
+    snapshot_path = _snapshot.snapshot_path()
+    _snapshot.write(snapshot_path, _config_cache.copy())
+    _snapshot_exists = True
+    _config_cache_changed = False
+    return snapshot_path
+
+
+def remove_config_snapshot() -> None:
+    """Remove the on-disk snapshot and forget all parsed config files."""
+    from . import _snapshot
+
+    _snapshot.remove(_snapshot.snapshot_path())
+    clear_config_cache()
+
+
+def _stat_signature(st: os.stat_result) -> _StatSignature:
+    return st.st_mtime_ns, st.st_size, st.st_ino
 
+
+def _parse_config_key(
+    key: str,
+) -> tuple[_Origin, tuple[str, ...], tuple[bool, bool, bool]] | None:
+    """Parse a config key into the origin and path segments it applies to and
+    its rank among the other spellings of the same origin and path (lower is
+    preferred).
+    """
+    match = re.fullmatch(_CONFIG_KEY_PATTERN, key)
+    if match is None:
+        return None
+
+    scheme = match["scheme"] or "https"
+    host = (match["ipv6"] or match["host"]).lower()
+    port = int(match["port"]) if match["port"] else _DEFAULT_PORTS[scheme]
+    if port > 65535:
+        return None
+
+    # Prefer an explicit scheme, then no port, then no trailing slash. Spellings
+    # with the same rank (i.e. differing in case only) keep the first one.
+    rank = (not match["scheme"], match["port"] is not None, bool(match["slash"]))
+    return (scheme, host, port), tuple(match["path"].split("/")[1:]), rank
+
+
+def _index_config(file: Path | str, config: dict[str, Any]) -> _ConfigIndex:
+    # The table used for each origin and path: the rank and key of its
+    # spelling, its token and whether it's authoritative. The preferred
+    # spelling's table is used as a whole, whichever order the keys are in.
+    tables: dict[
+        tuple[_Origin, tuple[str, ...]],
+        tuple[tuple[bool, bool, bool], str, _Token | None, bool],
+    ] = {}
+
+    for key, host_config in config.items():
         if not isinstance(host_config, dict):
             continue
 
-        try:
-            token = host_config["token"]
-        except KeyError:
+        token: _Token | None = host_config.get("token")
+        if not token or not isinstance(token, str):
+            token = _parse_token_pool(host_config) or _parse_token_command(host_config)
+        authoritative = host_config.get("authoritative") is True
+        if token is None and not authoritative:
             continue
 
-        if not token:
+        parsed = _parse_config_key(key)
+        if parsed is None:
             continue
+        origin, segments, rank = parsed
 
-        if isinstance(token, str):
-            return token
+        other = tables.get((origin, segments))
+        if other is not None:
+            other_rank, other_key = other[:2]
+            winner = key if rank < other_rank else other_key
+            log.warning(
+                "%s: %r and %r configure the same %s, using %r",
+                file,
+                other_key,
+                key,
+                "path" if segments else "host",
+                winner,
+            )
+            if winner != key:
+                continue
 
-    return None
+        tables[origin, segments] = rank, key, token, authoritative
 
+    index: _ConfigIndex = {}
+    for (origin, segments), (_, _, token, authoritative) in tables.items():
+        trie = index.get(origin)
+        if trie is None:
+            trie = index[origin] = _PathTrie()
+        if token is not None:
+            trie.insert(segments, token)
+        if authoritative:
+            trie.claim(segments)
+    return index
 
-def _load_ci_job_token(service: str) -> str | None:
-    url = _gitlab_url_from_service(service)
 
+def _parse_token_pool(host_config: dict[str, Any]) -> _TokenPool | None:
+    """Parse `tokens`, a list of tokens or of tables with a token and an
+    optional weight.
+    """
+    entries = host_config.get("tokens")
+    if not isinstance(entries, list) or not entries:
+        return None
+
+    tokens = []
+    weights = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            token = entry.get("token")
+            weight = entry.get("weight", 1)
+        else:
+            token, weight = entry, 1
+        if not token or not isinstance(token, str):
+            return None
+        if not isinstance(weight, int) or isinstance(weight, bool) or weight < 1:
+            return None
+        tokens.append(token)
+        weights.append(weight)
+    return _TokenPool(tuple(tokens), tuple(weights))
+
+
+def _parse_token_command(host_config: dict[str, Any]) -> _TokenCommand | None:
+    command = host_config.get("token_command")
+    if isinstance(command, str):
+        import shlex
+
+        argv = tuple(shlex.split(command))
+    elif isinstance(command, list) and all(isinstance(arg, str) for arg in command):
+        argv = tuple(command)
+    else:
+        return None
+    if not argv:
+        return None
+
+    ttl = host_config.get("token_ttl", _DEFAULT_TOKEN_TTL)
+    if not isinstance(ttl, (int, float)) or isinstance(ttl, bool):
+        ttl = _DEFAULT_TOKEN_TTL
+    return _TokenCommand(argv, ttl)
+
+
+def _match(index: _ConfigIndex, url: _ServiceURL) -> _Token | None:
+    """Return the token for the longest configured prefix of url."""
+    trie = index.get(url.origin)
+    return None if trie is None else trie.match(url.path)
+
+
+def _resolve_token(token: _Token | None) -> str | None:
+    """Return the token, running its command or choosing one from its pool if
+    it has one.
+    """
+    if token is None or isinstance(token, str):
+        return token
+
+    trace = _trace.current()
+    start = 0 if trace is None else trace.now()
+    if isinstance(token, _TokenPool):
+        from . import _token_pool
+
+        value: str | None = _token_pool.choose(token)
+        phase = "token_pool"
+    else:
+        from . import _token_command
+
+        value = _token_command.get(token)
+        phase = "token_command"
+    if trace is not None:
+        trace.phase(phase, start)
+    return value
+
+
+# Set to "cached" or "online" to skip tokens that are known to have expired or
+# been revoked (see _token_check).
+_TOKEN_CHECK_ENV_VAR = "KEYRING_GITLAB_PYPI_TOKEN_CHECK"
+
+
+def _check_token(token: str | None, url: _ServiceURL) -> str | None:
+    """Return the token, unless the token check policy finds that it has
+    expired or been revoked.
+    """
+    if not token:
+        return token
+    policy = os.environ.get(_TOKEN_CHECK_ENV_VAR)
+    if policy not in ("cached", "online"):
+        return token
+
+    from . import _token_check
+
+    trace = _trace.current()
+    start = 0 if trace is None else trace.now()
+    usable = _token_check.usable(url.origin, token, policy)
+    if trace is not None:
+        trace.phase("token_check", start)
+    return token if usable else None
+
+
+def _find_token(
+    index: _ConfigIndex, url: _ServiceURL, trace: _trace.Trace | None = None
+) -> str | None:
+    """Return the usable token for url in index. If trace is given, the time
+    spent matching keys is recorded in it.
+    """
+    start = 0 if trace is None else trace.now()
+    value = _match(index, url)
+    if trace is not None:
+        trace.phase("key_matching", start)
+    return _check_token(_resolve_token(value), url)
+
+
+def _is_authoritative(service: str) -> bool:
+    """Return whether a config file claims service with `authoritative = true`,
+    so that the answer for it is final.
+    """
+    url = _gitlab_url_from_service(service)
     if url is None:
+        return False
+    with _config_snapshot():
+        for _, index in _iter_configs(url.origin):
+            trie = index.get(url.origin)
+            if trie is not None and trie.claims(url.path):
+                return True
+    return False
+
+
+def _read_config(file: Path) -> tuple[_StatSignature, _ConfigIndex]:
+    if sys.version_info < (3, 11):
+        import tomli as tomllib
+    else:
+        import tomllib
+
+    trace = _trace.current()
+    with open(file, "rb") as f:
+        signature = _stat_signature(os.fstat(f.fileno()))
+        start = 0 if trace is None else trace.now()
+        try:
+            config = tomllib.load(f)
+        except tomllib.TOMLDecodeError:
+            if trace is not None:
+                trace.phase("toml_parse", start)
+                trace.parse_errors.add(file)
+            return signature, {}
+
+    if trace is None:
+        return signature, _index_config(file, config)
+
+    trace.phase("toml_parse", start)
+    start = trace.now()
+    index = _index_config(file, config)
+    trace.phase("config_index", start)
+    return signature, index
+
+
+def _load_config(file: Path, origin: _Origin | None = None) -> _ConfigIndex:
+    """Return the tokens in a config file, which is empty if the file doesn't
+    exist or is invalid.
+
+    Files are only read again if their stat signature has changed since they
+    were last parsed. If origin is given and the file is large, the result may
+    only contain the token for origin.
+    """
+    trace = _trace.current()
+    if trace is None:
+        return _load_config_untraced(file, origin)
+
+    start = trace.now()
+    parse_ns = trace.parse_ns()
+    cached = _config_cache.get(file)
+    missing = _missing_config_files.get(file)
+    index = _load_config_untraced(file, origin)
+    # Stat, open and read, excluding the parsing that _read_config records.
+    trace.phase("file_open", start + trace.parse_ns() - parse_ns)
+
+    if file in trace.parse_errors:
+        outcome = "parse_error"
+        from_cache = False
+    elif file not in _config_cache and file not in _scanned_configs:
+        outcome = "missing"
+        from_cache = missing is not None and _missing_config_files.get(file) is missing
+    else:
+        hit = any(_match(index, _ServiceURL(*url)) for url in trace.urls)
+        outcome = "hit" if hit else "miss"
+        from_cache = cached is not None and cached[1] is index
+    trace.file(file, outcome, cached=from_cache)
+    return index
+
+
+def _dir_signature(path: Path) -> _DirSignature | None:
+    try:
+        st = os.stat(path)
+    except OSError:
         return None
+    return st.st_mtime_ns, st.st_ino
 
-    if not os.getenv("GITLAB_CI"):
+
+def _remember_missing(file: Path) -> None:
+    for parent in file.parents:
+        try:
+            st = os.stat(parent)
+        except OSError:
+            continue
+        if time.time_ns() - st.st_mtime_ns >= _RACY_DIR_NS:
+            _missing_config_files[file] = parent, (st.st_mtime_ns, st.st_ino)
+        return
+
+
+def _load_config_untraced(file: Path, origin: _Origin | None) -> _ConfigIndex:
+    global _config_cache_changed
+
+    missing = _missing_config_files.get(file)
+    if missing is not None:
+        if _dir_signature(missing[0]) == missing[1]:
+            return {}
+        _missing_config_files.pop(file, None)
+
+    try:
+        signature = _stat_signature(os.stat(file))
+    except FileNotFoundError:
+        if _config_cache.pop(file, None) is not None:
+            _config_cache_changed = True
+        _scanned_configs.pop(file, None)
+        _remember_missing(file)
+        return {}
+
+    cached = _config_cache.get(file)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    # With a snapshot, parse the whole file so that it can be saved.
+    if origin is not None and signature[1] >= _SCAN_MIN_SIZE and not _snapshot_exists:
+        index = _scan_config(file, signature, origin)
+        if index is not None:
+            return index
+
+    lock = _reload_locks.get(file)
+    if lock is None:
+        lock = _reload_locks.setdefault(file, threading.Lock())
+    with lock:
+        # Another thread may have read the same version while this one waited.
+        cached = _config_cache.get(file)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        _config_cache_changed = True
+        try:
+            cached = _read_config(file)
+        except FileNotFoundError:
+            _config_cache.pop(file, None)
+            return {}
+
+        _config_cache[file] = cached
+        return cached[1]
+
+
+def _scan_config(
+    file: Path, signature: _StatSignature, origin: _Origin
+) -> _ConfigIndex | None:
+    """Return the token for origin in a config file as an index, or None if
+    the file needs to be parsed instead.
+    """
+    scanned = _scanned_configs.get(file)
+    if scanned is None or scanned[0] != signature:
+        scanned = _scanned_configs[file] = signature, {}
+
+    tokens = scanned[1]
+    if tokens is None or len(tokens) >= _MAX_SCANS_PER_FILE:
         return None
+    if origin in tokens:
+        trie = tokens[origin]
+        return {} if trie is None else {origin: trie}
+
+    from . import _scan
+
+    def wanted(key: str) -> bool:
+        # Only parse keys that could be a spelling of the host.
+        if origin[1] not in key.lower():
+            return False
+        parsed = _parse_config_key(key)
+        return parsed is not None and parsed[0] == origin
 
+    trace = _trace.current()
+    start = 0 if trace is None else trace.now()
     try:
-        ci_api_url = URL(os.environ["CI_API_V4_URL"])
-    except (KeyError, ValueError):
+        with open(file, "rb") as f:
+            if _stat_signature(os.fstat(f.fileno())) != signature:
+                # Changed since it was checked, so parse the current version.
+                return None
+            index = _index_config(file, _scan.scan(f, wanted))
+    except _scan.Unsupported:
+        _scanned_configs[file] = signature, None
         return None
+    except FileNotFoundError:
+        return None
+    finally:
+        if trace is not None:
+            trace.phase("toml_scan", start)
+
+    _scanned_configs[file] = signature, {**tokens, origin: index.get(origin)}
+    return index
+
 
+def _iter_configs(origin: _Origin | None = None) -> Iterator[tuple[Path, _ConfigIndex]]:
+    """Yields each config file and its tokens in order of highest to lowest
+    precedence.
+
+    If origin is given, large config files may only have the token for origin.
+    """
+    trace = _trace.current()
+    start = 0 if trace is None else trace.now()
+    files = _config_files()
+    if trace is not None:
+        trace.phase("path_discovery", start)
+
+    for fragments_dir, file in files:
+        yield from _iter_fragments(fragments_dir, origin)
+        yield file, _load_config(file, origin)
+
+
+def _list_fragments(directory: Path) -> tuple[Path, ...]:
+    """Return the fragments in a directory in order of highest to lowest
+    precedence, which is reverse order of file name.
+
+    The listing is only read again if the directory's signature has changed,
+    which happens when fragments are created, removed or renamed over. A new
+    tuple is returned when it is.
+    """
+    global _config_cache_changed
+
+    signature = _dir_signature(directory)
+    cached = _fragment_listings.get(directory)
     if (
-        url.scheme != ci_api_url.scheme
-        or url.host != ci_api_url.host
-        or url.port != ci_api_url.port
+        cached is not None
+        and cached[0] == signature
+        and (signature is None or time.time_ns() - signature[0] >= _RACY_DIR_NS)
     ):
+        return cached[1]
+
+    fragments: tuple[Path, ...] = ()
+    if signature is not None:
+        try:
+            with os.scandir(directory) as entries:
+                names = [
+                    entry.name
+                    for entry in entries
+                    if entry.name.endswith(".toml")
+                    and not entry.name.startswith(".")
+                    and entry.is_file()
+                ]
+        except OSError:
+            names = []
+        fragments = tuple(directory / name for name in sorted(names, reverse=True))
+
+    if cached is None or cached[1] != fragments:
+        # Forget removed fragments, which are no longer loaded to notice.
+        # They may have come from the snapshot rather than an earlier
+        # listing, so look for any in the cache.
+        listed = set(fragments)
+        for file in list(_config_cache):
+            if file.parent == directory and file not in listed:
+                if _config_cache.pop(file, None) is not None:
+                    _config_cache_changed = True
+    _fragment_listings[directory] = signature, fragments
+    return fragments
+
+
+def _load_fragment(fragment: Path) -> _ConfigIndex:
+    """Return the tokens in a fragment, like _load_config but with only a stat
+    if it hasn't changed.
+    """
+    cached = _config_cache.get(fragment)
+    if cached is not None:
+        try:
+            st = os.stat(fragment)
+        except OSError:
+            pass
+        else:
+            if _stat_signature(st) == cached[0]:
+                return cached[1]
+    return _load_config_untraced(fragment, None)
+
+
+def _iter_fragments(
+    directory: Path, origin: _Origin | None
+) -> Iterator[tuple[Path, _ConfigIndex]]:
+    """Yields each fragment in a directory and its tokens in order of highest
+    to lowest precedence.
+
+    If origin is given, only fragments with a key for origin are yielded, with
+    only that key, and only they are checked for changes, so that lookups
+    don't depend on how many fragments there are. Other fragments are checked
+    when the directory changes or when all fragments are iterated.
+    """
+    fragments = _list_fragments(directory)
+    if not fragments:
+        return
+
+    # Fragments are always parsed whole, since their origins are merged below.
+    load = _load_fragment if _trace.current() is None else _load_config
+    cached = _fragment_origins.get(directory)
+    if cached is None or cached[0] is not fragments:
+        indexes = tuple(map(load, fragments))
+        by_origin: dict[_Origin, list[tuple[int, Path, _ConfigIndex]]] = {}
+        for i, (fragment, index) in enumerate(zip(fragments, indexes)):
+            for key, trie in index.items():
+                by_origin.setdefault(key, []).append((i, fragment, {key: trie}))
+        _fragment_origins[directory] = fragments, indexes, by_origin
+    else:
+        _, indexes, by_origin = cached
+        if origin is None:
+            positions: Iterable[int] = range(len(fragments))
+        else:
+            positions = [i for i, _, _ in by_origin.get(origin, ())]
+        changed = {
+            i: index
+            for i in positions
+            if (index := load(fragments[i])) is not indexes[i]
+        }
+        if changed:
+            # Only the origins of changed fragments are updated, in a copy so
+            # that other threads' lookups aren't affected.
+            by_origin = by_origin.copy()
+            for i, index in changed.items():
+                for key in indexes[i].keys() | index.keys():
+                    entries = [
+                        entry for entry in by_origin.get(key, ()) if entry[0] != i
+                    ]
+                    if key in index:
+                        entries.append((i, fragments[i], {key: index[key]}))
+                        entries.sort(key=lambda entry: entry[0])
+                    if entries:
+                        by_origin[key] = entries
+                    else:
+                        by_origin.pop(key, None)
+            indexes = tuple(changed.get(i, index) for i, index in enumerate(indexes))
+            _fragment_origins[directory] = fragments, indexes, by_origin
+
+    if origin is None:
+        yield from zip(fragments, indexes)
+    else:
+        for _, fragment, index in by_origin.get(origin, ()):
+            yield fragment, index
+
+
+# Tokens from the environment, as whitespace- or comma-separated
+# `<config key>=<token>` entries, e.g.
+# "gitlab.example.com=glpat-abc https://gitlab.com/api/v4/projects/1=glpat-def".
+# They take precedence over every config file.
+_ENV_TOKENS_VAR = "KEYRING_GITLAB_PYPI_TOKENS"
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_env_tokens(value: str) -> _ConfigIndex:
+    """Index the entries in KEYRING_GITLAB_PYPI_TOKENS like a config file, so
+    keys are normalized and matched the same way.
+    """
+    config: dict[str, Any] = {}
+    for i, entry in enumerate(re.split(r"[\s,]+", value.strip()), 1):
+        key, sep, token = entry.partition("=")
+        if not sep or not key:
+            # The entry could be a token, so it isn't logged.
+            log.warning("%s: entry %d isn't <key>=<token>", _ENV_TOKENS_VAR, i)
+            continue
+        config[key] = {"token": token}
+    return _index_config(_ENV_TOKENS_VAR, config)
+
+
+def _env_tokens() -> _ConfigIndex | None:
+    """Return the tokens in KEYRING_GITLAB_PYPI_TOKENS, if it is set.
+
+    It is only parsed again when its value changes.
+    """
+    value = os.environ.get(_ENV_TOKENS_VAR)
+    return _parse_env_tokens(value) if value else None
+
+
+def _env_token(url: _ServiceURL) -> str | None:
+    trace = _trace.current()
+    start = 0 if trace is None else trace.now()
+    index = _env_tokens()
+    token = None if index is None else _find_token(index, url)
+    if trace is not None:
+        trace.phase("env_tokens", start)
+        if token:
+            trace.found("env")
+    return token
+
+
+def _ci_job_token() -> tuple[_Origin, str] | None:
+    """Return the origin of the GitLab instance running the current CI job and
+    the job token, if any.
+    """
+    if not os.getenv("GITLAB_CI"):
+        return None
+
+    try:
+        ci_api_url = _parse_ci_api_url(os.environ["CI_API_V4_URL"])
+    except KeyError:
+        return None
+
+    if ci_api_url is None:
         return None
 
     token = os.getenv("CI_JOB_TOKEN")
@@ -166,38 +1171,120 @@ def _load_ci_job_token(service: str) -> str | None:
     if not token:
         return None
 
-    return token
+    return ci_api_url.origin, token
+
 
+def _traced_ci_job_token() -> tuple[_Origin, str] | None:
+    trace = _trace.current()
+    if trace is None:
+        return _ci_job_token()
 
-class GitlabPypi(KeyringBackend):
-    priority = 9  # type: ignore[assignment]
+    start = trace.now()
+    ci_job_token = _ci_job_token()
+    trace.phase("ci_env_check", start)
+    return ci_job_token
 
-    if TYPE_CHECKING:
 
-        def __init__(self) -> None: ...
+def _load_ci_job_token(service: str) -> str | None:
+    url = _trace_service(service)
+
+    if url is None:
+        return None
 
-    def get_password(self, service: str, username: str) -> str | None:
-        if username == "__token__":
-            return _load_access_token(service)
-        elif username == "gitlab-ci-token":
-            return _load_ci_job_token(service)
+    ci_job_token = _traced_ci_job_token()
 
+    if ci_job_token is None or ci_job_token[0] != url.origin:
         return None
 
-    def set_password(self, service: str, username: str, password: str) -> None:
-        raise NotImplementedError
+    if (trace := _trace.current()) is not None:
+        trace.found("ci")
+    return ci_job_token[1]
 
-    def delete_password(self, service: str, username: str) -> None:
-        raise NotImplementedError
 
-    def get_credential(
-        self,
-        service: str,
-        username: str | None,
-    ) -> SimpleCredential | None:
-        if token := _load_access_token(service):
-            return SimpleCredential("__token__", token)
-        elif token := _load_ci_job_token(service):
-            return SimpleCredential("gitlab-ci-token", token)
+def _load_password(service: str, username: str) -> str | None:
+    if username == "__token__":
+        return _load_access_token(service)
+    elif username == "gitlab-ci-token":
+        return _load_ci_job_token(service)
 
-        return None
+    return None
+
+
+def _load_credential(service: str) -> tuple[str, str] | None:
+    """Return the (username, token) for a service."""
+    if token := _load_access_token(service):
+        return "__token__", token
+    elif token := _load_ci_job_token(service):
+        return "gitlab-ci-token", token
+
+    return None
+
+
+def _get_password(service: str, username: str) -> str | None:
+    """Like `_load_password`, but traced if tracing is enabled."""
+    if _trace.enabled():
+        with _trace.lookup("get_password", [service], username):
+            return _load_password(service, username)
+    return _load_password(service, username)
+
+
+def _get_credential(service: str, username: str | None) -> tuple[str, str] | None:
+    """Like `_load_credential`, but traced if tracing is enabled."""
+    if _trace.enabled():
+        with _trace.lookup("get_credential", [service], username):
+            return _load_credential(service)
+    return _load_credential(service)
+
+
+def _load_credentials(
+    services: Iterable[str],
+) -> dict[str, tuple[str, str] | None]:
+    """Return the (username, token) for each service."""
+    urls = {service: _trace_service(service) for service in services}
+
+    credentials: dict[_ServiceURL, tuple[str, str] | None] = {}
+    for url in set(urls.values()):
+        if url is not None and (token := _env_token(url)):
+            credentials[url] = "__token__", token
+    remaining = {url for url in urls.values() if url is not None} - credentials.keys()
+    if remaining:
+        with _config_snapshot():
+            configs = list(_iter_configs())
+        ci_job_token = _traced_ci_job_token()
+
+    trace = _trace.current()
+    for url in remaining:
+        credentials[url] = None
+        for file, index in configs:
+            if token := _find_token(index, url):
+                credentials[url] = "__token__", token
+                if trace is not None:
+                    trace.found("config", file)
+                break
+        else:
+            if ci_job_token is not None and ci_job_token[0] == url.origin:
+                credentials[url] = "gitlab-ci-token", ci_job_token[1]
+                if trace is not None:
+                    trace.found("ci")
+
+    return {
+        service: None if url is None else credentials[url]
+        for service, url in urls.items()
+    }
+
+
+def cool_down_token(token: str, seconds: float = _DEFAULT_COOL_DOWN) -> None:
+    """Skip a token listed in `tokens` for the next seconds, e.g. after a
+    request with it was rate limited.
+    """
+    from . import _token_pool
+
+    _token_pool.cool_down(token, seconds)
+
+
+def __getattr__(name: str) -> Any:
+    if name == "GitlabPypi":
+        from .backend import GitlabPypi
+
+        return GitlabPypi
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
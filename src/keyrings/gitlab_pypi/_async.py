@@ -0,0 +1,96 @@
+"""Looking up credentials from asyncio code, with the parts that touch the
+filesystem in the event loop's default executor."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from collections.abc import Iterable
+from pathlib import Path
+
+from . import (
+    _TOKEN_CHECK_ENV_VAR,
+    _ci_job_token,
+    _config_snapshot,
+    _ConfigIndex,
+    _env_tokens,
+    _find_token,
+    _gitlab_url_from_service,
+    _iter_configs,
+    _match,
+    _ServiceURL,
+)
+
+# Loads of the config files running in an executor, keyed by event loop.
+_pending: dict[
+    asyncio.AbstractEventLoop, asyncio.Future[list[tuple[Path, _ConfigIndex]]]
+] = {}
+
+
+def _load_configs() -> list[tuple[Path, _ConfigIndex]]:
+    with _config_snapshot():
+        return list(_iter_configs())
+
+
+async def _configs() -> list[tuple[Path, _ConfigIndex]]:
+    """Return each config file and its tokens in order of highest to lowest
+    precedence, loading them in the executor or waiting for the load in
+    progress.
+    """
+    loop = asyncio.get_running_loop()
+    future = _pending.get(loop)
+    if future is None:
+        future = loop.run_in_executor(None, _load_configs)
+        _pending[loop] = future
+        future.add_done_callback(lambda _: _pending.pop(loop, None))
+    # Cancelling one lookup mustn't cancel the load for the others.
+    return await asyncio.shield(future)
+
+
+async def _afind_token(index: _ConfigIndex, url: _ServiceURL) -> str | None:
+    value = _match(index, url)
+    if value is None:
+        return None
+    if isinstance(value, str) and os.environ.get(_TOKEN_CHECK_ENV_VAR) not in (
+        "cached",
+        "online",
+    ):
+        return value
+    # Running a token command, choosing from a pool (which locks a file) and
+    # checking a token all block.
+    return await asyncio.to_thread(_find_token, index, url)
+
+
+async def load_credentials(
+    services: Iterable[str], *, ci: bool = True
+) -> dict[str, tuple[str, str] | None]:
+    """Return the (username, token) for each service, like _load_credentials.
+
+    If ci is false, the CI job token isn't used.
+    """
+    urls = {service: _gitlab_url_from_service(service) for service in services}
+
+    credentials: dict[_ServiceURL, tuple[str, str] | None] = {}
+    if (env_index := _env_tokens()) is not None:
+        for url in set(urls.values()):
+            if url is not None and (token := await _afind_token(env_index, url)):
+                credentials[url] = "__token__", token
+    remaining = {url for url in urls.values() if url is not None} - credentials.keys()
+    if remaining:
+        configs = await _configs()
+        ci_job_token = _ci_job_token() if ci else None
+
+    for url in remaining:
+        credentials[url] = None
+        for _, index in configs:
+            if token := await _afind_token(index, url):
+                credentials[url] = "__token__", token
+                break
+        else:
+            if ci_job_token is not None and ci_job_token[0] == url.origin:
+                credentials[url] = "gitlab-ci-token", ci_job_token[1]
+
+    return {
+        service: None if url is None else credentials[url]
+        for service, url in urls.items()
+    }
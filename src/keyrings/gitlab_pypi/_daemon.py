@@ -0,0 +1,332 @@
+"""Local credential daemon that answers `keyring-gitlab-pypi get` over a Unix
+domain socket.
+
+The protocol is one tab-separated line per request and response:
+
+    GET <config key> <username> <service>
+    OK <username> <password>
+    NONE
+    ERROR <message>
+
+The config key identifies the config files that the client would read and
+its KEYRING_GITLAB_PYPI_TOKEN_CHECK policy (see `config_key`). The daemon
+answers ERROR if they aren't its own, so that the client looks the token up
+itself. An empty username asks for credentials with any username, like
+`keyring --mode creds get`.
+"""
+
+from __future__ import annotations
+
+import os
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import warnings
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+from . import (
+    _TOKEN_CHECK_ENV_VAR,
+    CONFIG_APPNAME,
+    CONFIG_FRAGMENTS_DIRNAME,
+    _config_files,
+    _files,
+    _find_token,
+    _gitlab_url_from_service,
+    _iter_configs,
+    iter_config_paths,
+    log,
+)
+
+if TYPE_CHECKING:
+    from . import _ConfigIndex
+
+SOCKET_FILENAME = "daemon.sock"
+
+# Longest request line the daemon reads; service URLs are much shorter.
+MAX_LINE = 64 * 1024
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def socket_path() -> Path:
+    import platformdirs
+
+    with warnings.catch_warnings():
+        # Newer versions of platformdirs warn if XDG_RUNTIME_DIR isn't set and
+        # they fall back to a directory in /tmp. That's fine here: the socket
+        # is only trusted if it belongs to the current user.
+        warnings.simplefilter("ignore")
+        runtime_path = platformdirs.user_runtime_path(CONFIG_APPNAME, appauthor=False)
+    return runtime_path / SOCKET_FILENAME
+
+
+def config_key() -> str:
+    """Return a key for the config files that this process reads and how it
+    checks tokens, which depend on its environment.
+    """
+    files = [os.fspath(file) for _, file in _config_files()]
+    return _files.key([*files, os.environ.get(_TOKEN_CHECK_ENV_VAR)])
+
+
+class _State(NamedTuple):
+    # Tokens from each config file in order of highest to lowest precedence.
+    indexes: tuple[_ConfigIndex, ...]
+
+
+class Resolver:
+    """Answers lookups from an immutable snapshot of the config files, which
+    is replaced as a whole when they are reloaded.
+    """
+
+    def __init__(self) -> None:
+        self.config_key = config_key()
+        self._state = _State(())
+        self.reload()
+
+    def reload(self) -> None:
+        # Only files whose stat signature changed are parsed again.
+        self._state = _State(tuple(index for _, index in _iter_configs()))
+
+    def lookup(self, service: str, username: str | None) -> tuple[str, str] | None:
+        """Return the username and password for a service, like `get_password`
+        if username is given, or `get_credential` otherwise, but without the
+        CI job token.
+        """
+        url = _gitlab_url_from_service(service)
+        if url is None:
+            return None
+
+        state = self._state
+        if username is None or username == "__token__":
+            for index in state.indexes:
+                if token := _find_token(index, url):
+                    return "__token__", token
+        return None
+
+    def handle(self, line: str) -> str:
+        fields = line.rstrip("\n").split("\t", 3)
+        if len(fields) != 4 or fields[0] != "GET":
+            return "ERROR\tinvalid request\n"
+
+        _, key, username, service = fields
+        if key != self.config_key:
+            return "ERROR\tdifferent config files or token check\n"
+
+        credential = self.lookup(service, username or None)
+        if credential is None:
+            return "NONE\n"
+        if "\n" in credential[1]:
+            # The client looks it up itself instead.
+            return "ERROR\tpassword can't be sent\n"
+        return "OK\t{}\t{}\n".format(*credential)
+
+
+def _peer_uid(sock: socket.socket) -> int | None:
+    """Return the user ID of the process on the other end of the socket, or
+    None if the platform doesn't tell us.
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    uid: int = struct.unpack("3i", creds)[1]
+    return uid
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: Server
+
+    def handle(self) -> None:
+        uid = _peer_uid(self.connection)
+        if uid is not None and uid != os.getuid():
+            log.warning("Rejected connection from user %d", uid)
+            return
+
+        while line := self.rfile.readline(MAX_LINE):
+            try:
+                request = line.decode()
+            except UnicodeDecodeError:
+                response = "ERROR\tinvalid request\n"
+            else:
+                response = self.server.resolver.handle(request)
+            self.wfile.write(response.encode())
+
+
+# socketserver.UnixStreamServer only exists where Unix domain sockets do, so
+# that the module can still be imported on Windows without them.
+if hasattr(socket, "AF_UNIX"):
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = socket.SOMAXCONN
+
+        def __init__(self, path: Path, resolver: Resolver) -> None:
+            self.resolver = resolver
+            path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            _remove_stale_socket(path)
+            self.path = path
+            super().__init__(os.fspath(path), _Handler)
+
+        def server_bind(self) -> None:
+            super().server_bind()
+            # Connections are refused until the server listens, so no other
+            # user can connect before the mode is changed.
+            os.chmod(self.path, 0o600)
+
+        def server_close(self) -> None:
+            super().server_close()
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _remove_stale_socket(path: Path) -> None:
+    """Remove a socket left behind by a daemon that didn't exit cleanly, or
+    raise an error if a daemon is still listening on it.
+    """
+    if not path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(os.fspath(path))
+        except ConnectionRefusedError:
+            path.unlink()
+            return
+    raise RuntimeError(f"A daemon is already listening on {path}")
+
+
+def _config_dirs() -> list[Path]:
+    """Return the config directories and fragment directories that exist."""
+    dirs = []
+    for path in iter_config_paths():
+        for directory in (path, path / CONFIG_FRAGMENTS_DIRNAME):
+            if directory.is_dir():
+                dirs.append(directory)
+    return dirs
+
+
+@contextmanager
+def _inotify(dirs: list[Path]) -> Iterator[int | None]:
+    """Yield an inotify file descriptor watching dirs, or None if inotify isn't
+    available.
+    """
+    if sys.platform != "linux":
+        yield None
+        return
+
+    import ctypes
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        yield None
+        return
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_CLOEXEC = os.O_CLOEXEC
+    mask = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+    )
+
+    fd = inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        yield None
+        return
+    try:
+        for path in dirs:
+            # Changes to other files in /etc also wake us up, but reloading
+            # only stats the config files.
+            inotify_add_watch(fd, os.fsencode(path), mask)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def watch(resolver: Resolver, stop: threading.Event, poll_interval: float) -> None:
+    """Reload the config files when they change until stop is set.
+
+    With inotify, the directories are also checked every poll_interval, which
+    catches config directories that are created later.
+    """
+    while not stop.is_set():
+        dirs = _config_dirs()
+        with _inotify(dirs) as fd:
+            while not stop.is_set():
+                if fd is None:
+                    stop.wait(poll_interval)
+                else:
+                    ready, _, _ = select.select([fd], [], [], poll_interval)
+                    if ready:
+                        # Drain the events, they only tell us to reload.
+                        os.read(fd, 64 * 1024)
+                resolver.reload()
+                if _config_dirs() != dirs:
+                    break
+
+
+def serve(path: Path, poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+    resolver = Resolver()
+    stop = threading.Event()
+    watcher = threading.Thread(
+        target=watch, args=(resolver, stop, poll_interval), daemon=True
+    )
+    with Server(path, resolver) as server:
+        watcher.start()
+        log.info("Listening on %s", path)
+        try:
+            server.serve_forever()
+        finally:
+            stop.set()
+
+
+def request(
+    path: Path, service: str, username: str | None, timeout: float = 1.0
+) -> tuple[str, str] | None:
+    """Ask the daemon listening on path for credentials.
+
+    Raises OSError if the daemon isn't running, doesn't answer or reads
+    different config files or checks tokens differently, and ValueError if the request can't be represented in the protocol.
+    """
+    if any(c in field for field in (service, username or "") for c in "\t\n"):
+        raise ValueError("service and username can't contain tabs or newlines")
+    # The socket could be in a shared directory like /tmp, so make sure that
+    # it belongs to us before trusting its answers.
+    if sys.platform != "win32" and os.stat(path).st_uid != os.getuid():
+        raise PermissionError(f"{path} belongs to another user")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(os.fspath(path))
+        line = f"GET\t{config_key()}\t{username or ''}\t{service}\n"
+        sock.sendall(line.encode())
+        with sock.makefile("rb") as f:
+            response = f.readline(MAX_LINE).decode()
+
+    status, _, rest = response.rstrip("\n").partition("\t")
+    if status == "OK":
+        username, _, password = rest.partition("\t")
+        return username, password
+    elif status == "NONE":
+        return None
+    raise OSError(f"Unexpected response from daemon: {response!r}")
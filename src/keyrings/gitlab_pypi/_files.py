@@ -0,0 +1,120 @@
+"""Locked JSON state files and atomically replaced files shared by the
+processes that look up tokens."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any
+
+from . import log
+
+# Serialises access to each state file by threads of this process.
+_thread_locks: dict[Path, threading.Lock] = {}
+_thread_locks_lock = threading.Lock()
+
+
+def is_private(st: os.stat_result) -> bool:
+    """Check that a file can only have been written by the current user, since
+    its contents determine which token is sent to which host.
+    """
+    if sys.platform == "win32":
+        return True
+    return st.st_uid == os.getuid() and st.st_mode & 0o077 == 0
+
+
+def atomic_write(
+    path: Path, text: str, *, mode: int = 0o600, fsync: bool = False
+) -> None:
+    """Replace a file with one containing text, so that readers see either
+    the old or the new contents.
+
+    The temporary file is hidden and doesn't end with the file's suffix, so
+    readers that pick files by name skip it. If fsync is true, its contents
+    are flushed to disk before it replaces the file.
+    """
+    # mkstemp creates the file with mode 0600.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mode != 0o600:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def key(value: object) -> str:
+    """Return a state key for a token or command, which doesn't reveal it."""
+    return hashlib.sha256(json.dumps(value).encode()).hexdigest()
+
+
+@contextmanager
+def locked(
+    path: Path, *, exclusive: bool, mode: int | None = None
+) -> Iterator[IO[str]]:
+    """Open a state file with a shared or exclusive lock, held until the block
+    exits.
+
+    If mode is given, the file is opened for reading and writing and created
+    with that mode if it doesn't exist. Otherwise it must exist, and is only
+    opened for reading.
+    """
+    import fcntl
+
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(path, threading.Lock())
+    with thread_lock:
+        if mode is None:
+            fd = os.open(path, os.O_RDONLY)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, mode)
+        with open(fd, "r" if mode is None else "r+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield f
+
+
+@contextmanager
+def locked_private(path: Path, *, exclusive: bool) -> Iterator[IO[str] | None]:
+    """Like `locked`, but create the file and its directory so that only the
+    current user can access them.
+
+    Yields None if the file isn't private to the current user, in which case
+    it isn't trusted or written to.
+    """
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with locked(path, exclusive=exclusive, mode=0o600) as f:
+        if is_private(os.fstat(f.fileno())):
+            yield f
+        else:
+            log.warning("Not using %s, which other users can access", path)
+            yield None
+
+
+def read(f: IO[str]) -> Any:
+    """Return the contents of a state file, or None if they aren't JSON."""
+    f.seek(0)
+    try:
+        return json.load(f)
+    except ValueError:
+        return None
+
+
+def write(f: IO[str], data: Any) -> None:
+    """Replace the contents of a state file."""
+    f.seek(0)
+    f.truncate()
+    json.dump(data, f, separators=(",", ":"))
+    f.flush()
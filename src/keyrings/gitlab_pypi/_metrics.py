@@ -0,0 +1,225 @@
+"""Counting lookups in a state file (KEYRING_GITLAB_PYPI_METRICS) and rendering
+them in node-exporter textfile format."""
+
+from __future__ import annotations
+
+import os
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any
+
+from . import _files, _trace
+
+ENV_VAR = _trace.METRICS_ENV_VAR
+
+STATE_VERSION = 1
+
+# Upper bounds of the lookup duration histogram buckets, in seconds.
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+SOURCES = ("env", "config", "ci", "miss")
+
+PREFIX = "keyring_gitlab_pypi"
+
+
+class _State:
+    """Totals of every lookup recorded in a state file."""
+
+    __slots__ = ("durations", "parse_errors", "missing_files", "cache")
+
+    def __init__(self) -> None:
+        # Per source: the count in each bucket (the last one is +Inf), and
+        # the sum of the durations.
+        self.durations: dict[str, tuple[list[int], float]] = {}
+        self.parse_errors: dict[str, int] = {}
+        self.missing_files: dict[str, int] = {}
+        # Config file loads answered from the cache, and ones that weren't.
+        self.cache = {"hit": 0, "miss": 0}
+
+    @classmethod
+    def load(cls, data: Any) -> _State:
+        state = cls()
+        try:
+            if data["version"] != STATE_VERSION:
+                return state
+            for source, (counts, total) in data["durations"].items():
+                counts = [int(count) for count in counts]
+                if len(counts) != len(BUCKETS) + 1:
+                    return cls()
+                state.durations[str(source)] = counts, float(total)
+            for path, count in data["parse_errors"].items():
+                state.parse_errors[str(path)] = int(count)
+            for path, count in data["missing_files"].items():
+                state.missing_files[str(path)] = int(count)
+            state.cache = {
+                "hit": int(data["cache"]["hit"]),
+                "miss": int(data["cache"]["miss"]),
+            }
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return cls()
+        return state
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            "version": STATE_VERSION,
+            "durations": {
+                source: [counts, total]
+                for source, (counts, total) in self.durations.items()
+            },
+            "parse_errors": self.parse_errors,
+            "missing_files": self.missing_files,
+            "cache": self.cache,
+        }
+
+    def add(self, record: dict[str, Any]) -> None:
+        """Add a lookup, given its trace record."""
+        source = record["source"] or "miss"
+        seconds = record["duration_us"] / 1e6
+        counts, total = self.durations.get(source, ([0] * (len(BUCKETS) + 1), 0.0))
+        bucket = next(
+            (i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS)
+        )
+        counts[bucket] += 1
+        self.durations[source] = counts, total + seconds
+
+        for file in record["files"]:
+            path = file["path"]
+            if file["outcome"] == "parse_error":
+                self.parse_errors[path] = self.parse_errors.get(path, 0) + 1
+            elif file["outcome"] == "missing":
+                self.missing_files[path] = self.missing_files.get(path, 0) + 1
+            self.cache["hit" if file["cached"] else "miss"] += 1
+
+
+def record(record: dict[str, Any]) -> None:
+    """Add a lookup to the state file named by KEYRING_GITLAB_PYPI_METRICS."""
+    path = os.environ.get(ENV_VAR)
+    if not path or sys.platform == "win32":
+        return
+
+    from . import log
+
+    try:
+        with _locked_state(Path(path), exclusive=True) as (f, state):
+            state.add(record)
+            _files.write(f, state.dump())
+    except OSError:
+        log.warning("Unable to update metrics in %s", path, exc_info=True)
+
+
+def load(path: Path) -> _State:
+    """Return the totals in a state file, which are empty if it doesn't
+    exist.
+    """
+    if sys.platform == "win32":
+        return _State()
+    try:
+        with _locked_state(path, exclusive=False) as (_, state):
+            return state
+    except FileNotFoundError:
+        return _State()
+
+
+@contextmanager
+def _locked_state(path: Path, *, exclusive: bool) -> Iterator[tuple[IO[str], _State]]:
+    """Open the state file locked, creating it if exclusive is true, and yield
+    it with its state.
+    """
+    with _files.locked(
+        path, exclusive=exclusive, mode=0o644 if exclusive else None
+    ) as f:
+        yield f, _State.load(_files.read(f))
+
+
+def _label(value: str) -> str:
+    """Escape a label value for the text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(state: _State) -> str:
+    """Return the totals in the Prometheus text format."""
+    lines = [
+        f"# HELP {PREFIX}_lookup_duration_seconds Time taken by credential "
+        "lookups, by where the credential came from.",
+        f"# TYPE {PREFIX}_lookup_duration_seconds histogram",
+    ]
+    for source in sorted(state.durations, key=_source_order):
+        counts, total = state.durations[source]
+        cumulative = 0
+        for bound, count in zip((*map(repr, BUCKETS), "+Inf"), counts):
+            cumulative += count
+            lines.append(
+                f"{PREFIX}_lookup_duration_seconds_bucket"
+                f'{{source="{_label(source)}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(
+            f'{PREFIX}_lookup_duration_seconds_sum{{source="{_label(source)}"}} '
+            f"{total!r}"
+        )
+        lines.append(
+            f'{PREFIX}_lookup_duration_seconds_count{{source="{_label(source)}"}} '
+            f"{cumulative}"
+        )
+
+    for name, help_text, per_path in [
+        (
+            "config_parse_errors_total",
+            "Times a config file couldn't be parsed.",
+            state.parse_errors,
+        ),
+        (
+            "config_missing_total",
+            "Lookups that found a config file missing.",
+            state.missing_files,
+        ),
+    ]:
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        for path, count in sorted(per_path.items()):
+            lines.append(f'{PREFIX}_{name}{{path="{_label(path)}"}} {count}')
+
+    lines.append(
+        f"# HELP {PREFIX}_config_cache_total Config file loads, by whether they "
+        "were answered from the cache."
+    )
+    lines.append(f"# TYPE {PREFIX}_config_cache_total counter")
+    for result in ("hit", "miss"):
+        lines.append(
+            f'{PREFIX}_config_cache_total{{result="{result}"}} {state.cache[result]}'
+        )
+    loads = state.cache["hit"] + state.cache["miss"]
+    ratio = state.cache["hit"] / loads if loads else 0.0
+    lines.append(
+        f"# HELP {PREFIX}_config_cache_hit_ratio Fraction of config file loads "
+        "answered from the cache."
+    )
+    lines.append(f"# TYPE {PREFIX}_config_cache_hit_ratio gauge")
+    lines.append(f"{PREFIX}_config_cache_hit_ratio {ratio!r}")
+    return "\n".join(lines) + "\n"
+
+
+def _source_order(source: str) -> tuple[int, str]:
+    return (SOURCES.index(source) if source in SOURCES else len(SOURCES), source)
+
+
+def write_textfile(path: Path, text: str) -> None:
+    """Atomically replace a file in node-exporter's textfile directory, which
+    it may read at any time.
+    """
+    _files.atomic_write(path, text, mode=0o644)
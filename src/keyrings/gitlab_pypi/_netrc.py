@@ -0,0 +1,143 @@
+"""Writing credentials for GitLab package indexes to a netrc file.
+
+uv reads netrc files itself, so with the credentials written there it doesn't
+need to start a keyring process for each index. `keyring-gitlab-pypi netrc`
+resolves the index URLs like `GitlabPypi.get_credentials` and keeps them in a
+block of the netrc file between two marker comments. Anything outside the
+block is left alone.
+
+The file is replaced atomically with one only the current user can read, and
+only if its contents would change.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+
+from . import _files, _parse_url, log
+
+BEGIN = "# BEGIN keyring-gitlab-pypi"
+END = "# END keyring-gitlab-pypi"
+
+
+def default_path() -> Path:
+    """Return the netrc file that uv reads."""
+    if path := os.environ.get("NETRC"):
+        return Path(path)
+    return Path("~/.netrc").expanduser()
+
+
+def index_urls(directory: Path) -> list[str]:
+    """Return the URLs of the `[[tool.uv.index]]` tables in pyproject.toml and
+    the `[[index]]` tables in uv.toml in a directory.
+    """
+    if sys.version_info < (3, 11):
+        import tomli as tomllib
+    else:
+        import tomllib
+
+    urls = []
+    for filename, keys in [("uv.toml", ()), ("pyproject.toml", ("tool", "uv"))]:
+        path = directory / filename
+        try:
+            with open(path, "rb") as f:
+                config = tomllib.load(f)
+        except FileNotFoundError:
+            continue
+        except tomllib.TOMLDecodeError:
+            log.warning("Unable to parse %s", path)
+            continue
+        # uv rejects files where these have the wrong types, and so do we.
+        try:
+            for key in keys:
+                config = config.get(key, {})
+            urls += [
+                index["url"]
+                for index in config.get("index", [])
+                if isinstance(index.get("url"), str)
+            ]
+        except (AttributeError, TypeError):
+            log.warning("Unable to parse %s", path)
+    return urls
+
+
+def machines(
+    credentials: Mapping[str, tuple[str, str] | None],
+) -> dict[str, tuple[str, str]]:
+    """Return the login and password for each host.
+
+    netrc entries only have a host, so if URLs on the same host have different
+    credentials (because of their port or a path-prefix key), the first one
+    is used.
+    """
+    entries: dict[str, tuple[str, str]] = {}
+    for service, credential in credentials.items():
+        url = _parse_url(service)
+        if credential is None or url is None:
+            continue
+        # netrc has no quoting, so these would split the entry.
+        if any(c.isspace() or c in "\"'#" for c in url.host + "".join(credential)):
+            log.warning("Can't write the credentials for %s to a netrc file", url.host)
+            continue
+        other = entries.setdefault(url.host, credential)
+        if other != credential:
+            log.warning(
+                "Different credentials for %s, only the first is written", url.host
+            )
+    return entries
+
+
+def render_block(entries: Mapping[str, tuple[str, str]]) -> str:
+    lines = [BEGIN]
+    for host, (login, password) in sorted(entries.items()):
+        lines.append(f"machine {host} login {login} password {password}")
+    lines.append(END)
+    return "\n".join(lines) + "\n"
+
+
+def replace_block(content: str, block: str) -> str:
+    """Replace the block in the contents of a netrc file, or append it."""
+    start = content.find(BEGIN + "\n")
+    end = content.find(END + "\n", start)
+    if start != -1 and end != -1:
+        return content[:start] + block + content[end + len(END) + 1 :]
+    if content and not content.endswith("\n"):
+        content += "\n"
+    return content + block
+
+
+def update(path: Path, entries: Mapping[str, tuple[str, str]]) -> bool:
+    """Write the entries to a netrc file, and return whether it changed."""
+    try:
+        content = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        content = ""
+
+    new_content = replace_block(content, render_block(entries))
+    if new_content == content:
+        return False
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _files.atomic_write(path, new_content, fsync=True)
+    return True
+
+
+def sync(path: Path, services: Iterable[str]) -> tuple[bool, list[str]]:
+    """Write credentials for services to a netrc file.
+
+    Returns whether the file changed and the services that are GitLab package
+    indexes but have no credentials.
+    """
+    from . import _gitlab_url_from_service, _load_credentials
+
+    services = list(dict.fromkeys(services))
+    credentials = _load_credentials(services)
+    missing = [
+        service
+        for service, credential in credentials.items()
+        if credential is None and _gitlab_url_from_service(service) is not None
+    ]
+    return update(path, machines(credentials)), missing
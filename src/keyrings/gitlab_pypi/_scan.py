@@ -0,0 +1,130 @@
+"""Targeted scan of large config files.
+
+Config files generated from an inventory can have thousands of host tables,
+but a lookup only needs one of them. Instead of parsing the whole document
+with tomllib, `scan` reads the file line by line and only decodes the tables
+whose header the caller asks for.
+
+The scanner only accepts a subset of TOML that it can check completely
+without building the document: single-line comments, single (not dotted)
+keys, table headers, and values that are single-line strings without unicode
+escapes, integers or booleans, all in ASCII. Together with checking for
+duplicate tables and keys, this means that every file it accepts is valid
+TOML, so the result is the same as parsing it. Anything else raises
+`Unsupported`, and the caller parses the whole file instead.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Callable
+from typing import IO, Any
+
+
+class Unsupported(Exception):
+    """The file uses TOML the scanner doesn't handle."""
+
+
+_PARTS = {
+    b"ws": rb"[ \t]*",
+    b"comment": rb"(?:#[\t\x20-\x7e]*)?",
+    # Unrolled so that runs of plain characters are matched at once.
+    b"basic": (
+        rb'"[\t\x20\x21\x23-\x5b\x5d-\x7e]*'
+        rb'(?:\\["\\btnfr][\t\x20\x21\x23-\x5b\x5d-\x7e]*)*"'
+    ),
+    b"literal": rb"'[\t\x20-\x26\x28-\x7e]*'",
+    b"integer": rb"[+-]?(?:0|[1-9](?:_?[0-9])*)",
+}
+_PARTS[b"key"] = rb"(?:[A-Za-z0-9_-]+|%(basic)s|%(literal)s)" % _PARTS
+_PARTS[b"value"] = rb"(?:%(basic)s|%(literal)s|%(integer)s|true|false)" % _PARTS
+
+# One line without its line ending. Exactly one of the groups matches for a
+# table header or a key/value pair; neither matches for blank lines and
+# comments.
+_LINE = re.compile(
+    rb"%(ws)s(?:"
+    rb"\[%(ws)s(?P<table>%(key)s)%(ws)s\]"
+    rb"|(?P<key>%(key)s)%(ws)s=%(ws)s(?P<value>%(value)s)"
+    rb")?%(ws)s%(comment)s" % _PARTS
+)
+
+_ESCAPES = {
+    "b": "\b",
+    "t": "\t",
+    "n": "\n",
+    "f": "\f",
+    "r": "\r",
+    '"': '"',
+    "\\": "\\",
+}
+
+
+def _decode_key(raw: bytes) -> str:
+    key = raw.decode("ascii")
+    if key[0] == "'":
+        return key[1:-1]
+    if key[0] == '"':
+        return _decode_basic(key)
+    return key
+
+
+def _decode_basic(value: str) -> str:
+    value = value[1:-1]
+    if "\\" not in value:
+        return value
+    return re.sub(r"\\(.)", lambda m: _ESCAPES[m[1]], value)
+
+
+def _decode_value(raw: bytes) -> str | int | bool:
+    value = raw.decode("ascii")
+    if value[0] == "'":
+        return value[1:-1]
+    if value[0] == '"':
+        return _decode_basic(value)
+    if value in ("true", "false"):
+        return value == "true"
+    return int(value)
+
+
+def scan(f: IO[bytes], wanted: Callable[[str], bool]) -> dict[str, dict[str, Any]]:
+    """Return the tables whose keys `wanted` accepts, in file order.
+
+    Raises Unsupported if the file isn't in the subset of TOML that the
+    scanner checks.
+    """
+    tables: dict[str, dict[str, Any]] = {}
+    # Keys defined in the root table, including table headers.
+    root_keys: set[str] = set()
+    # Keys defined in the current table.
+    keys = root_keys
+    current: dict[str, Any] | None = None
+
+    for line in f:
+        if line.endswith(b"\r\n"):
+            line = line[:-2]
+        elif line.endswith(b"\n"):
+            line = line[:-1]
+
+        match = _LINE.fullmatch(line)
+        if match is None:
+            raise Unsupported
+
+        if match["table"] is not None:
+            table = _decode_key(match["table"])
+            if table in root_keys:
+                raise Unsupported
+            root_keys.add(table)
+            keys = set()
+            current = None
+            if wanted(table):
+                current = tables[table] = {}
+        elif match["key"] is not None:
+            key = _decode_key(match["key"])
+            if key in keys:
+                raise Unsupported
+            keys.add(key)
+            if current is not None:
+                current[key] = _decode_value(match["value"])
+
+    return tables
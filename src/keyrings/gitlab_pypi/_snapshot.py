@@ -0,0 +1,118 @@
+"""On-disk snapshot of parsed config files, written by `keyring-gitlab-pypi
+compile`."""
+
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from . import _ConfigIndex, _StatSignature, _Token
+
+_SnapshotEntries = Mapping[Path, "tuple[_StatSignature, _ConfigIndex]"]
+
+SNAPSHOT_VERSION = 5
+SNAPSHOT_FILENAME = "config-snapshot.json"
+
+
+def snapshot_path() -> Path:
+    import platformdirs
+
+    from . import CONFIG_APPNAME
+
+    return (
+        platformdirs.user_cache_path(CONFIG_APPNAME, appauthor=False)
+        / SNAPSHOT_FILENAME
+    )
+
+
+def read(path: Path) -> dict[Path, tuple[_StatSignature, _ConfigIndex]] | None:
+    """Return the snapshot entries, or None if the snapshot doesn't exist.
+
+    An invalid snapshot is treated as empty so that it gets replaced.
+    """
+    try:
+        with open(path, "rb") as f:
+            from ._files import is_private
+
+            if not is_private(os.fstat(f.fileno())):
+                return {}
+            data = json.load(f)
+    except ValueError:
+        return {}
+    except OSError:
+        return None
+
+    from . import _PathTrie, _TokenCommand, _TokenPool
+
+    entries = {}
+    try:
+        if data["version"] != SNAPSHOT_VERSION:
+            return {}
+        for file, entry in data["files"].items():
+            mtime_ns, size, ino = entry["signature"]
+            index: _ConfigIndex = {}
+            for scheme, host, port, prefix, token in entry["index"]:
+                if isinstance(token, dict) and "tokens" in token:
+                    token = _TokenPool(tuple(token["tokens"]), tuple(token["weights"]))
+                elif isinstance(token, dict):
+                    token = _TokenCommand(tuple(token["command"]), token["ttl"])
+                trie = index.setdefault((scheme, host, port), _PathTrie())
+                trie.insert(prefix.split("/")[1:], token)
+            for scheme, host, port, prefix in entry["claims"]:
+                trie = index.setdefault((scheme, host, port), _PathTrie())
+                trie.claim(prefix.split("/")[1:])
+            entries[Path(file)] = (mtime_ns, size, ino), index
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return {}
+    return entries
+
+
+def write(path: Path, entries: _SnapshotEntries) -> None:
+    """Atomically replace the snapshot with one that only the current user can
+    read.
+    """
+    data: dict[str, Any] = {
+        "version": SNAPSHOT_VERSION,
+        "files": {
+            os.fspath(file): {
+                "signature": list(signature),
+                "index": [
+                    [*origin, prefix, _dump_token(token)]
+                    for origin, trie in index.items()
+                    for prefix, token in trie.items()
+                ],
+                "claims": [
+                    [*origin, prefix]
+                    for origin, trie in index.items()
+                    for prefix in trie.claimed()
+                ],
+            }
+            for file, (signature, index) in entries.items()
+        },
+    }
+
+    from ._files import atomic_write
+
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    atomic_write(path, json.dumps(data, separators=(",", ":")))
+
+
+def _dump_token(token: _Token) -> str | dict[str, Any]:
+    from . import _TokenPool
+
+    if isinstance(token, str):
+        return token
+    if isinstance(token, _TokenPool):
+        return {"tokens": list(token.tokens), "weights": list(token.weights)}
+    return {"command": list(token.argv), "ttl": token.ttl}
+
+
+def remove(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,364 @@
+"""Checking tokens with GitLab's token self-introspection endpoint, and the
+saved results that KEYRING_GITLAB_PYPI_TOKEN_CHECK uses."""
+
+from __future__ import annotations
+
+import datetime
+import http.client
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from . import CONFIG_APPNAME, _files, log
+
+if TYPE_CHECKING:
+    from . import _Origin, _StatSignature
+
+METADATA_FILENAME = "token-metadata.json"
+METADATA_VERSION = 1
+
+SELF_PATH = "/api/v4/personal_access_tokens/self"
+
+# Seconds to wait for GitLab.
+REQUEST_TIMEOUT = 10
+
+# Seconds to wait for a connection to GitLab during a lookup, which every
+# process uv starts would otherwise spend when GitLab can't be reached.
+LOOKUP_CONNECT_TIMEOUT = 1
+
+# Seconds after which `online` checks an active token again.
+RECHECK_AFTER = 24 * 60 * 60
+
+# Seconds after which `online` tries again to check a token that GitLab
+# couldn't be asked about.
+CHECK_BACKOFF = 5 * 60
+
+# Statuses of tokens that lookups skip.
+_UNUSABLE = frozenset({"expired", "revoked"})
+
+
+class TokenInfo(NamedTuple):
+    """What GitLab said about a token, and when.
+
+    status is "active", "expired", "revoked", "rejected" (a 401 for
+    another reason) or "unreachable" (a lookup couldn't ask GitLab, in which
+    case the expiry date and scopes are the ones known before, if any).
+    """
+
+    status: str
+    expires_at: str | None
+    scopes: tuple[str, ...]
+    checked: float
+
+    def usable(self, today: str) -> bool:
+        if self.status in _UNUSABLE:
+            return False
+        # GitLab treats a token as expired from the start of its expiry date.
+        return self.expires_at is None or self.expires_at > today
+
+
+class CheckError(Exception):
+    """GitLab couldn't be asked about a token."""
+
+
+def metadata_path() -> Path:
+    import platformdirs
+
+    return (
+        platformdirs.user_cache_path(CONFIG_APPNAME, appauthor=False)
+        / METADATA_FILENAME
+    )
+
+
+def _key(origin: _Origin, token: str) -> str:
+    """Return the metadata key for a token."""
+    return _files.key([*origin, token])
+
+
+def _today() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+# The metadata file as last read by this process, with its stat signature.
+_metadata: tuple[_StatSignature | None, dict[str, TokenInfo]] = (None, {})
+
+_metadata_lock = threading.Lock()
+
+
+def _load() -> dict[str, TokenInfo]:
+    """Return the saved metadata, reading the file again only if it changed."""
+    global _metadata
+    from . import _stat_signature
+
+    path = metadata_path()
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            signature = _stat_signature(st)
+            if signature == _metadata[0]:
+                return _metadata[1]
+            data = json.load(f) if _files.is_private(st) else {}
+    except OSError:
+        _metadata = None, {}
+        return {}
+    except ValueError:
+        data = {}
+
+    entries = {}
+    try:
+        if data.get("version") == METADATA_VERSION:
+            for key, entry in data["tokens"].items():
+                entries[key] = TokenInfo(
+                    str(entry["status"]),
+                    None if entry["expires_at"] is None else str(entry["expires_at"]),
+                    tuple(map(str, entry["scopes"])),
+                    float(entry["checked"]),
+                )
+    except (AttributeError, KeyError, TypeError, ValueError):
+        entries = {}
+    _metadata = signature, entries
+    return entries
+
+
+def _save(updates: dict[str, TokenInfo]) -> None:
+    """Merge entries into the metadata file and atomically replace it."""
+    path = metadata_path()
+    with _metadata_lock:
+        entries = {**_load(), **updates}
+        data = {
+            "version": METADATA_VERSION,
+            "tokens": {key: info._asdict() for key, info in entries.items()},
+        }
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        _files.atomic_write(path, json.dumps(data, separators=(",", ":")))
+
+
+class ConnectionPool:
+    """One keep-alive connection per GitLab instance, which waits at most
+    connect_timeout seconds to connect.
+    """
+
+    def __init__(self, connect_timeout: float = REQUEST_TIMEOUT) -> None:
+        self._connections: dict[_Origin, http.client.HTTPConnection] = {}
+        self._lock = threading.Lock()
+        self._connect_timeout = connect_timeout
+
+    def _connection(self, origin: _Origin) -> http.client.HTTPConnection:
+        connection = self._connections.get(origin)
+        if connection is None:
+            scheme, host, port = origin
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(
+                    host, port, timeout=self._connect_timeout
+                )
+            else:
+                connection = http.client.HTTPConnection(
+                    host, port, timeout=self._connect_timeout
+                )
+            self._connections[origin] = connection
+        return connection
+
+    def get(
+        self, origin: _Origin, path: str, headers: dict[str, str]
+    ) -> tuple[int, bytes]:
+        """Return the status and body of a GET request."""
+        with self._lock:
+            # A kept-alive connection may have been closed by the server since
+            # it was last used, so a failure on it is retried once on a new one.
+            for attempt in range(2):
+                connection = self._connection(origin)
+                reused = connection.sock is not None
+                try:
+                    if not reused:
+                        connection.connect()
+                        assert connection.sock is not None
+                        connection.sock.settimeout(REQUEST_TIMEOUT)
+                    connection.request("GET", path, headers=headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    del self._connections[origin]
+                    if reused and attempt == 0:
+                        continue
+                    raise CheckError(str(e)) from e
+                if response.will_close:
+                    connection.close()
+                    del self._connections[origin]
+                return response.status, body
+        raise AssertionError("unreachable")
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+
+# Connections for lookups with the `online` policy, which last as long as the
+# process so that the daemon reuses them.
+_pool = ConnectionPool(LOOKUP_CONNECT_TIMEOUT)
+
+
+def check(pool: ConnectionPool, origin: _Origin, token: str) -> TokenInfo:
+    """Ask GitLab about a token. Raises CheckError if it can't be asked."""
+    status, body = pool.get(
+        origin,
+        SELF_PATH,
+        {"PRIVATE-TOKEN": token, "Accept": "application/json"},
+    )
+    now = time.time()
+    try:
+        data: Any = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+
+    if status == 401:
+        description = str(data.get("error_description", "")).lower()
+        if "expired" in description:
+            return TokenInfo("expired", None, (), now)
+        if "revoked" in description:
+            return TokenInfo("revoked", None, (), now)
+        return TokenInfo("rejected", None, (), now)
+    if status == 403:
+        # Authenticated, but without a scope that can read its own details.
+        return TokenInfo("active", None, (), now)
+    if status != 200:
+        raise CheckError(f"{SELF_PATH} returned {status}")
+
+    expires_at = data.get("expires_at")
+    scopes = data.get("scopes")
+    if data.get("revoked"):
+        state = "revoked"
+    elif data.get("active") is False:
+        state = "expired"
+    else:
+        state = "active"
+    return TokenInfo(
+        state,
+        expires_at if isinstance(expires_at, str) else None,
+        tuple(scopes) if isinstance(scopes, list) else (),
+        now,
+    )
+
+
+def usable(origin: _Origin, token: str, policy: str) -> bool:
+    """Return False if a token is known to be expired or revoked, checking it
+    first with the `online` policy.
+    """
+    key = _key(origin, token)
+    info = _load().get(key)
+    if policy == "online" and _needs_check(info):
+        try:
+            info = check(_pool, origin, token)
+        except CheckError as e:
+            log.warning("Unable to check a token for %s: %s", origin[1], e)
+            # Saved so that the next lookups don't wait for GitLab again
+            # until CHECK_BACKOFF has passed.
+            if info is None:
+                info = TokenInfo("unreachable", None, (), time.time())
+            else:
+                info = info._replace(status="unreachable", checked=time.time())
+        try:
+            _save({key: info})
+        except OSError:
+            log.warning("Unable to update %s", metadata_path(), exc_info=True)
+
+    if info is None or info.usable(_today()):
+        return True
+    log.warning("Skipping a token for %s, which has expired or was revoked", origin[1])
+    return False
+
+
+def _needs_check(info: TokenInfo | None) -> bool:
+    """Return whether the `online` policy asks GitLab about a token."""
+    if info is None:
+        return True
+    if info.status in _UNUSABLE:
+        return False
+    if info.status == "unreachable":
+        return info.checked < time.time() - CHECK_BACKOFF
+    return info.checked < time.time() - RECHECK_AFTER
+
+
+class Result(NamedTuple):
+    """The outcome of checking one configured token."""
+
+    file: Path
+    key: str
+    info: TokenInfo | None
+    error: str | None
+
+    @property
+    def ok(self) -> bool:
+        return (
+            self.info is not None
+            and self.info.status == "active"
+            and self.info.usable(_today())
+        )
+
+
+def _configured_tokens() -> Iterator[tuple[Path, _Origin, str, str | None]]:
+    """Yields the file, origin, a description of the key and the token (None
+    if its command failed) for every configured token.
+    """
+    from . import _DEFAULT_PORTS, _iter_configs, _TokenCommand, _TokenPool
+
+    for file, index in _iter_configs():
+        for origin, trie in index.items():
+            scheme, host, port = origin
+            netloc = host if port == _DEFAULT_PORTS[scheme] else f"{host}:{port}"
+            for prefix, value in sorted(trie.items()):
+                key = f"{scheme}://{netloc}{prefix}"
+                if isinstance(value, _TokenPool):
+                    for i, token in enumerate(value.tokens):
+                        yield file, origin, f"{key} tokens[{i}]", token
+                elif isinstance(value, _TokenCommand):
+                    from . import _token_command
+
+                    yield (
+                        file,
+                        origin,
+                        f"{key} token_command",
+                        _token_command.get(value),
+                    )
+                else:
+                    yield file, origin, key, value
+
+
+def check_configured() -> Iterator[Result]:
+    """Check every configured token, and save what GitLab says about them."""
+    pool = ConnectionPool()
+    # Tokens configured more than once are only checked once.
+    outcomes: dict[str, TokenInfo | str] = {}
+    updates: dict[str, TokenInfo] = {}
+    try:
+        for file, origin, key, token in _configured_tokens():
+            if token is None:
+                yield Result(file, key, None, "token_command failed")
+                continue
+
+            token_key = _key(origin, token)
+            if token_key not in outcomes:
+                try:
+                    outcomes[token_key] = updates[token_key] = check(
+                        pool, origin, token
+                    )
+                except CheckError as e:
+                    outcomes[token_key] = str(e)
+
+            outcome = outcomes[token_key]
+            if isinstance(outcome, str):
+                yield Result(file, key, None, outcome)
+            else:
+                yield Result(file, key, outcome, None)
+    finally:
+        pool.close()
+        if updates:
+            _save(updates)
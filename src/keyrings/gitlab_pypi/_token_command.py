@@ -0,0 +1,120 @@
+"""Tokens printed by a `token_command`, cached for `token_ttl` seconds across
+processes."""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any
+
+from . import CONFIG_APPNAME, _files, log
+
+if TYPE_CHECKING:
+    from . import _TokenCommand
+
+CACHE_FILENAME = "token-commands.json"
+
+# Seconds to wait for a command before giving up on it.
+COMMAND_TIMEOUT = 60
+
+# Tokens cached by this process, keyed by command, with when they expire.
+_memory: dict[str, tuple[str, float]] = {}
+
+
+def cache_path() -> Path:
+    import platformdirs
+
+    return (
+        platformdirs.user_cache_path(CONFIG_APPNAME, appauthor=False) / CACHE_FILENAME
+    )
+
+
+def get(command: _TokenCommand) -> str | None:
+    """Return the token printed by a command, or None if it fails."""
+    key = _files.key(command.argv)
+    cached = _memory.get(key)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
+    if sys.platform == "win32" or command.ttl <= 0:
+        token = _run(command.argv)
+        if token is not None and command.ttl > 0:
+            _memory[key] = token, time.time() + command.ttl
+        return token
+
+    path = cache_path()
+    try:
+        with _files.locked_private(path, exclusive=False) as f:
+            if f is None:
+                return _run(command.argv)
+            return _get_locked(f, key, command)
+    except OSError:
+        log.warning("Unable to use %s", path, exc_info=True)
+        return _run(command.argv)
+
+
+def _get_locked(f: IO[str], key: str, command: _TokenCommand) -> str | None:
+    """Return the token from the cache file, holding a shared lock on it, or
+    run the command and cache its output.
+    """
+    import fcntl
+
+    entry = _read(f).get(key)
+    if entry is None or entry[1] <= time.time():
+        # Only one process runs the command. The others wait for the
+        # exclusive lock and then find its output in the cache.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        entries = _read(f)
+        entry = entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            token = _run(command.argv)
+            if token is None:
+                return None
+            now = time.time()
+            entry = token, now + command.ttl
+            entries = {k: v for k, v in entries.items() if v[1] > now}
+            entries[key] = entry
+            _files.write(f, {k: list(v) for k, v in entries.items()})
+
+    _memory[key] = entry
+    return entry[0]
+
+
+def _read(f: IO[str]) -> dict[str, tuple[str, float]]:
+    """Return the cache entries, ignoring the file's contents if it's invalid."""
+    data: Any = _files.read(f)
+    try:
+        return {
+            key: (str(token), float(expires)) for key, (token, expires) in data.items()
+        }
+    except (AttributeError, TypeError, ValueError):
+        return {}
+
+
+def _run(argv: tuple[str, ...]) -> str | None:
+    try:
+        result = subprocess.run(
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            text=True,
+            timeout=COMMAND_TIMEOUT,
+            check=False,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        log.warning("Unable to run token_command %r: %s", argv[0], e)
+        return None
+
+    if result.returncode != 0:
+        log.warning(
+            "token_command %r failed with exit status %d", argv[0], result.returncode
+        )
+        return None
+
+    token = result.stdout.strip()
+    if not token or "\n" in token:
+        log.warning("token_command %r didn't print a single line", argv[0])
+        return None
+    return token
@@ -0,0 +1,149 @@
+"""Choosing one of several `tokens` for a host with smooth weighted
+round-robin."""
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any
+
+from . import CONFIG_APPNAME, _files, log
+
+if TYPE_CHECKING:
+    from . import _TokenPool
+
+STATE_FILENAME = "token-pools.json"
+
+# Rotation state for tables that haven't been used for this many seconds is
+# dropped, so the file doesn't grow as config files change.
+_STATE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class _State:
+    """Current weights of each pool, with when it was last used, and when
+    each cooling-down token becomes available again, keyed by hash.
+    """
+
+    __slots__ = ("pools", "cooling")
+
+    def __init__(self) -> None:
+        self.pools: dict[str, tuple[list[int], float]] = {}
+        self.cooling: dict[str, float] = {}
+
+    @classmethod
+    def load(cls, data: Any) -> _State:
+        state = cls()
+        try:
+            for key, (weights, used) in data["pools"].items():
+                state.pools[str(key)] = [int(w) for w in weights], float(used)
+            for key, until in data["cooling"].items():
+                state.cooling[str(key)] = float(until)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return cls()
+        return state
+
+    def dump(self, now: float) -> dict[str, Any]:
+        return {
+            "pools": {
+                key: [weights, used]
+                for key, (weights, used) in self.pools.items()
+                if used > now - _STATE_MAX_AGE
+            },
+            "cooling": {
+                key: until for key, until in self.cooling.items() if until > now
+            },
+        }
+
+
+# State for this process where it can't be shared through the file.
+_memory = _State()
+
+# Serialises changes to _memory by threads of this process.
+_lock = threading.Lock()
+
+
+def state_path() -> Path:
+    import platformdirs
+
+    return (
+        platformdirs.user_cache_path(CONFIG_APPNAME, appauthor=False) / STATE_FILENAME
+    )
+
+
+def choose(pool: _TokenPool) -> str:
+    """Return the next token from the pool."""
+    with _lock:
+        if sys.platform == "win32":
+            return _choose(_memory, pool, time.time())
+
+        path = state_path()
+        try:
+            with _locked_state(path) as (f, state):
+                token = _choose(state, pool, time.time())
+                if f is not None:
+                    _write(f, state)
+                return token
+        except OSError:
+            log.warning("Unable to use %s", path, exc_info=True)
+            return _choose(_memory, pool, time.time())
+
+
+def cool_down(token: str, seconds: float) -> None:
+    """Skip the token in the tables that list it for the next seconds."""
+    with _lock:
+        until = time.time() + seconds
+        if sys.platform == "win32":
+            _memory.cooling[_files.key(token)] = until
+            return
+
+        path = state_path()
+        try:
+            with _locked_state(path) as (f, state):
+                state.cooling[_files.key(token)] = until
+                if f is not None:
+                    _write(f, state)
+        except OSError:
+            log.warning("Unable to use %s", path, exc_info=True)
+            _memory.cooling[_files.key(token)] = until
+
+
+def _choose(state: _State, pool: _TokenPool, now: float) -> str:
+    keys = [_files.key(token) for token in pool.tokens]
+    available = [i for i, key in enumerate(keys) if state.cooling.get(key, 0) <= now]
+    if not available:
+        # Better to try a rate-limited token than none at all.
+        i = min(range(len(keys)), key=lambda i: state.cooling[keys[i]])
+        log.warning("Every token for the host is cooling down, using one anyway")
+        return pool.tokens[i]
+
+    pool_key = _files.key([pool.tokens, pool.weights])
+    current = state.pools.get(pool_key, ([], 0.0))[0]
+    if len(current) != len(pool.tokens):
+        current = [0] * len(pool.tokens)
+
+    for i in available:
+        current[i] += pool.weights[i]
+    chosen = max(available, key=lambda i: current[i])
+    current[chosen] -= sum(pool.weights[i] for i in available)
+    state.pools[pool_key] = current, now
+    return pool.tokens[chosen]
+
+
+@contextmanager
+def _locked_state(path: Path) -> Iterator[tuple[IO[str] | None, _State]]:
+    """Open the state file with an exclusive lock, creating it if necessary,
+    and yield it with its state.
+
+    If the file isn't private to the current user, the state in memory is
+    yielded instead, and the file isn't trusted or written to.
+    """
+    with _files.locked_private(path, exclusive=True) as f:
+        yield f, _memory if f is None else _State.load(_files.read(f))
+
+
+def _write(f: IO[str], state: _State) -> None:
+    _files.write(f, state.dump(time.time()))
@@ -0,0 +1,164 @@
+"""Opt-in tracing of credential lookups.
+
+Set KEYRING_GITLAB_PYPI_TRACE to "stderr" (or "1") to write one JSON object
+per lookup to stderr, or to a file path to append them to that file. A hook
+registered with `keyrings.gitlab_pypi.set_trace_hook` receives the same
+objects as dicts.
+
+Each record has the time spent in each phase of the lookup, the config files
+that were tried and their outcome, and which source produced the credential.
+Tokens are never recorded, and user info in service URLs is redacted.
+
+Lookups are also traced when KEYRING_GITLAB_PYPI_METRICS is set, to count
+them (see _metrics).
+
+When tracing is disabled, instrumented code only pays for a context variable
+lookup.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+
+ENV_VAR = "KEYRING_GITLAB_PYPI_TRACE"
+METRICS_ENV_VAR = "KEYRING_GITLAB_PYPI_METRICS"
+
+TraceHook = Callable[[dict[str, Any]], None]
+
+_hook: TraceHook | None = None
+
+_current: ContextVar[Trace | None] = ContextVar("trace", default=None)
+
+
+def set_hook(hook: TraceHook | None) -> None:
+    global _hook
+    _hook = hook
+
+
+def enabled() -> bool:
+    return (
+        _hook is not None
+        or bool(os.environ.get(ENV_VAR))
+        or bool(os.environ.get(METRICS_ENV_VAR))
+    )
+
+
+def current() -> Trace | None:
+    """Return the trace of the lookup in progress, if it is being traced."""
+    return _current.get()
+
+
+def redact(service: str) -> str:
+    """Remove user info, which could contain a password, from a URL."""
+    scheme, sep, rest = service.partition("://")
+    authority, slash, path = rest.partition("/")
+    if "@" not in authority:
+        return service
+    return f"{scheme}{sep}***@{authority.rpartition('@')[2]}{slash}{path}"
+
+
+class Trace:
+    def __init__(self, operation: str, services: list[str], username: str | None):
+        self.operation = operation
+        self.services = services
+        self.username = username
+        # (scheme, host, port, path) of the URLs being looked up, to tell
+        # whether a config file is a hit.
+        self.urls: set[tuple[str, str, int, str]] = set()
+        self.phases_ns: dict[str, int] = {}
+        self.files: list[dict[str, Any]] = []
+        self.parse_errors: set[Path] = set()
+        self.source: str | None = None
+        self.source_file: Path | None = None
+        self.start_ns = time.perf_counter_ns()
+
+    @staticmethod
+    def now() -> int:
+        return time.perf_counter_ns()
+
+    def phase(self, name: str, start_ns: int) -> None:
+        """Add the time since start_ns to a phase."""
+        elapsed = time.perf_counter_ns() - start_ns
+        self.phases_ns[name] = self.phases_ns.get(name, 0) + elapsed
+
+    def parse_ns(self) -> int:
+        return sum(
+            self.phases_ns.get(name, 0)
+            for name in ("toml_parse", "toml_scan", "config_index")
+        )
+
+    def file(self, path: Path, outcome: str, *, cached: bool) -> None:
+        self.files.append({"path": str(path), "outcome": outcome, "cached": cached})
+
+    def found(self, source: str, file: Path | None = None) -> None:
+        if self.source is None:
+            self.source = source
+            self.source_file = file
+
+    def as_dict(self) -> dict[str, Any]:
+        record: dict[str, Any] = {"event": "lookup", "operation": self.operation}
+        services = [redact(service) for service in self.services]
+        if len(services) == 1:
+            record["service"] = services[0]
+        else:
+            record["services"] = services
+        record["username"] = self.username
+        record["source"] = self.source
+        record["source_file"] = (
+            None if self.source_file is None else str(self.source_file)
+        )
+        record["duration_us"] = (time.perf_counter_ns() - self.start_ns) / 1e3
+        record["phases_us"] = {
+            name: elapsed / 1e3 for name, elapsed in self.phases_ns.items()
+        }
+        record["files"] = self.files
+        record["cache_hits"] = sum(file["cached"] for file in self.files)
+        return record
+
+
+@contextmanager
+def lookup(
+    operation: str, services: list[str], username: str | None
+) -> Iterator[Trace]:
+    trace = Trace(operation, services, username)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        _emit(trace.as_dict())
+
+
+def _emit(record: dict[str, Any]) -> None:
+    if _hook is not None:
+        _hook(record)
+
+    if os.environ.get(METRICS_ENV_VAR):
+        from . import _metrics
+
+        _metrics.record(record)
+
+    destination = os.environ.get(ENV_VAR)
+    if not destination:
+        return
+
+    import json
+
+    line = json.dumps(record) + "\n"
+    if destination in ("1", "stderr"):
+        sys.stderr.write(line)
+    else:
+        try:
+            with open(destination, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            from . import log
+
+            log.warning("Unable to write trace to %s", destination, exc_info=True)
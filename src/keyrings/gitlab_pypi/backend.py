@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import functools
+import os
+import sys
+from collections.abc import Iterable, Sequence
+from typing import TYPE_CHECKING
+
+from keyring.backend import KeyringBackend
+from keyring.compat import properties
+from keyring.credentials import SimpleCredential
+
+from . import (
+    _get_credential,
+    _get_password,
+    _is_authoritative,
+    _load_credentials,
+    _load_password,
+    _trace,
+    log,
+)
+
+# keyring's chainer, which asks every other backend in turn until one of them
+# has a credential, has priority 10.
+_PRIORITY = 9
+_AUTHORITATIVE_PRIORITY = 11
+
+# Options of `keyring` that take a value, which can come before `get`.
+_KEYRING_OPTIONS_WITH_VALUES = {
+    "-p",
+    "--keyring-path",
+    "-b",
+    "--keyring-backend",
+    "--mode",
+    "--output",
+}
+
+
+def _keyring_get_service(argv: Sequence[str]) -> str | None:
+    """Return the service that `keyring get` was run for, or None if argv
+    isn't a `keyring get` command.
+    """
+    if not argv:
+        return None
+    program = os.path.normpath(argv[0])
+    if os.path.basename(program) not in ("keyring", "keyring.exe") and not (
+        program.endswith(os.path.join("keyring", "__main__.py"))
+    ):
+        return None
+
+    # Options can come before and after the command.
+    command = None
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in _KEYRING_OPTIONS_WITH_VALUES:
+            next(args, None)
+        elif arg.startswith("-"):
+            continue
+        elif command is not None:
+            return arg
+        elif arg == "get":
+            command = arg
+        else:
+            return None
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def _priority(argv: tuple[str, ...]) -> float:
+    # keyring reads the priority several times while it picks a backend, and
+    # the chainer reads it again for every lookup.
+    service = _keyring_get_service(argv)
+    if service is None:
+        return _PRIORITY
+    try:
+        authoritative = _is_authoritative(service)
+    except Exception:
+        # Don't stop keyring from picking a backend.
+        log.warning(
+            "Unable to check whether %s is authoritative",
+            _trace.redact(service),
+            exc_info=True,
+        )
+        return _PRIORITY
+    return _AUTHORITATIVE_PRIORITY if authoritative else _PRIORITY
+
+
+class GitlabPypi(KeyringBackend):
+    @properties.classproperty
+    def priority(cls) -> float:
+        """Outrank keyring's chainer when this process is `keyring get` for a
+        URL that a config file marks as authoritative, so that keyring uses
+        this backend alone and doesn't ask slower backends after it.
+        """
+        return _priority(tuple(sys.argv))
+
+    if TYPE_CHECKING:
+
+        def __init__(self) -> None: ...
+
+    def get_password(self, service: str, username: str) -> str | None:
+        return _get_password(service, username)
+
+    def set_password(self, service: str, username: str, password: str) -> None:
+        raise NotImplementedError
+
+    def delete_password(self, service: str, username: str) -> None:
+        raise NotImplementedError
+
+    def get_credential(
+        self,
+        service: str,
+        username: str | None,
+    ) -> SimpleCredential | None:
+        credential = _get_credential(service, username)
+        return None if credential is None else SimpleCredential(*credential)
+
+    def get_credentials(
+        self, services: Iterable[str]
+    ) -> dict[str, SimpleCredential | None]:
+        """Look up credentials for many services at once.
+
+        Equivalent to calling `get_credential` for each service, but config
+        files are located and read once, and each index URL is only looked
+        up once.
+        """
+        if _trace.enabled():
+            services = list(services)
+            with _trace.lookup("get_credentials", services, None):
+                credentials = _load_credentials(services)
+        else:
+            credentials = _load_credentials(services)
+
+        return {
+            service: None if credential is None else SimpleCredential(*credential)
+            for service, credential in credentials.items()
+        }
+
+    async def aget_password(self, service: str, username: str) -> str | None:
+        """Like `get_password`, but config files are read in the event loop's
+        default executor instead of blocking the loop.
+        """
+        if _trace.enabled():
+            import asyncio
+
+            return await asyncio.to_thread(self.get_password, service, username)
+        if username != "__token__":
+            # The CI job token only comes from the environment.
+            return _load_password(service, username)
+
+        from ._async import load_credentials
+
+        credential = (await load_credentials([service], ci=False))[service]
+        return None if credential is None else credential[1]
+
+    async def aget_credential(
+        self,
+        service: str,
+        username: str | None,
+    ) -> SimpleCredential | None:
+        """Like `get_credential`, but config files are read in the event
+        loop's default executor instead of blocking the loop.
+        """
+        if _trace.enabled():
+            import asyncio
+
+            return await asyncio.to_thread(self.get_credential, service, username)
+
+        from ._async import load_credentials
+
+        credential = (await load_credentials([service]))[service]
+        return None if credential is None else SimpleCredential(*credential)
+
+    async def aget_credentials(
+        self, services: Iterable[str]
+    ) -> dict[str, SimpleCredential | None]:
+        """Like `get_credentials`, but config files are read in the event
+        loop's default executor instead of blocking the loop.
+
+        Concurrent lookups read each config file at most once between them.
+        """
+        if _trace.enabled():
+            import asyncio
+
+            return await asyncio.to_thread(self.get_credentials, list(services))
+
+        from ._async import load_credentials
+
+        credentials = await load_credentials(services)
+        return {
+            service: None if credential is None else SimpleCredential(*credential)
+            for service, credential in credentials.items()
+        }
@@ -0,0 +1,386 @@
+"""Command line interface compatible with `keyring get`.
+
+uv's subprocess keyring provider runs `keyring get <url> <username>` (or
+`keyring --mode creds get <url>`) once per index. Installing this entry point
+as `keyring` answers those calls like `GitlabPypi` would, without importing
+keyring, which discovers and prioritises every installed backend first.
+
+If `keyring-gitlab-pypi serve` is running and reads the same config files,
+`get` asks it instead of reading them. Tokens in KEYRING_GITLAB_PYPI_TOKENS
+are looked up in the process itself, since the daemon doesn't share its
+environment.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import signal
+import sys
+from collections.abc import Sequence
+from pathlib import Path
+
+from . import (
+    _DEFAULT_COOL_DOWN,
+    compile_config_snapshot,
+    cool_down_token,
+    log,
+    remove_config_snapshot,
+)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    # keyring accepts --mode and --output before or after the operation.
+    get_options = argparse.ArgumentParser(add_help=False)
+    get_options.add_argument(
+        "--mode",
+        choices=["password", "creds"],
+        dest="get_mode",
+        default=argparse.SUPPRESS,
+        help=(
+            "Mode for 'get' operation. 'password' requires a username and will "
+            "return only the password. 'creds' does not require a username and "
+            "will return both the username and password separated by a newline. "
+            "Default is 'password'"
+        ),
+    )
+    get_options.add_argument(
+        "--output",
+        choices=["plain", "json"],
+        dest="output_format",
+        default=argparse.SUPPRESS,
+        help="Output format for 'get' operation. Default is 'plain'",
+    )
+
+    parser = argparse.ArgumentParser(prog="keyring-gitlab-pypi", parents=[get_options])
+    subparsers = parser.add_subparsers(dest="operation", required=True)
+
+    get_parser = subparsers.add_parser(
+        "get", parents=[get_options], help="Get a token for a GitLab package index"
+    )
+    get_parser.add_argument("service")
+    get_parser.add_argument("username", nargs="?")
+
+    subparsers.add_parser(
+        "batch",
+        help=(
+            "Read service URLs from stdin, one per line, and write a JSON object "
+            "with the service, username and password for each to stdout"
+        ),
+    )
+
+    subparsers.add_parser(
+        "compile",
+        help=(
+            "Parse every config file and save the result, so that new processes "
+            "don't need to parse config files that haven't changed"
+        ),
+    )
+    subparsers.add_parser("clear-cache", help="Remove the saved config files")
+
+    netrc_parser = subparsers.add_parser(
+        "netrc",
+        help=(
+            "Write credentials for GitLab package indexes to a netrc file, which "
+            "uv reads without running keyring"
+        ),
+    )
+    netrc_parser.add_argument(
+        "urls",
+        nargs="*",
+        metavar="URL",
+        help=(
+            "Index URL. Default is the indexes in pyproject.toml and uv.toml in "
+            "the current directory"
+        ),
+    )
+    netrc_parser.add_argument(
+        "--file",
+        type=Path,
+        help="netrc file to update. Default is $NETRC or ~/.netrc",
+    )
+
+    cool_down_parser = subparsers.add_parser(
+        "cool-down",
+        help=(
+            "Read a token from stdin and skip it in the tables that list it in "
+            "'tokens', e.g. after a request with it was rate limited"
+        ),
+    )
+    cool_down_parser.add_argument(
+        "--seconds",
+        type=float,
+        default=_DEFAULT_COOL_DOWN,
+        help=f"How long to skip the token for. Default is {_DEFAULT_COOL_DOWN:g}",
+    )
+
+    subparsers.add_parser(
+        "check",
+        help=(
+            "Ask GitLab whether each configured token is still valid, and save "
+            "the answers for KEYRING_GITLAB_PYPI_TOKEN_CHECK"
+        ),
+    )
+
+    metrics_parser = subparsers.add_parser(
+        "metrics",
+        help=(
+            "Print the lookups counted with KEYRING_GITLAB_PYPI_METRICS in "
+            "node-exporter textfile format"
+        ),
+    )
+    metrics_parser.add_argument(
+        "--state",
+        type=Path,
+        help="State file to read. Default is $KEYRING_GITLAB_PYPI_METRICS",
+    )
+    metrics_parser.add_argument(
+        "--output",
+        type=Path,
+        help=(
+            "Atomically replace this file (e.g. a .prom file in the textfile "
+            "collector's directory) instead of printing"
+        ),
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help=(
+            "Keep the config files in memory and answer 'get' from other "
+            "processes over a Unix domain socket"
+        ),
+    )
+    serve_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help=(
+            "How often to check config files for changes, if inotify isn't "
+            "available. Default is 2"
+        ),
+    )
+
+    return parser
+
+
+def _lookup(service: str, username: str | None) -> tuple[str, str] | None:
+    """Return the username and password for a service, from the daemon if it
+    is running. Any username is accepted if username is None.
+    """
+    import socket
+
+    if hasattr(socket, "AF_UNIX") and not _has_env_token(service, username):
+        from . import _daemon
+
+        try:
+            answer = _daemon.request(_daemon.socket_path(), service, username)
+        except (OSError, ValueError) as exc:
+            log.debug("Not using daemon: %s", exc)
+        else:
+            # The daemon doesn't have this process's CI job token, so without
+            # a token from the config files it's looked up here.
+            if answer is not None or not _has_ci_job_token(service, username):
+                return answer
+
+    from . import _get_credential, _get_password
+
+    if username is None:
+        return _get_credential(service, None)
+
+    password = _get_password(service, username)
+    if password is None:
+        return None
+    return username, password
+
+
+def _has_env_token(service: str, username: str | None) -> bool:
+    """Return whether KEYRING_GITLAB_PYPI_TOKENS has a token for a service."""
+    from . import _env_tokens, _gitlab_url_from_service, _match
+
+    if username not in (None, "__token__"):
+        return False
+    index = _env_tokens()
+    if index is None:
+        return False
+    url = _gitlab_url_from_service(service)
+    return url is not None and _match(index, url) is not None
+
+
+def _has_ci_job_token(service: str, username: str | None) -> bool:
+    """Return whether the CI job token in the environment is for a service."""
+    from . import _ci_job_token, _gitlab_url_from_service
+
+    if username not in (None, "gitlab-ci-token"):
+        return False
+    ci_job_token = _ci_job_token()
+    if ci_job_token is None:
+        return False
+    url = _gitlab_url_from_service(service)
+    return url is not None and url.origin == ci_job_token[0]
+
+
+def _get(
+    args: argparse.Namespace, parser: argparse.ArgumentParser
+) -> dict[str, str] | None:
+    """Return the fields that `keyring get` would print, in order."""
+    if args.get_mode == "creds":
+        credential = _lookup(args.service, None)
+        if credential is None:
+            return None
+        return {"username": credential[0], "password": credential[1]}
+
+    if args.username is None:
+        parser.error("get requires service and username")
+
+    credential = _lookup(args.service, args.username)
+    if credential is None:
+        return None
+    return {"password": credential[1]}
+
+
+def _batch() -> int:
+    from .backend import GitlabPypi
+
+    services = [line.strip() for line in sys.stdin]
+    services = [service for service in services if service]
+
+    credentials = GitlabPypi().get_credentials(services)
+    for service in services:
+        credential = credentials[service]
+        username = password = None
+        if credential is not None:
+            username, password = credential.username, credential.password
+        print(
+            json.dumps({"service": service, "username": username, "password": password})
+        )
+
+    return 0
+
+
+def _netrc(urls: list[str], path: Path | None) -> int:
+    from . import _netrc
+
+    if not urls:
+        urls = _netrc.index_urls(Path.cwd())
+    if path is None:
+        path = _netrc.default_path()
+
+    changed, missing = _netrc.sync(path, urls)
+    for url in missing:
+        log.warning("No credentials for %s", url)
+    print(f"Updated {path}" if changed else f"{path} is up to date", file=sys.stderr)
+    return 1 if missing else 0
+
+
+def _cool_down(seconds: float) -> int:
+    # Read from stdin rather than an argument, which other users can see.
+    token = sys.stdin.readline().strip()
+    if not token:
+        print("No token on stdin", file=sys.stderr)
+        return 1
+    cool_down_token(token, seconds)
+    return 0
+
+
+def _check() -> int:
+    from . import _token_check
+
+    status = 0
+    for result in _token_check.check_configured():
+        if result.info is None:
+            description = f"unable to check: {result.error}"
+        else:
+            description = result.info.status
+            if result.info.expires_at is not None:
+                description += f", expires {result.info.expires_at}"
+            if result.info.scopes:
+                description += f", scopes: {', '.join(result.info.scopes)}"
+        print(f"{result.file}: {result.key}: {description}")
+        if not result.ok:
+            status = 1
+    return status
+
+
+def _metrics(state_path: Path | None, output: Path | None) -> int:
+    import os
+
+    from . import _metrics
+
+    if state_path is None:
+        value = os.environ.get(_metrics.ENV_VAR)
+        if not value:
+            print(f"Neither --state nor {_metrics.ENV_VAR} is set", file=sys.stderr)
+            return 1
+        state_path = Path(value)
+
+    text = _metrics.render(_metrics.load(state_path))
+    if output is None:
+        sys.stdout.write(text)
+    else:
+        _metrics.write_textfile(output, text)
+    return 0
+
+
+def _serve(poll_interval: float) -> int:
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("serve requires Unix domain sockets", file=sys.stderr)
+        return 1
+
+    from . import _daemon
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Exit through serve's cleanup, which removes the socket.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        _daemon.serve(_daemon.socket_path(), poll_interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+
+    if args.operation == "batch":
+        return _batch()
+    elif args.operation == "compile":
+        print(compile_config_snapshot())
+        return 0
+    elif args.operation == "clear-cache":
+        remove_config_snapshot()
+        return 0
+    elif args.operation == "netrc":
+        return _netrc(args.urls, args.file)
+    elif args.operation == "cool-down":
+        return _cool_down(args.seconds)
+    elif args.operation == "check":
+        return _check()
+    elif args.operation == "metrics":
+        return _metrics(args.state, args.output)
+    elif args.operation == "serve":
+        return _serve(args.poll_interval)
+    # Defaults are applied here so that the option can be given on either side
+    # of the operation without the subparser overwriting it.
+    args.get_mode = getattr(args, "get_mode", "password")
+    args.output_format = getattr(args, "output_format", "plain")
+
+    fields = _get(args, parser)
+    if fields is None:
+        return 1
+
+    if args.output_format == "json":
+        print(json.dumps(fields))
+    else:
+        for value in fields.values():
+            print(value)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
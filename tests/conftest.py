@@ -5,7 +5,8 @@ import re
 import secrets
 import string
 import sys
-from collections.abc import Mapping
+import time
+from collections.abc import Callable, Iterator, Mapping
 from enum import Enum, auto
 from functools import cached_property
 from pathlib import Path
@@ -20,7 +21,14 @@ from pyfakefs.fake_filesystem import FakeFilesystem
 from pytest import FixtureRequest, Metafunc, MonkeyPatch
 from yarl import URL
 
-from keyrings.gitlab_pypi import GitlabPypi, iter_config_paths
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import (
+    CONFIG_FILENAME,
+    GitlabPypi,
+    clear_config_cache,
+    iter_config_paths,
+)
+from keyrings.gitlab_pypi import user_config_path as gitlab_pypi_user_config_path
 
 
 def _convert_path_to_str(path: str | os.PathLike[str]) -> str:
@@ -118,6 +126,18 @@ def service(gitlab_base_url: URL, request: FixtureRequest) -> str:
     )
 
 
+@pytest.fixture(
+    params=[
+        "api/v4/groups/1/-/packages/pypi/simple/keyring-gitlab-pypi",
+        "api/v4/packages/pypi/simple/keyring-gitlab-pypi",
+    ],
+    ids=["group", "instance"],
+)
+def non_project_service(gitlab_base_url: URL, request: FixtureRequest) -> str:
+    """Return a service for an index that isn't a project's."""
+    return str(gitlab_base_url.joinpath(request.param))
+
+
 @pytest.fixture(
     params=[
         "simple/keyring-gitlab-pypi",
@@ -192,6 +212,110 @@ def config_file(
     return path
 
 
+@pytest.fixture
+def user_config_file(fs: FakeFilesystem) -> Path:
+    """Return the path of the user config file, which doesn't exist yet."""
+    path = gitlab_pypi_user_config_path() / CONFIG_FILENAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@pytest.fixture
+def real_config_dir(tmp_path: Path, monkeypatch: MonkeyPatch) -> Path:
+    """Use an empty directory on the real filesystem as the only config
+    directory, for tests that pyfakefs can't serve: ones that use other
+    threads or processes, keyring's backend discovery, or the modification
+    time of directories (which pyfakefs doesn't update).
+
+    On Linux, the XDG variables are set so that other processes use the same
+    directory.
+    """
+    config_dir = tmp_path / "config"
+    config_dir.mkdir()
+    monkeypatch.setattr(keyrings.gitlab_pypi, "system_config_paths", lambda: [])
+    monkeypatch.setattr(keyrings.gitlab_pypi, "user_config_path", lambda: config_dir)
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(config_dir))
+    monkeypatch.setenv("XDG_CONFIG_DIRS", str(tmp_path / "xdg"))
+    return config_dir
+
+
+@pytest.fixture
+def make_old() -> Callable[[Path], None]:
+    """Return a function that sets the modification time of a directory far
+    enough in the past that what was cached about it (its listing, or that a
+    file in it is missing) is trusted.
+    """
+
+    def make_old(path: Path) -> None:
+        old = time.time_ns() - 3_600_000_000_000
+        os.utime(path, ns=(old, old))
+
+    return make_old
+
+
+@pytest.fixture
+def write_config(real_config_dir: Path) -> Callable[..., Path]:
+    """Return a function that writes a config document to the config file in
+    real_config_dir, or in another directory or with another name (e.g. a
+    fragment), and returns the file's path.
+    """
+
+    def write(
+        doc: dict[str, Any],
+        directory: Path = real_config_dir,
+        name: str = CONFIG_FILENAME,
+    ) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / name
+        with open(path, "wb") as f:
+            tomli_w.dump(doc, f)
+        return path
+
+    return write
+
+
+@pytest.fixture
+def write_token() -> Callable[[Path, str], None]:
+    """Return a function that writes a config file with a token for
+    gitlab.example.com, creating its directory.
+    """
+
+    def write(path: Path, token: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            tomli_w.dump({"gitlab.example.com": {"token": token}}, f)
+
+    return write
+
+
+@pytest.fixture
+def read_count(monkeypatch: MonkeyPatch) -> list[Path]:
+    """Record the config files that are actually read and parsed."""
+    calls: list[Path] = []
+    read_config = keyrings.gitlab_pypi._read_config
+
+    def wrapper(file: Path) -> Any:
+        calls.append(file)
+        return read_config(file)
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_read_config", wrapper)
+    return calls
+
+
+@pytest.fixture
+def discovery_count(monkeypatch: MonkeyPatch) -> list[None]:
+    """Record each time config paths are discovered."""
+    calls: list[None] = []
+    iter_config_paths = keyrings.gitlab_pypi.iter_config_paths
+
+    def wrapper() -> Iterator[Path]:
+        calls.append(None)
+        return iter_config_paths()
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "iter_config_paths", wrapper)
+    return calls
+
+
 class InvalidConfig(Enum):
     NOT_A_TABLE = auto()
     NO_TOKEN = auto()
@@ -237,10 +361,25 @@ def invalid_config_file(
 
 
 @pytest.fixture(autouse=True)
-def isolate_env(monkeypatch: MonkeyPatch) -> None:
-    keys = [key for key in os.environ.keys() if re.match(r"(CI|GITLAB|XDG)_", key)]
+def isolate_env(monkeypatch: MonkeyPatch, tmp_path: Path) -> None:
+    keys = [
+        key
+        for key in os.environ.keys()
+        if re.match(r"(CI|GITLAB|XDG|KEYRING_GITLAB_PYPI)_", key)
+    ]
     for key in keys:
         monkeypatch.delenv(key)  # pragma: no cover
+    # Keep the config snapshot, token caches and daemon socket out of the
+    # user's real cache and runtime directories.
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "run"))
+
+
+@pytest.fixture(autouse=True)
+def isolate_config_cache() -> Iterator[None]:
+    clear_config_cache()
+    yield
+    clear_config_cache()
 
 
 @pytest.fixture
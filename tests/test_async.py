@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections.abc import Coroutine
+from pathlib import Path
+from typing import Any, TypeVar
+
+import pytest
+import tomli_w
+from keyring.credentials import SimpleCredential
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import GitlabPypi, _async, compile_config_snapshot
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+
+_T = TypeVar("_T")
+
+
+def run(coro: Coroutine[Any, Any, _T]) -> _T:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def config_file(real_config_dir: Path) -> Path:
+    path = real_config_dir / "gitlab-pypi.toml"
+    with open(path, "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "token1"}}, f)
+    return path
+
+
+@pytest.fixture
+def slow_read(monkeypatch: pytest.MonkeyPatch) -> list[Path]:
+    """Make reading a config file block its thread for a while, and record
+    the files that are read.
+    """
+    calls: list[Path] = []
+    read_config = keyrings.gitlab_pypi._read_config
+
+    def wrapper(file: Path) -> Any:
+        calls.append(file)
+        time.sleep(0.2)
+        return read_config(file)
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_read_config", wrapper)
+    return calls
+
+
+@pytest.fixture
+def mock_ci(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", "https://other.example.com/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "job-token")
+
+
+def pair(credential: SimpleCredential | None) -> tuple[str, str] | None:
+    if credential is None:
+        return None
+    assert credential.username is not None
+    assert credential.password is not None
+    return credential.username, credential.password
+
+
+def test_aget_password(backend: GitlabPypi, config_file: Path) -> None:
+    assert run(backend.aget_password(SERVICE, "__token__")) == "token1"
+    assert run(backend.aget_password(OTHER_SERVICE, "__token__")) is None
+    assert run(backend.aget_password(SERVICE, "someone")) is None
+    assert run(backend.aget_password("https://pypi.org/simple/", "__token__")) is None
+
+
+def test_aget_credential(backend: GitlabPypi, config_file: Path) -> None:
+    credential = run(backend.aget_credential(SERVICE, None))
+    assert credential is not None
+    assert credential.username == "__token__"
+    assert credential.password == "token1"
+    assert run(backend.aget_credential(OTHER_SERVICE, None)) is None
+
+
+def test_ci_job_token(backend: GitlabPypi, config_file: Path, mock_ci: None) -> None:
+    assert run(backend.aget_password(OTHER_SERVICE, "gitlab-ci-token")) == "job-token"
+    assert run(backend.aget_password(OTHER_SERVICE, "__token__")) is None
+    credential = run(backend.aget_credential(OTHER_SERVICE, None))
+    assert credential is not None
+    assert credential.username == "gitlab-ci-token"
+
+
+def test_aget_credentials(
+    backend: GitlabPypi, config_file: Path, mock_ci: None
+) -> None:
+    services = [SERVICE, OTHER_SERVICE, "https://pypi.org/simple/"]
+    credentials = run(backend.aget_credentials(services))
+    assert list(credentials) == services
+    assert {service: pair(c) for service, c in credentials.items()} == {
+        service: pair(c) for service, c in backend.get_credentials(services).items()
+    }
+
+
+def test_fragments_and_precedence(
+    backend: GitlabPypi,
+    config_file: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    system_dir = tmp_path / "system"
+    system_dir.mkdir()
+    with open(system_dir / "gitlab-pypi.toml", "wb") as f:
+        tomli_w.dump({"other.example.com": {"token": "system"}}, f)
+    monkeypatch.setattr(
+        keyrings.gitlab_pypi, "system_config_paths", lambda: [system_dir]
+    )
+    assert run(backend.aget_password(SERVICE, "__token__")) == "token1"
+    assert run(backend.aget_password(OTHER_SERVICE, "__token__")) == "system"
+
+    fragments_dir = config_file.parent / "gitlab-pypi.d"
+    fragments_dir.mkdir()
+    with open(fragments_dir / "team.toml", "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "fragment"}}, f)
+    assert run(backend.aget_password(SERVICE, "__token__")) == "fragment"
+
+
+def test_concurrent_lookups_read_each_file_once(
+    backend: GitlabPypi, config_file: Path, slow_read: list[Path]
+) -> None:
+    async def lookups() -> list[str | None]:
+        return await asyncio.gather(
+            *(backend.aget_password(SERVICE, "__token__") for _ in range(1000))
+        )
+
+    assert run(lookups()) == ["token1"] * 1000
+    assert slow_read == [config_file]
+    assert not _async._pending
+
+
+def test_event_loop_is_not_blocked(
+    backend: GitlabPypi, config_file: Path, slow_read: list[Path]
+) -> None:
+    async def main() -> float:
+        gaps = []
+
+        async def tick() -> None:
+            last = time.perf_counter()
+            while True:
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        ticker = asyncio.create_task(tick())
+        assert await backend.aget_password(SERVICE, "__token__") == "token1"
+        ticker.cancel()
+        return max(gaps)
+
+    # Reading the config file takes 0.2 seconds.
+    assert run(main()) < 0.1
+
+
+def test_cancelled_lookup_does_not_cancel_others(
+    backend: GitlabPypi, config_file: Path, slow_read: list[Path]
+) -> None:
+    async def main() -> str | None:
+        first = asyncio.create_task(backend.aget_password(SERVICE, "__token__"))
+        second = asyncio.create_task(backend.aget_password(SERVICE, "__token__"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await second
+
+    assert run(main()) == "token1"
+
+
+def test_token_command_runs_off_the_loop(
+    backend: GitlabPypi, real_config_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    from keyrings.gitlab_pypi import _token_command
+
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def get(command: object) -> str:
+        threads.append(threading.get_ident())
+        return "from command"
+
+    monkeypatch.setattr(_token_command, "get", get)
+    with open(real_config_dir / "gitlab-pypi.toml", "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token_command": ["true"]}}, f)
+    assert run(backend.aget_password(SERVICE, "__token__")) == "from command"
+    assert threads
+    assert loop_thread not in threads
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="locates cache with XDG variables")
+def test_snapshot_is_updated(
+    backend: GitlabPypi,
+    config_file: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    path = compile_config_snapshot()
+    with open(config_file, "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "token2"}}, f)
+    st = config_file.stat()
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+    assert run(backend.aget_password(SERVICE, "__token__")) == "token2"
+    assert "token2" in path.read_text()
+
+
+def test_trace(
+    backend: GitlabPypi, config_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    events: list[dict[str, Any]] = []
+    keyrings.gitlab_pypi.set_trace_hook(events.append)
+    try:
+        assert run(backend.aget_password(SERVICE, "__token__")) == "token1"
+    finally:
+        keyrings.gitlab_pypi.set_trace_hook(None)
+    assert [event["source"] for event in events] == ["config"]
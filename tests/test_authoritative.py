@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import sys
+from collections.abc import Iterator
+from contextlib import suppress
+from pathlib import Path
+from typing import ClassVar
+
+import pytest
+from keyring.backend import KeyringBackend, get_all_keyring
+from keyring.backends.chainer import ChainerBackend
+from keyring.compat import properties
+from keyring.core import _detect_backend
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import GitlabPypi, _snapshot, backend
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+class SlowKeyring(KeyringBackend):
+    """A backend with a lower priority than GitlabPypi that finds nothing,
+    standing in for one that is slow to answer, like Secret Service waiting
+    for D-Bus activation on a headless runner. It's only viable while the
+    slow_keyring fixture is active.
+    """
+
+    enabled = False
+    calls: ClassVar[list[str]] = []
+
+    @properties.classproperty
+    def priority(cls) -> float:
+        if not cls.enabled:
+            raise RuntimeError("only used by test_authoritative")
+        return 5
+
+    def get_password(self, service: str, username: str) -> str | None:
+        self.calls.append(service)
+        return None
+
+    def set_password(self, service: str, username: str, password: str) -> None:
+        raise NotImplementedError
+
+    def delete_password(self, service: str, username: str) -> None:
+        raise NotImplementedError
+
+
+@pytest.fixture
+def slow_keyring() -> Iterator[list[str]]:
+    """Register SlowKeyring with keyring, and return the services it was asked
+    for.
+    """
+    SlowKeyring.enabled = True
+    SlowKeyring.calls.clear()
+    reset_backends()
+    try:
+        yield SlowKeyring.calls
+    finally:
+        SlowKeyring.enabled = False
+        reset_backends()
+
+
+def reset_backends() -> None:
+    """Make keyring find its backends again."""
+    # Raises KeyError if they haven't been found yet.
+    with suppress(KeyError):
+        get_all_keyring.reset()
+
+
+def detect() -> KeyringBackend:
+    """Return the backend that keyring would use, out of GitlabPypi and
+    SlowKeyring.
+    """
+    keyring = _detect_backend(
+        lambda keyring: isinstance(keyring, (GitlabPypi, SlowKeyring, ChainerBackend))
+    )
+    assert isinstance(keyring, KeyringBackend)
+    return keyring
+
+
+@pytest.fixture(autouse=True)
+def clear_priority() -> Iterator[None]:
+    backend._priority.cache_clear()
+    yield
+    backend._priority.cache_clear()
+
+
+@pytest.fixture
+def config_file(real_config_dir: Path) -> Path:
+    path = real_config_dir / "gitlab-pypi.toml"
+    path.write_text('["gitlab.example.com"]\nauthoritative = true\n')
+    return path
+
+
+def keyring_get(monkeypatch: pytest.MonkeyPatch, *args: str) -> None:
+    monkeypatch.setattr(sys, "argv", ["/usr/bin/keyring", *args])
+
+
+def test_priority(config_file: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    keyring_get(monkeypatch, "get", SERVICE, "__token__")
+    assert GitlabPypi.priority == 11
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["/usr/bin/keyring", "get", OTHER_SERVICE, "__token__"],
+        ["/usr/bin/keyring", "set", SERVICE, "__token__"],
+        ["/usr/bin/keyring", "get", "https://pypi.org/simple", "__token__"],
+        ["/usr/bin/pip", "download", SERVICE],
+        ["/usr/bin/keyring", "--list-backends"],
+        ["/usr/bin/keyring", "get"],
+        [],
+    ],
+    ids=["other-host", "set", "not-gitlab", "not-keyring", "no-get", "no-url", "empty"],
+)
+def test_default_priority(
+    config_file: Path, monkeypatch: pytest.MonkeyPatch, argv: list[str]
+) -> None:
+    monkeypatch.setattr(sys, "argv", argv)
+    assert GitlabPypi.priority == 9
+
+
+def test_priority_with_unreadable_config(
+    config_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+    slow_keyring: list[str],
+) -> None:
+    """An error reading config files doesn't stop keyring from picking a
+    backend.
+    """
+    config_file.unlink()
+    config_file.mkdir()
+    keyring_get(monkeypatch, "get", SERVICE, "__token__")
+    assert GitlabPypi.priority == 9
+    assert "Unable to check whether" in caplog.text
+    assert detect().name == ChainerBackend.name
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["keyring", "--mode", "creds", "get", SERVICE],
+        ["/venv/bin/keyring", "-b", "x.Y", "--output", "json", "get", SERVICE, "u"],
+        ["/lib/python3/site-packages/keyring/__main__.py", "get", SERVICE, "u"],
+        ["keyring", "get", "--mode", "creds", SERVICE],
+        ["keyring", "get", "-b", "x.Y", "--output=json", "--disable", SERVICE, "u"],
+    ],
+    ids=["mode", "options", "module", "mode-after-get", "options-after-get"],
+)
+def test_keyring_get_service(argv: list[str]) -> None:
+    assert backend._keyring_get_service(argv) == SERVICE
+
+
+def test_path_prefix(config_file: Path) -> None:
+    config_file.write_text(
+        '["gitlab.example.com/api/v4/projects/1"]\nauthoritative = true\n'
+    )
+    assert keyrings.gitlab_pypi._is_authoritative(SERVICE)
+    assert not keyrings.gitlab_pypi._is_authoritative(
+        "https://gitlab.example.com/api/v4/projects/2/packages/pypi/simple"
+    )
+
+
+def test_not_authoritative(config_file: Path) -> None:
+    config_file.write_text(
+        '["gitlab.example.com"]\ntoken = "token1"\nauthoritative = "yes"\n'
+    )
+    assert not keyrings.gitlab_pypi._is_authoritative(SERVICE)
+    assert GitlabPypi().get_password(SERVICE, "__token__") == "token1"
+
+
+@pytest.mark.parametrize(
+    ("preferred", "other", "token", "authoritative"),
+    [
+        ('token = "token1"', "authoritative = true", "token1", False),
+        ("authoritative = true", 'token = "token1"', None, True),
+    ],
+    ids=["token", "claim"],
+)
+@pytest.mark.parametrize("reverse", [False, True], ids=["preferred-first", "last"])
+def test_conflicting_spellings(
+    config_file: Path,
+    preferred: str,
+    other: str,
+    token: str | None,
+    authoritative: bool,
+    reverse: bool,
+) -> None:
+    """Only the table with the preferred spelling of the host is used, whether
+    it has a token or only claims the host.
+    """
+    tables = [
+        f'["https://gitlab.example.com"]\n{preferred}\n',
+        f'["gitlab.example.com"]\n{other}\n',
+    ]
+    if reverse:
+        tables.reverse()
+    config_file.write_text("".join(tables))
+    assert keyrings.gitlab_pypi._is_authoritative(SERVICE) is authoritative
+    assert GitlabPypi().get_password(SERVICE, "__token__") == token
+
+
+def test_token(config_file: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    config_file.write_text(
+        '["gitlab.example.com"]\ntoken = "token1"\nauthoritative = true\n'
+    )
+    keyring_get(monkeypatch, "get", SERVICE, "__token__")
+    assert GitlabPypi.priority == 11
+    assert GitlabPypi().get_password(SERVICE, "__token__") == "token1"
+
+
+def test_snapshot(
+    config_file: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    snapshot_path = tmp_path / "snapshot.json"
+    monkeypatch.setattr(_snapshot, "snapshot_path", lambda: snapshot_path)
+    keyrings.gitlab_pypi.compile_config_snapshot()
+    keyrings.gitlab_pypi.clear_config_cache()
+
+    entries = _snapshot.read(snapshot_path)
+    assert entries is not None
+    [(_, index)] = entries.values()
+    assert index[("https", "gitlab.example.com", 443)].claims("/api/v4")
+    assert keyrings.gitlab_pypi._is_authoritative(SERVICE)
+
+
+def test_keyring_uses_backend_alone(
+    config_file: Path, monkeypatch: pytest.MonkeyPatch, slow_keyring: list[str]
+) -> None:
+    keyring_get(monkeypatch, "get", SERVICE, "__token__")
+    keyring = detect()
+    assert isinstance(keyring, GitlabPypi)
+    assert keyring.get_password(SERVICE, "__token__") is None
+    assert keyring.get_credential(SERVICE, None) is None
+    assert slow_keyring == []
+
+
+def test_keyring_chains_other_hosts(
+    config_file: Path, monkeypatch: pytest.MonkeyPatch, slow_keyring: list[str]
+) -> None:
+    keyring_get(monkeypatch, "get", OTHER_SERVICE, "__token__")
+    keyring = detect()
+    assert keyring.name == ChainerBackend.name
+    assert keyring.get_password(OTHER_SERVICE, "__token__") is None
+    assert slow_keyring == [OTHER_SERVICE]
+
+
+def test_slow_backend_asked_unless_authoritative(
+    config_file: Path, monkeypatch: pytest.MonkeyPatch, slow_keyring: list[str]
+) -> None:
+    """Lookups of an index with no token through keyring only reach the slow
+    backend if the host isn't authoritative.
+    """
+    lookups = 10
+
+    def run() -> None:
+        backend._priority.cache_clear()
+        keyring_get(monkeypatch, "get", SERVICE, "__token__")
+        for _ in range(lookups):
+            assert detect().get_password(SERVICE, "__token__") is None
+
+    run()
+    assert slow_keyring == []
+
+    config_file.write_text("")
+    run()
+    assert slow_keyring == [SERVICE] * lookups
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import tomli_w
+from keyring.credentials import SimpleCredential
+from pyfakefs.fake_filesystem import FakeFilesystem
+from pytest import MonkeyPatch
+
+from keyrings.gitlab_pypi import GitlabPypi
+
+
+def project_url(base: str, project: int) -> str:
+    return f"{base}/api/v4/projects/{project}/packages/pypi/simple"
+
+
+def as_tuple(credential: SimpleCredential | None) -> tuple[str, str] | None:
+    if credential is None:
+        return None
+    return credential.username, credential.password
+
+
+def test_get_credentials(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    monkeypatch: MonkeyPatch,
+    discovery_count: list[None],
+) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(
+            {
+                "gitlab.example.com": {"token": "token1"},
+                "http://gitlab.example.com:8080": {"token": "token2"},
+            },
+            f,
+        )
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", "https://ci.example.com/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "ci-token")
+
+    services = [
+        *(project_url("https://gitlab.example.com", i) for i in range(40)),
+        project_url("http://gitlab.example.com:8080", 1),
+        project_url("https://ci.example.com", 1),
+        project_url("https://unknown.example.com", 1),
+        "https://pypi.org/simple",
+    ]
+    credentials = backend.get_credentials(services)
+    assert len(discovery_count) == 1
+
+    results = {service: as_tuple(c) for service, c in credentials.items()}
+    assert list(results) == services
+    assert results[services[0]] == ("__token__", "token1")
+    assert results[services[40]] == ("__token__", "token2")
+    assert results[services[41]] == ("gitlab-ci-token", "ci-token")
+    assert results[services[42]] is None
+    assert results[services[43]] is None
+
+    # Same results as looking each one up separately
+    assert results == {
+        service: as_tuple(backend.get_credential(service, None)) for service in services
+    }
+
+
+def test_get_credentials_not_gitlab(
+    backend: GitlabPypi, fs: FakeFilesystem, discovery_count: list[None]
+) -> None:
+    services = ["https://pypi.org/simple", "https://example.com/"]
+    assert backend.get_credentials(services) == dict.fromkeys(services)
+    assert discovery_count == []
+
+
+def test_get_credentials_ci(
+    backend: GitlabPypi, fs: FakeFilesystem, mock_ci: None, service: str
+) -> None:
+    credential = backend.get_credentials([service])[service]
+    assert credential is not None
+    assert credential.username == "gitlab-ci-token"
+    assert credential.password == os.environ["CI_JOB_TOKEN"]
@@ -21,6 +21,15 @@ def test_get_credential(backend: GitlabPypi, mock_ci: None, service: str) -> Non
     assert credential.password == os.environ["CI_JOB_TOKEN"]
 
 
+def test_non_project_index(
+    backend: GitlabPypi, mock_ci: None, non_project_service: str
+) -> None:
+    credential = backend.get_credential(non_project_service, None)
+    assert isinstance(credential, SimpleCredential)
+    assert credential.username == "gitlab-ci-token"
+    assert credential.password == os.environ["CI_JOB_TOKEN"]
+
+
 def test_not_ci(backend: GitlabPypi, service: str) -> None:
     assert backend.get_password(service, "gitlab-ci-token") is None
     assert backend.get_credential(service, None) is None
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+from pathlib import Path
+
+import pytest
+import tomli_w
+from pyfakefs.fake_filesystem import FakeFilesystem
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import _daemon
+from keyrings.gitlab_pypi.cli import main
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture
+def token_config(user_config_file: Path) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "config-token"}}, f)
+
+
+@pytest.mark.usefixtures("token_config")
+def test_get_password(capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["get", SERVICE, "__token__"]) == 0
+    assert capsys.readouterr().out == "config-token\n"
+
+
+@pytest.mark.usefixtures("token_config")
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--mode", "creds", "get", SERVICE],
+        ["get", "--mode", "creds", SERVICE],
+        ["get", SERVICE, "--mode=creds"],
+        ["--mode", "creds", "get", SERVICE, "someone"],
+    ],
+)
+def test_get_creds(capsys: pytest.CaptureFixture[str], argv: list[str]) -> None:
+    assert main(argv) == 0
+    assert capsys.readouterr().out == "__token__\nconfig-token\n"
+
+
+@pytest.mark.usefixtures("token_config")
+def test_get_password_json(capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["--output", "json", "get", SERVICE, "__token__"]) == 0
+    assert json.loads(capsys.readouterr().out) == {"password": "config-token"}
+
+
+@pytest.mark.usefixtures("token_config")
+def test_get_creds_json(capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["--mode", "creds", "--output", "json", "get", SERVICE]) == 0
+    assert json.loads(capsys.readouterr().out) == {
+        "username": "__token__",
+        "password": "config-token",
+    }
+
+
+@pytest.mark.usefixtures("token_config")
+def test_without_unix_domain_sockets(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    """Like on Windows, where socketserver has no UnixStreamServer."""
+    monkeypatch.delattr(socket, "AF_UNIX", raising=False)
+    monkeypatch.delattr(socketserver, "UnixStreamServer", raising=False)
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_daemon", _daemon)
+    monkeypatch.delitem(sys.modules, _daemon.__name__)
+    assert not hasattr(importlib.import_module(_daemon.__name__), "Server")
+
+    assert main(["get", SERVICE, "__token__"]) == 0
+    assert capsys.readouterr().out == "config-token\n"
+    assert main(["serve"]) == 1
+    assert "Unix domain sockets" in capsys.readouterr().err
+
+
+def test_get_ci_job_token(
+    capsys: pytest.CaptureFixture[str], fs: FakeFilesystem, mock_ci: None
+) -> None:
+    service = os.environ["CI_API_V4_URL"] + "/projects/1/packages/pypi/simple"
+    assert main(["get", service, "gitlab-ci-token"]) == 0
+    assert capsys.readouterr().out == "some-ci-job-token\n"
+
+    assert main(["--mode", "creds", "get", service]) == 0
+    assert capsys.readouterr().out == "gitlab-ci-token\nsome-ci-job-token\n"
+
+
+@pytest.mark.usefixtures("token_config")
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["get", "https://pypi.org/simple", "__token__"],
+        ["get", SERVICE, "alice"],
+        ["--mode", "creds", "get", "https://pypi.org/simple"],
+    ],
+)
+def test_get_not_found(capsys: pytest.CaptureFixture[str], argv: list[str]) -> None:
+    assert main(argv) == 1
+    assert capsys.readouterr().out == ""
+
+
+def test_get_password_requires_username(capsys: pytest.CaptureFixture[str]) -> None:
+    with pytest.raises(SystemExit) as exc_info:
+        main(["get", SERVICE])
+    assert exc_info.value.code == 2
+    assert "requires service and username" in capsys.readouterr().err
+
+
+@pytest.mark.usefixtures("token_config")
+def test_batch(
+    capsys: pytest.CaptureFixture[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    services = [SERVICE, "https://pypi.org/simple", SERVICE.replace("1", "2")]
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join([*services, "", ""])))
+
+    assert main(["batch"]) == 0
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"service": services[0], "username": "__token__", "password": "config-token"},
+        {"service": services[1], "username": None, "password": None},
+        {"service": services[2], "username": "__token__", "password": "config-token"},
+    ]
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import logging
 import os
 import sys
 from pathlib import Path
 
 import pytest
+import tomli_w
 from keyring.credentials import SimpleCredential
 from pyfakefs.fake_filesystem import FakeFilesystem
 from pytest import MonkeyPatch
@@ -19,6 +21,12 @@ def test_get_password(
     assert backend.get_password(service, "__token__") == token
 
 
+def test_get_password_non_project_index(
+    backend: GitlabPypi, config_file: Path, non_project_service: str, token: str
+) -> None:
+    assert backend.get_password(non_project_service, "__token__") == token
+
+
 def test_get_password_wrong_username(
     backend: GitlabPypi, config_file: Path, service: str, token: str
 ) -> None:
@@ -137,3 +145,163 @@ def test_macos_system_config_dir() -> None:
 def test_windows_system_config_dir() -> None:
     allusersprofile = os.environ["ALLUSERSPROFILE"]
     assert system_config_paths() == [Path(allusersprofile, "gitlab-pypi")]
+
+
+@pytest.mark.parametrize(
+    ("preferred", "other"),
+    [
+        ("https://gitlab.example.com", "gitlab.example.com"),
+        ("https://gitlab.example.com", "https://gitlab.example.com:443"),
+        ("https://gitlab.example.com", "https://gitlab.example.com/"),
+        ("gitlab.example.com/", "gitlab.example.com:443"),
+        ("gitlab.example.com:443", "gitlab.example.com:443/"),
+    ],
+)
+@pytest.mark.parametrize("reverse", [False, True], ids=["preferred-first", "last"])
+def test_conflicting_spellings(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    caplog: pytest.LogCaptureFixture,
+    preferred: str,
+    other: str,
+    reverse: bool,
+) -> None:
+    doc = {preferred: {"token": "preferred"}, other: {"token": "other"}}
+    if reverse:
+        doc = dict(reversed(doc.items()))
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(doc, f)
+
+    service = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+    with caplog.at_level(logging.WARNING, logger="keyrings.gitlab_pypi"):
+        assert backend.get_password(service, "__token__") == "preferred"
+    assert f"using {preferred!r}" in caplog.text
+
+
+def test_config_key_host_is_case_insensitive(
+    backend: GitlabPypi, user_config_file: Path
+) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump({"GitLab.Example.com": {"token": "token"}}, f)
+
+    service = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+    assert backend.get_password(service, "__token__") == "token"
+
+
+@pytest.mark.parametrize(
+    "key", ["gitlab.example.com:99999", "ftp://gitlab.example.com", "gitlab/foo"]
+)
+def test_invalid_config_key(
+    backend: GitlabPypi, user_config_file: Path, key: str
+) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump({key: {"token": "token"}}, f)
+
+    service = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+    assert backend.get_password(service, "__token__") is None
+
+
+SCOPED_CONFIG = {
+    "https://gitlab.example.com": {"token": "host"},
+    "https://gitlab.example.com/api/v4/projects/1": {"token": "project-1"},
+    "gitlab.example.com/api/v4/projects/2/": {"token": "project-2"},
+    "https://gitlab.example.com/api/v4/projects/2/packages/pypi/simple/foo": {
+        "token": "foo"
+    },
+    "https://gitlab.example.com:8443/api/v4/projects/1": {"token": "other-port"},
+}
+
+
+@pytest.mark.parametrize(
+    ("service", "expected"),
+    [
+        (
+            "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple",
+            "project-1",
+        ),
+        (
+            "https://gitlab.example.com/api/v4/projects/2/packages/pypi/simple",
+            "project-2",
+        ),
+        (
+            "https://gitlab.example.com/api/v4/projects/2/packages/pypi/simple/foo/",
+            "foo",
+        ),
+        (
+            "https://gitlab.example.com/api/v4/projects/2/packages/pypi/simple/foobar",
+            "project-2",
+        ),
+        ("https://gitlab.example.com/api/v4/projects/12/packages/pypi/simple", "host"),
+        ("https://gitlab.example.com/api/v4/projects/3/packages/pypi/simple", "host"),
+        (
+            "https://gitlab.example.com:8443/api/v4/projects/1/packages/pypi/simple",
+            "other-port",
+        ),
+        (
+            "https://gitlab.example.com:8443/api/v4/projects/3/packages/pypi/simple",
+            None,
+        ),
+    ],
+)
+def test_path_prefix(
+    backend: GitlabPypi, user_config_file: Path, service: str, expected: str | None
+) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(SCOPED_CONFIG, f)
+
+    assert backend.get_password(service, "__token__") == expected
+    credential = backend.get_credentials([service])[service]
+    assert (credential and credential.password) == expected
+
+
+def test_group_path_prefix(backend: GitlabPypi, user_config_file: Path) -> None:
+    doc = {
+        "gitlab.example.com": {"token": "host"},
+        "gitlab.example.com/api/v4/groups/group": {"token": "group"},
+    }
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(doc, f)
+
+    base = "https://gitlab.example.com/api/v4/groups"
+    for group, expected in [
+        ("group", "group"),
+        # Subgroups given by their full path.
+        ("group%2Fsubgroup", "group"),
+        ("other", "host"),
+    ]:
+        service = f"{base}/{group}/-/packages/pypi/simple"
+        assert backend.get_password(service, "__token__") == expected
+
+
+def test_path_prefix_conflicting_spellings(
+    backend: GitlabPypi, user_config_file: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    doc = {
+        "gitlab.example.com/api/v4/projects/1/": {"token": "other"},
+        "https://gitlab.example.com/api/v4/projects/1": {"token": "preferred"},
+    }
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(doc, f)
+
+    service = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+    with caplog.at_level(logging.WARNING, logger="keyrings.gitlab_pypi"):
+        assert backend.get_password(service, "__token__") == "preferred"
+    assert "configure the same path" in caplog.text
+
+
+def test_path_prefix_in_lower_precedence_file(
+    backend: GitlabPypi, user_config_file: Path
+) -> None:
+    # The first config file with a matching key is used, even if a lower
+    # precedence file has a longer prefix.
+    system_config_file = system_config_paths()[0] / "gitlab-pypi.toml"
+    system_config_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(system_config_file, "wb") as f:
+        tomli_w.dump(SCOPED_CONFIG, f)
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "user"}}, f)
+
+    service = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+    assert backend.get_password(service, "__token__") == "user"
+    user_config_file.unlink()
+    assert backend.get_password(service, "__token__") == "project-1"
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import os
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import GitlabPypi, clear_config_cache
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+def test_unchanged_file_is_not_reparsed(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    for _ in range(3):
+        assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert read_count == [user_config_file]
+
+
+def test_changed_file_is_reparsed(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+    # Same size, so only the modification time tells them apart.
+    write_token(user_config_file, "token2")
+    st = user_config_file.stat()
+    os.utime(user_config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert backend.get_password(SERVICE, "__token__") == "token2"
+    assert read_count == [user_config_file, user_config_file]
+
+
+def test_invalid_file_is_not_reparsed(
+    backend: GitlabPypi, user_config_file: Path, read_count: list[Path]
+) -> None:
+    user_config_file.write_text("[invalid")
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert read_count == [user_config_file]
+
+
+def test_deleted_file(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    user_config_file.unlink()
+    assert backend.get_password(SERVICE, "__token__") is None
+
+
+def test_clear_config_cache(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    clear_config_cache()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert read_count == [user_config_file, user_config_file]
+
+
+def test_config_paths_are_memoized(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    discovery_count: list[None],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    for _ in range(3):
+        assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert len(discovery_count) == 1
+
+    clear_config_cache()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert len(discovery_count) == 2
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="requires Linux")
+def test_config_paths_follow_environment(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    other = Path("/srv/config")
+    other.mkdir(parents=True)
+    write_token(other / "gitlab-pypi.toml", "token2")
+
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(other))
+    assert backend.get_password(SERVICE, "__token__") == "token2"
+    monkeypatch.delenv("XDG_CONFIG_HOME")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+
+def test_missing_file_is_remembered(
+    backend: GitlabPypi,
+    real_config_dir: Path,
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    config_file = real_config_dir / "gitlab-pypi.toml"
+    make_old(real_config_dir)
+
+    assert backend.get_password(SERVICE, "__token__") is None
+    missing = keyrings.gitlab_pypi._missing_config_files
+    assert missing[config_file][0] == real_config_dir
+    assert backend.get_password(SERVICE, "__token__") is None
+
+    # Creating the file changes the modification time of the directory.
+    write_token(config_file, "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert config_file not in missing
+
+
+def test_missing_directory_is_remembered(
+    backend: GitlabPypi,
+    real_config_dir: Path,
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    config_file = real_config_dir / "gitlab-pypi.toml"
+    real_config_dir.rmdir()
+    make_old(real_config_dir.parent)
+
+    assert backend.get_password(SERVICE, "__token__") is None
+    missing = keyrings.gitlab_pypi._missing_config_files
+    assert missing[config_file][0] == real_config_dir.parent
+
+    real_config_dir.mkdir()
+    write_token(config_file, "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+
+def test_recently_modified_directory_is_not_trusted(
+    backend: GitlabPypi, real_config_dir: Path
+) -> None:
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert not keyrings.gitlab_pypi._missing_config_files
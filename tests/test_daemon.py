@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+import tomli_w
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import (
+    _daemon,
+    _token_check,
+    clear_config_cache,
+    system_config_paths,
+    user_config_path,
+)
+from keyrings.gitlab_pypi.cli import main
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="requires Unix domain sockets"
+)
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture
+def config_file(
+    real_config_dir: Path, write_token: Callable[[Path, str], None]
+) -> Path:
+    path = real_config_dir / "gitlab-pypi.toml"
+    write_token(path, "token1")
+    return path
+
+
+@pytest.fixture
+def runtime_dir() -> Iterator[Path]:
+    # Socket paths are limited to about 100 bytes, which pytest's tmp_path can
+    # exceed.
+    with tempfile.TemporaryDirectory(prefix="kgp") as tmp:
+        yield Path(tmp)
+
+
+@pytest.fixture
+def socket_file(runtime_dir: Path) -> Path:
+    return runtime_dir / "gitlab-pypi" / "daemon.sock"
+
+
+@pytest.fixture
+def subprocess_config_paths(
+    real_config_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Find config directories like another process with the same environment
+    does, so that a daemon in this process agrees with clients in others.
+    """
+    monkeypatch.setattr(
+        keyrings.gitlab_pypi, "system_config_paths", system_config_paths
+    )
+    monkeypatch.setattr(keyrings.gitlab_pypi, "user_config_path", user_config_path)
+    clear_config_cache()
+
+
+@contextmanager
+def running(path: Path, *, poll_interval: float | None = None) -> Iterator[Path]:
+    resolver = _daemon.Resolver()
+    stop = threading.Event()
+    with _daemon.Server(path, resolver) as server:
+        threads = [threading.Thread(target=server.serve_forever)]
+        if poll_interval is not None:
+            threads.append(
+                threading.Thread(
+                    target=_daemon.watch, args=(resolver, stop, poll_interval)
+                )
+            )
+        for thread in threads:
+            thread.start()
+        try:
+            yield path
+        finally:
+            stop.set()
+            server.shutdown()
+            for thread in threads:
+                thread.join()
+
+
+@pytest.mark.usefixtures("config_file")
+def test_request(socket_file: Path) -> None:
+    with running(socket_file):
+        assert _daemon.request(socket_file, SERVICE, "__token__") == (
+            "__token__",
+            "token1",
+        )
+        assert _daemon.request(socket_file, SERVICE, None) == ("__token__", "token1")
+        assert _daemon.request(socket_file, SERVICE, "gitlab-ci-token") is None
+        assert _daemon.request(socket_file, SERVICE, "alice") is None
+        assert _daemon.request(socket_file, "https://pypi.org/simple", None) is None
+
+
+@pytest.mark.usefixtures("config_file")
+def test_request_ci_job_token(
+    socket_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The daemon's environment isn't the client's, so its CI job token isn't
+    used.
+    """
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", "https://ci.example.com/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "some-ci-job-token")
+    service = "https://ci.example.com/api/v4/projects/1/packages/pypi/simple"
+    with running(socket_file):
+        assert _daemon.request(socket_file, service, "gitlab-ci-token") is None
+        assert _daemon.request(socket_file, service, None) is None
+
+
+def test_different_config_files(
+    socket_file: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    """A client whose environment points at other config files reads them
+    itself.
+    """
+    monkeypatch.setattr(_daemon, "socket_path", lambda: socket_file)
+    other_dir = tmp_path / "other"
+    other_dir.mkdir()
+    write_token(other_dir / "gitlab-pypi.toml", "token2")
+
+    with running(socket_file):
+        monkeypatch.setattr(keyrings.gitlab_pypi, "user_config_path", lambda: other_dir)
+        monkeypatch.setenv("XDG_CONFIG_HOME", str(other_dir))
+        with pytest.raises(OSError, match="different config files"):
+            _daemon.request(socket_file, SERVICE, "__token__")
+        assert main(["get", SERVICE, "__token__"]) == 0
+        assert capsys.readouterr().out == "token2\n"
+
+
+@pytest.mark.usefixtures("config_file")
+def test_different_token_check(
+    socket_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """A client that checks tokens while the daemon doesn't looks them up
+    itself, so that it doesn't get tokens known to be unusable.
+    """
+    monkeypatch.setattr(_daemon, "socket_path", lambda: socket_file)
+    # As if the token had been found to have expired.
+    monkeypatch.setattr(_token_check, "usable", lambda *args: False)
+
+    with running(socket_file):
+        monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "cached")
+        with pytest.raises(OSError, match="token check"):
+            _daemon.request(socket_file, SERVICE, "__token__")
+        assert main(["get", SERVICE, "__token__"]) == 1
+        assert capsys.readouterr().out == ""
+
+
+@pytest.mark.usefixtures("config_file")
+def test_invalid_request(socket_file: Path) -> None:
+    with running(socket_file):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(os.fspath(socket_file))
+            sock.sendall(b"PUT\tfoo\n\xff\n")
+            with sock.makefile("rb") as f:
+                assert f.readline().startswith(b"ERROR\t")
+                assert f.readline().startswith(b"ERROR\t")
+
+        with pytest.raises(ValueError):
+            _daemon.request(socket_file, SERVICE + "\n", "__token__")
+
+
+def test_password_with_newline(config_file: Path, socket_file: Path) -> None:
+    with open(config_file, "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "a\nb"}}, f)
+    with running(socket_file):
+        with pytest.raises(OSError):
+            _daemon.request(socket_file, SERVICE, "__token__")
+
+
+@pytest.mark.usefixtures("config_file")
+def test_socket_permissions(socket_file: Path) -> None:
+    with running(socket_file):
+        assert socket_file.stat().st_mode & 0o777 == 0o600
+        assert socket_file.parent.stat().st_mode & 0o777 == 0o700
+    assert not socket_file.exists()
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_PEERCRED"), reason="requires Linux")
+def test_peer_uid() -> None:
+    a, b = socket.socketpair()
+    with a, b:
+        assert _daemon._peer_uid(a) == os.getuid()
+
+
+@pytest.mark.usefixtures("config_file")
+def test_stale_socket(socket_file: Path) -> None:
+    socket_file.parent.mkdir(mode=0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(os.fspath(socket_file))
+    assert socket_file.exists()
+
+    with running(socket_file):
+        assert _daemon.request(socket_file, SERVICE, "__token__") is not None
+        with pytest.raises(RuntimeError, match="already listening"):
+            _daemon.Server(socket_file, _daemon.Resolver())
+
+
+def test_reload(
+    config_file: Path, socket_file: Path, write_token: Callable[[Path, str], None]
+) -> None:
+    with running(socket_file, poll_interval=0.05):
+        write_token(config_file, "token2")
+        # Make sure the change is visible even with a coarse mtime.
+        st = config_file.stat()
+        os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+        deadline = time.monotonic() + 10
+        while _daemon.request(socket_file, SERVICE, "__token__") != (
+            "__token__",
+            "token2",
+        ):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        config_file.unlink()
+        while _daemon.request(socket_file, SERVICE, "__token__") is not None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+@pytest.mark.usefixtures("config_file")
+def test_concurrent_clients(socket_file: Path) -> None:
+    services = [
+        SERVICE if i % 2 else f"https://pypi.org/simple/pkg{i}/" for i in range(2000)
+    ]
+    expected = [("__token__", "token1") if i % 2 else None for i in range(2000)]
+
+    with running(socket_file):
+        with ThreadPoolExecutor(max_workers=64) as executor:
+            results = list(
+                executor.map(
+                    lambda service: _daemon.request(
+                        socket_file, service, None, timeout=10
+                    ),
+                    services,
+                )
+            )
+
+    assert results == expected
+
+
+def test_cli_uses_daemon(
+    config_file: Path,
+    socket_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setattr(_daemon, "socket_path", lambda: socket_file)
+    with running(socket_file):
+        # The daemon isn't watching for changes, so it still has the token.
+        config_file.unlink()
+        assert main(["get", SERVICE, "__token__"]) == 0
+        assert capsys.readouterr().out == "token1\n"
+        assert main(["--mode", "creds", "get", SERVICE]) == 0
+        assert capsys.readouterr().out == "__token__\ntoken1\n"
+
+
+def test_cli_without_daemon(
+    config_file: Path,
+    socket_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setattr(_daemon, "socket_path", lambda: socket_file)
+    assert main(["get", SERVICE, "__token__"]) == 0
+    assert capsys.readouterr().out == "token1\n"
+
+    # A socket left behind by a daemon that has stopped
+    socket_file.parent.mkdir(mode=0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(os.fspath(socket_file))
+    assert main(["get", SERVICE, "__token__"]) == 0
+    assert capsys.readouterr().out == "token1\n"
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="uses XDG_RUNTIME_DIR")
+@pytest.mark.usefixtures("subprocess_config_paths")
+def test_cli_ci_job_token(config_file: Path, runtime_dir: Path) -> None:
+    """A daemon started outside the CI job doesn't stop a client in the job
+    from using its CI job token.
+    """
+    service = "https://ci.example.com/api/v4/projects/1/packages/pypi/simple"
+    env = {
+        **os.environ,
+        "XDG_RUNTIME_DIR": str(runtime_dir),
+        "GITLAB_CI": "true",
+        "CI_API_V4_URL": "https://ci.example.com/api/v4",
+        "CI_JOB_TOKEN": "some-ci-job-token",
+    }
+    code = (
+        "import sys; from keyrings.gitlab_pypi.cli import main; "
+        "sys.exit(main(sys.argv[1:]))"
+    )
+
+    def get(*args: str) -> str:
+        return subprocess.run(
+            [sys.executable, "-c", code, *args],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+    with running(runtime_dir / "gitlab-pypi" / "daemon.sock"):
+        # The daemon isn't watching for changes, so it still has the token.
+        config_file.unlink()
+        assert get("get", service, "gitlab-ci-token") == "some-ci-job-token\n"
+        assert get("--mode", "creds", "get", service) == (
+            "gitlab-ci-token\nsome-ci-job-token\n"
+        )
+        # Tokens from config files still come from the daemon.
+        assert get("--mode", "creds", "get", SERVICE) == "__token__\ntoken1\n"
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="uses XDG_RUNTIME_DIR")
+@pytest.mark.usefixtures("subprocess_config_paths")
+def test_cli_client_does_not_import_keyring(
+    config_file: Path, runtime_dir: Path
+) -> None:
+    code = (
+        "import sys; from keyrings.gitlab_pypi.cli import main; "
+        f"assert main(['get', {SERVICE!r}, '__token__']) == 0; "
+        "assert 'keyring' not in sys.modules"
+    )
+
+    def get() -> str:
+        return subprocess.run(
+            [sys.executable, "-c", code],
+            env={**os.environ, "XDG_RUNTIME_DIR": str(runtime_dir)},
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+    # Without the daemon, and with it after the file it read is gone.
+    assert get() == "token1\n"
+    with running(runtime_dir / "gitlab-pypi" / "daemon.sock"):
+        config_file.unlink()
+        assert get() == "token1\n"
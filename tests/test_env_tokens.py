@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, NoReturn
+
+import pytest
+from keyring.credentials import SimpleCredential
+from pyfakefs.fake_filesystem import FakeFilesystem
+from yarl import URL
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import GitlabPypi, _daemon, _snapshot, set_trace_hook
+from keyrings.gitlab_pypi.cli import main
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+def pair(credential: SimpleCredential | None) -> tuple[str, str] | None:
+    return None if credential is None else (credential.username, credential.password)
+
+
+def _no_filesystem(*args: Any) -> NoReturn:
+    raise AssertionError("config files were looked up")
+
+
+@pytest.fixture
+def no_config_files(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Fail if config directories or the config snapshot are looked up."""
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_config_files", _no_filesystem)
+    monkeypatch.setattr(_snapshot, "snapshot_path", _no_filesystem)
+
+
+def test_get_password(
+    backend: GitlabPypi,
+    no_config_files: None,
+    service: str,
+    section: str,
+    token: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", f"{section}={token}")
+    assert backend.get_password(service, "__token__") == token
+    credential = backend.get_credential(service, None)
+    assert isinstance(credential, SimpleCredential)
+    assert credential.username == "__token__"
+    assert credential.password == token
+
+
+def test_precedence_over_config_file(
+    backend: GitlabPypi,
+    config_file: Path,
+    service: str,
+    section: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", f"{section}=env-token")
+    assert backend.get_password(service, "__token__") == "env-token"
+
+
+def test_precedence_over_ci_job_token(
+    backend: GitlabPypi,
+    no_config_files: None,
+    mock_ci: None,
+    service: str,
+    section: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", f"{section}=env-token")
+    credential = backend.get_credential(service, None)
+    assert pair(credential) == ("__token__", "env-token")
+    assert backend.get_password(service, "gitlab-ci-token") == "some-ci-job-token"
+
+
+def test_falls_back_to_config_file(
+    backend: GitlabPypi,
+    config_file: Path,
+    service: str,
+    token: str,
+    gitlab_base_url: URL,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    other = gitlab_base_url.with_host("other.example.com")
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", f"{other}=env-token")
+    assert backend.get_password(service, "__token__") == token
+
+
+def test_entries(
+    backend: GitlabPypi, no_config_files: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv(
+        "KEYRING_GITLAB_PYPI_TOKENS",
+        "\n  gitlab.example.com=host-token,"
+        "https://gitlab.example.com/api/v4/projects/1/=project-token\n"
+        "https://Other.Example.com:443=other-token ",
+    )
+    assert backend.get_password(SERVICE, "__token__") == "project-token"
+    assert (
+        backend.get_password(
+            "https://gitlab.example.com/api/v4/projects/2/packages/pypi/simple",
+            "__token__",
+        )
+        == "host-token"
+    )
+    assert backend.get_password(OTHER_SERVICE, "__token__") == "other-token"
+
+
+def test_invalid_entries(
+    backend: GitlabPypi,
+    fs: FakeFilesystem,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    monkeypatch.setenv(
+        "KEYRING_GITLAB_PYPI_TOKENS",
+        "glpat-secret =no-key gitlab.example.com= other.example.com=token",
+    )
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert backend.get_password(OTHER_SERVICE, "__token__") == "token"
+    assert "entry 1 isn't <key>=<token>" in caplog.text
+    assert "entry 2 isn't <key>=<token>" in caplog.text
+    assert "secret" not in caplog.text
+
+
+def test_parsed_once(
+    backend: GitlabPypi, no_config_files: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    parse = keyrings.gitlab_pypi._parse_env_tokens
+    parse.cache_clear()
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=token1")
+    for _ in range(3):
+        assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert parse.cache_info().misses == 1
+
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=token2")
+    assert backend.get_password(SERVICE, "__token__") == "token2"
+    assert parse.cache_info().misses == 2
+
+
+def test_get_credentials(
+    backend: GitlabPypi, user_config_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    user_config_file.write_text('["other.example.com"]\ntoken = "config-token"\n')
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=env-token")
+    credentials = backend.get_credentials([SERVICE, OTHER_SERVICE])
+    assert pair(credentials[SERVICE]) == ("__token__", "env-token")
+    assert pair(credentials[OTHER_SERVICE]) == ("__token__", "config-token")
+
+
+def test_get_credentials_only_env(
+    backend: GitlabPypi, no_config_files: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=env-token")
+    credentials = backend.get_credentials([SERVICE, "https://pypi.org/simple"])
+    assert {
+        service: pair(credential) for service, credential in credentials.items()
+    } == {
+        SERVICE: ("__token__", "env-token"),
+        "https://pypi.org/simple": None,
+    }
+
+
+def test_async(
+    backend: GitlabPypi, no_config_files: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=env-token")
+
+    async def lookups() -> tuple[str | None, SimpleCredential | None]:
+        return (
+            await backend.aget_password(SERVICE, "__token__"),
+            await backend.aget_credential(SERVICE, None),
+        )
+
+    password, credential = asyncio.run(lookups())
+    assert password == "env-token"
+    assert pair(credential) == ("__token__", "env-token")
+
+
+def test_trace(
+    backend: GitlabPypi, no_config_files: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    records: list[dict[str, Any]] = []
+    set_trace_hook(records.append)
+    try:
+        monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=secret")
+        assert backend.get_password(SERVICE, "__token__") == "secret"
+    finally:
+        set_trace_hook(None)
+
+    [record] = records
+    assert record["source"] == "env"
+    assert record["source_file"] is None
+    assert record["files"] == []
+    assert "env_tokens" in record["phases_us"]
+    assert "secret" not in json.dumps(record)
+
+
+def test_cli_skips_daemon(
+    no_config_files: None,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """The daemon doesn't have this process's environment, so it isn't asked
+    for tokens that are in it.
+    """
+    monkeypatch.setattr(_daemon, "request", _no_filesystem)
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKENS", "gitlab.example.com=env-token")
+    assert main(["get", SERVICE, "__token__"]) == 0
+    assert capsys.readouterr().out == "env-token\n"
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import os
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import (
+    GitlabPypi,
+    _snapshot,
+    clear_config_cache,
+    compile_config_snapshot,
+)
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture
+def fragments_dir(real_config_dir: Path) -> Path:
+    path = real_config_dir / "gitlab-pypi.d"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def system_fragments_dir(
+    real_config_dir: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    system_dir = tmp_path / "system"
+    monkeypatch.setattr(
+        keyrings.gitlab_pypi, "system_config_paths", lambda: [system_dir]
+    )
+    path = system_dir / "gitlab-pypi.d"
+    path.mkdir(parents=True)
+    return path
+
+
+def test_fragment(
+    backend: GitlabPypi, fragments_dir: Path, write_token: Callable[[Path, str], None]
+) -> None:
+    write_token(fragments_dir / "team.toml", "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    credential = backend.get_credentials([SERVICE])[SERVICE]
+    assert credential is not None
+    assert credential.password == "token1"
+
+
+def test_precedence(
+    backend: GitlabPypi,
+    real_config_dir: Path,
+    fragments_dir: Path,
+    system_fragments_dir: Path,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    system_config_file = system_fragments_dir.parent / "gitlab-pypi.toml"
+    write_token(system_config_file, "system")
+    write_token(system_fragments_dir / "a.toml", "system fragment")
+    assert backend.get_password(SERVICE, "__token__") == "system fragment"
+
+    write_token(real_config_dir / "gitlab-pypi.toml", "user")
+    assert backend.get_password(SERVICE, "__token__") == "user"
+
+    # Fragments override the config file next to them, and later names
+    # override earlier ones.
+    write_token(fragments_dir / "10-a.toml", "10-a")
+    assert backend.get_password(SERVICE, "__token__") == "10-a"
+    write_token(fragments_dir / "20-b.toml", "20-b")
+    write_token(fragments_dir / "15-c.toml", "15-c")
+    assert backend.get_password(SERVICE, "__token__") == "20-b"
+
+
+def test_host_key_in_higher_precedence_fragment_wins(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    write_config: Callable[..., Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_config(
+        {"gitlab.example.com/api/v4/projects/1": {"token": "project"}},
+        fragments_dir,
+        "10-project.toml",
+    )
+    write_token(fragments_dir / "20-host.toml", "host")
+    assert backend.get_password(SERVICE, "__token__") == "host"
+
+
+def test_only_toml_files(
+    backend: GitlabPypi, fragments_dir: Path, write_token: Callable[[Path, str], None]
+) -> None:
+    write_token(fragments_dir / "10-team.toml", "token1")
+    write_token(fragments_dir / "20-team.toml~", "backup")
+    write_token(fragments_dir / ".30-team.toml", "hidden")
+    (fragments_dir / "40-dir.toml").mkdir()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+
+def test_changed_fragment_is_reparsed_alone(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    read_count: list[Path],
+    write_config: Callable[..., Path],
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    fragments = [
+        write_config(
+            {f"host{i}.example.com": {"token": f"token{i}"}},
+            fragments_dir,
+            f"{i:03}.toml",
+        )
+        for i in range(10)
+    ]
+    write_token(fragments[3], "token3")
+    make_old(fragments_dir)
+
+    assert backend.get_password(SERVICE, "__token__") == "token3"
+    assert sorted(read_count) == fragments
+
+    read_count.clear()
+    # Renamed over, like config management tools do.
+    write_token(fragments_dir / ".003.toml.tmp", "token3-changed")
+    os.replace(fragments_dir / ".003.toml.tmp", fragments[3])
+    assert backend.get_password(SERVICE, "__token__") == "token3-changed"
+    assert backend.get_password(OTHER_SERVICE, "__token__") is None
+    assert read_count == [fragments[3]]
+
+
+def test_fragment_edited_in_place(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    write_token(fragments_dir / "10-a.toml", "a")
+    fragment = fragments_dir / "20-b.toml"
+    write_token(fragment, "old")
+    make_old(fragments_dir)
+    assert backend.get_password(SERVICE, "__token__") == "old"
+
+    with open(fragment, "w") as f:
+        f.write('["gitlab.example.com"]\ntoken = "new-token"\n')
+    assert backend.get_password(SERVICE, "__token__") == "new-token"
+
+    with open(fragment, "w") as f:
+        f.write('["other.example.com"]\ntoken = "other"\n')
+    assert backend.get_password(SERVICE, "__token__") == "a"
+
+
+def test_only_fragments_for_host_are_checked(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    write_config: Callable[..., Path],
+    make_old: Callable[[Path], None],
+) -> None:
+    fragments = [
+        write_config(
+            {f"host{i}.example.com": {"token": f"token{i}"}},
+            fragments_dir,
+            f"{i:03}.toml",
+        )
+        for i in range(10)
+    ]
+    make_old(fragments_dir)
+    service = "https://host3.example.com/api/v4/projects/1/packages/pypi/simple"
+    assert backend.get_password(service, "__token__") == "token3"
+
+    checked: list[Path] = []
+    load_fragment = keyrings.gitlab_pypi._load_fragment
+
+    def load(fragment: Path) -> Any:
+        checked.append(fragment)
+        return load_fragment(fragment)
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_load_fragment", load)
+    assert backend.get_password(service, "__token__") == "token3"
+    assert backend.get_password(OTHER_SERVICE, "__token__") is None
+    assert checked == [fragments[3]]
+
+
+def test_reload_checks_every_fragment(
+    fragments_dir: Path,
+    write_config: Callable[..., Path],
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    write_token(fragments_dir / "10-a.toml", "a")
+    fragment = write_config(
+        {"other.example.com": {"token": "other"}}, fragments_dir, "20-b.toml"
+    )
+    from keyrings.gitlab_pypi._daemon import Resolver
+
+    make_old(fragments_dir)
+    resolver = Resolver()
+    assert resolver.lookup(SERVICE, "__token__") == ("__token__", "a")
+
+    # Adds a key for a host that the fragment had no key for.
+    with open(fragment, "a") as f:
+        f.write('["gitlab.example.com"]\ntoken = "b"\n')
+    resolver.reload()
+    assert resolver.lookup(SERVICE, "__token__") == ("__token__", "b")
+
+
+def test_added_and_removed_fragments(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    write_token(fragments_dir / "10-a.toml", "a")
+    make_old(fragments_dir)
+    assert backend.get_password(SERVICE, "__token__") == "a"
+
+    write_token(fragments_dir / "20-b.toml", "b")
+    assert backend.get_password(SERVICE, "__token__") == "b"
+
+    make_old(fragments_dir)
+    (fragments_dir / "20-b.toml").unlink()
+    assert backend.get_password(SERVICE, "__token__") == "a"
+    assert fragments_dir / "20-b.toml" not in keyrings.gitlab_pypi._config_cache
+
+    # Renamed over, like config management tools do.
+    write_token(fragments_dir / ".10-a.toml.tmp", "a2")
+    make_old(fragments_dir)
+    os.replace(fragments_dir / ".10-a.toml.tmp", fragments_dir / "10-a.toml")
+    assert backend.get_password(SERVICE, "__token__") == "a2"
+
+    (fragments_dir / "10-a.toml").unlink()
+    assert backend.get_password(SERVICE, "__token__") is None
+
+
+def test_listing_is_cached(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    write_token: Callable[[Path, str], None],
+    make_old: Callable[[Path], None],
+) -> None:
+    write_token(fragments_dir / "team.toml", "token1")
+    make_old(fragments_dir)
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+    def scandir(path: object) -> None:
+        raise AssertionError("listed again")
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+
+def test_snapshot(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(fragments_dir / "team.toml", "token1")
+    assert compile_config_snapshot() == _snapshot.snapshot_path()
+    clear_config_cache()
+    read_count.clear()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert read_count == []
+
+
+def test_removed_fragment_leaves_snapshot(
+    backend: GitlabPypi,
+    fragments_dir: Path,
+    write_config: Callable[..., Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(fragments_dir / "10-a.toml", "a")
+    write_config({"other.example.com": {"token": "b"}}, fragments_dir, "20-b.toml")
+    snapshot_path = compile_config_snapshot()
+
+    (fragments_dir / "20-b.toml").unlink()
+    clear_config_cache()
+    assert backend.get_password(SERVICE, "__token__") == "a"
+    assert backend.get_password(OTHER_SERVICE, "__token__") is None
+    assert '"b"' not in snapshot_path.read_text()
+
+    # A later change rewrites the snapshot without the removed fragment.
+    write_token(fragments_dir / "10-a.toml", "a2")
+    clear_config_cache()
+    assert backend.get_password(SERVICE, "__token__") == "a2"
+    entries = _snapshot.read(snapshot_path)
+    assert entries is not None
+    assert list(entries) == [fragments_dir / "10-a.toml"]
+
+
+def test_daemon_watches_fragments_dir(fragments_dir: Path) -> None:
+    from keyrings.gitlab_pypi._daemon import _config_dirs
+
+    assert fragments_dir in _config_dirs()
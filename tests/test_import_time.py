@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+# keyring imports every installed backend whenever it is used, so importing
+# keyrings.gitlab_pypi mustn't import what is only needed to look up a token.
+# benchmarks/suite.py measures the time it takes, and fails if it's over the
+# budget given with --max-import-us.
+LAZY_MODULES = ["platformdirs", "yarl", "multidict", "propcache", "tomllib", "tomli"]
+
+# Import the parts of keyring that load backends, like keyring does.
+IMPORT_CODE = (
+    "import keyring.backend, keyring.credentials; import keyrings.gitlab_pypi.backend"
+)
+PACKAGE_MODULES = {"keyrings.gitlab_pypi", "keyrings.gitlab_pypi.backend"}
+
+
+def test_import_does_not_load_lookup_dependencies() -> None:
+    code = f"{IMPORT_CODE}; import sys; print(*sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout
+    modules = set(output.split())
+    assert PACKAGE_MODULES <= modules
+    assert modules.isdisjoint(LAZY_MODULES)
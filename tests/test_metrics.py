@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+import tomli_w
+
+from keyrings.gitlab_pypi import GitlabPypi, _metrics
+from keyrings.gitlab_pypi.cli import main
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="metrics are only recorded with fcntl"
+)
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+CI_SERVICE = "https://ci.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture
+def config_file(real_config_dir: Path) -> Path:
+    path = real_config_dir / "gitlab-pypi.toml"
+    with open(path, "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "token1"}}, f)
+    return path
+
+
+@pytest.fixture
+def state_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = tmp_path / "metrics.json"
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_METRICS", str(path))
+    return path
+
+
+def samples(text: str) -> dict[str, float]:
+    """Return the value of each sample in the text format, keyed by name and
+    labels.
+    """
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            key, _, value = line.rpartition(" ")
+            values[key] = float(value)
+    return values
+
+
+def rendered(state_path: Path) -> dict[str, float]:
+    return samples(_metrics.render(_metrics.load(state_path)))
+
+
+def test_sources(
+    backend: GitlabPypi,
+    config_file: Path,
+    state_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", "https://ci.example.com/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "job-token")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    credential = backend.get_credential(CI_SERVICE, None)
+    assert credential is not None
+    assert backend.get_password(OTHER_SERVICE, "__token__") is None
+
+    values = rendered(state_path)
+    duration = "keyring_gitlab_pypi_lookup_duration_seconds"
+    assert values[f'{duration}_count{{source="config"}}'] == 2
+    assert values[f'{duration}_count{{source="ci"}}'] == 1
+    assert values[f'{duration}_count{{source="miss"}}'] == 1
+    assert values[f'{duration}_bucket{{source="config",le="+Inf"}}'] == 2
+    assert 0 < values[f'{duration}_sum{{source="config"}}'] < 10
+    # Buckets are cumulative.
+    buckets = [
+        value
+        for key, value in values.items()
+        if key.startswith(f'{duration}_bucket{{source="config"')
+    ]
+    assert buckets == sorted(buckets)
+
+    text = state_path.read_text()
+    assert "token1" not in text
+    assert "job-token" not in text
+    assert "example.com" not in text
+
+
+def test_parse_errors_and_missing_files(
+    backend: GitlabPypi, real_config_dir: Path, state_path: Path
+) -> None:
+    config_file = real_config_dir / "gitlab-pypi.toml"
+    backend.get_password(SERVICE, "__token__")
+    config_file.write_text("not = [toml")
+    backend.get_password(SERVICE, "__token__")
+    backend.get_password(SERVICE, "__token__")
+
+    values = rendered(state_path)
+    assert (
+        values[f'keyring_gitlab_pypi_config_missing_total{{path="{config_file}"}}'] == 1
+    )
+    assert (
+        values[f'keyring_gitlab_pypi_config_parse_errors_total{{path="{config_file}"}}']
+        == 1
+    )
+
+
+def test_cache_hit_ratio(
+    backend: GitlabPypi, config_file: Path, state_path: Path
+) -> None:
+    for _ in range(4):
+        backend.get_password(SERVICE, "__token__")
+
+    values = rendered(state_path)
+    assert values['keyring_gitlab_pypi_config_cache_total{result="miss"}'] == 1
+    assert values['keyring_gitlab_pypi_config_cache_total{result="hit"}'] == 3
+    assert values["keyring_gitlab_pypi_config_cache_hit_ratio"] == 0.75
+
+
+def test_disabled(backend: GitlabPypi, config_file: Path, tmp_path: Path) -> None:
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert list(tmp_path.iterdir()) == [config_file.parent]
+
+
+def test_invalid_state(
+    backend: GitlabPypi, config_file: Path, state_path: Path
+) -> None:
+    state_path.write_text('{"version": 1, "durations": []}')
+    backend.get_password(SERVICE, "__token__")
+    values = rendered(state_path)
+    assert (
+        values['keyring_gitlab_pypi_lookup_duration_seconds_count{source="config"}']
+        == 1
+    )
+
+
+def test_unwritable_state(
+    backend: GitlabPypi,
+    config_file: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_METRICS", str(tmp_path / "no" / "dir"))
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert "Unable to update metrics" in caplog.text
+
+
+def test_label_escaping() -> None:
+    state = _metrics._State()
+    state.missing_files['/a "b"\\c\nd'] = 1
+    assert (
+        'keyring_gitlab_pypi_config_missing_total{path="/a \\"b\\"\\\\c\\nd"} 1'
+        in _metrics.render(state).splitlines()
+    )
+
+
+def test_metrics_command(
+    backend: GitlabPypi,
+    config_file: Path,
+    state_path: Path,
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    backend.get_password(SERVICE, "__token__")
+    assert main(["metrics"]) == 0
+    assert capsys.readouterr().out == _metrics.render(_metrics.load(state_path))
+
+    output = tmp_path / "gitlab_pypi.prom"
+    assert main(["metrics", "--output", str(output)]) == 0
+    assert output.read_text() == _metrics.render(_metrics.load(state_path))
+    assert output.stat().st_mode & 0o777 == 0o644
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith(".")] == []
+
+    monkeypatch.delenv("KEYRING_GITLAB_PYPI_METRICS")
+    assert main(["metrics"]) == 1
+    assert main(["metrics", "--state", str(state_path)]) == 0
+    assert main(["metrics", "--state", str(tmp_path / "missing.json")]) == 0
+    assert "keyring_gitlab_pypi_config_cache_hit_ratio 0.0" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="locates config with XDG variables")
+def test_processes(tmp_path: Path) -> None:
+    """Lookups in concurrent processes are all counted."""
+    config_home = tmp_path / "config"
+    config_home.mkdir()
+    with open(config_home / "gitlab-pypi.toml", "wb") as f:
+        tomli_w.dump({"gitlab.example.com": {"token": "token1"}}, f)
+    state_path = tmp_path / "metrics.json"
+    env = {
+        **os.environ,
+        "XDG_CONFIG_HOME": str(config_home),
+        "XDG_CONFIG_DIRS": str(tmp_path / "xdg"),
+        "XDG_CACHE_HOME": str(tmp_path / "cache"),
+        "XDG_RUNTIME_DIR": str(tmp_path / "run"),
+        "KEYRING_GITLAB_PYPI_METRICS": str(state_path),
+    }
+    get = [sys.executable, "-m", "keyrings.gitlab_pypi.cli", "get", SERVICE]
+
+    def run(_: int) -> None:
+        subprocess.run([*get, "__token__"], env=env, check=True, capture_output=True)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(run, range(16)))
+    values = rendered(state_path)
+    assert (
+        values['keyring_gitlab_pypi_lookup_duration_seconds_count{source="config"}']
+        == 16
+    )
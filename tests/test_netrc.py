@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import netrc
+import sys
+from pathlib import Path
+
+import pytest
+import tomli_w
+from pyfakefs.fake_filesystem import FakeFilesystem
+
+from keyrings.gitlab_pypi import _netrc
+from keyrings.gitlab_pypi.cli import main
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+CI_SERVICE = "https://ci.example.com/api/v4/groups/1/-/packages/pypi/simple"
+
+
+@pytest.fixture
+def netrc_file(fs: FakeFilesystem) -> Path:
+    path = Path("/home/user/.netrc")
+    path.parent.mkdir(parents=True)
+    return path
+
+
+@pytest.fixture
+def user_config(user_config_file: Path) -> Path:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(
+            {
+                "gitlab.example.com": {"token": "token1"},
+                "other.example.com": {"token": "token2"},
+            },
+            f,
+        )
+    return user_config_file
+
+
+def authenticators(path: Path, host: str) -> tuple[str, str] | None:
+    entry = netrc.netrc(path).authenticators(host)
+    return None if entry is None else (entry[0], entry[2])
+
+
+def test_write(
+    user_config: Path, netrc_file: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    assert main(["netrc", SERVICE, OTHER_SERVICE, "--file", str(netrc_file)]) == 0
+    assert capsys.readouterr().err == f"Updated {netrc_file}\n"
+
+    assert authenticators(netrc_file, "gitlab.example.com") == ("__token__", "token1")
+    assert authenticators(netrc_file, "other.example.com") == ("__token__", "token2")
+    if sys.platform != "win32":
+        assert netrc_file.stat().st_mode & 0o777 == 0o600
+
+
+def test_unchanged_file_is_not_rewritten(
+    user_config: Path, netrc_file: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    main(["netrc", SERVICE, "--file", str(netrc_file)])
+    inode = netrc_file.stat().st_ino
+    capsys.readouterr()
+
+    assert main(["netrc", SERVICE, "--file", str(netrc_file)]) == 0
+    assert capsys.readouterr().err == f"{netrc_file} is up to date\n"
+    assert netrc_file.stat().st_ino == inode
+
+
+def test_other_entries_are_kept(user_config: Path, netrc_file: Path) -> None:
+    netrc_file.write_text("machine example.com login user password secret")
+    main(["netrc", SERVICE, OTHER_SERVICE, "--file", str(netrc_file)])
+    main(["netrc", SERVICE, "--file", str(netrc_file)])
+
+    content = netrc_file.read_text()
+    assert content.startswith("machine example.com login user password secret\n")
+    assert authenticators(netrc_file, "example.com") == ("user", "secret")
+    assert authenticators(netrc_file, "gitlab.example.com") is not None
+    # Hosts that are no longer given are removed from the block.
+    assert authenticators(netrc_file, "other.example.com") is None
+
+
+def test_ci_job_token(
+    netrc_file: Path, fs: FakeFilesystem, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", "https://ci.example.com/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "ci-token")
+
+    assert main(["netrc", CI_SERVICE, "--file", str(netrc_file)]) == 0
+    assert authenticators(netrc_file, "ci.example.com") == (
+        "gitlab-ci-token",
+        "ci-token",
+    )
+
+
+def test_index_urls_from_project(
+    user_config: Path, netrc_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    project = Path("/project")
+    project.mkdir()
+    with open(project / "pyproject.toml", "wb") as f:
+        tomli_w.dump(
+            {
+                "tool": {
+                    "uv": {
+                        "index": [
+                            {"name": "gitlab", "url": SERVICE},
+                            {"name": "pytorch", "url": "https://download.pytorch.org"},
+                        ]
+                    }
+                }
+            },
+            f,
+        )
+    with open(project / "uv.toml", "wb") as f:
+        tomli_w.dump({"index": [{"name": "other", "url": OTHER_SERVICE}]}, f)
+    monkeypatch.chdir(project)
+
+    # Indexes that aren't on GitLab are skipped.
+    assert main(["netrc", "--file", str(netrc_file)]) == 0
+    assert authenticators(netrc_file, "gitlab.example.com") is not None
+    assert authenticators(netrc_file, "other.example.com") is not None
+    assert authenticators(netrc_file, "download.pytorch.org") is None
+
+
+@pytest.mark.parametrize(
+    "pyproject",
+    [
+        "[tool.uv\n",
+        '[tool]\nuv = "x"\n',
+        "[tool.uv]\nindex = 1\n",
+        '[tool.uv]\nindex = ["x"]\n',
+    ],
+    ids=["invalid-toml", "uv-not-a-table", "index-not-a-list", "index-not-a-table"],
+)
+def test_index_urls_from_invalid_project(
+    pyproject: str, fs: FakeFilesystem, caplog: pytest.LogCaptureFixture
+) -> None:
+    """A file that can't be read is skipped, and the other file is still used."""
+    project = Path("/project")
+    project.mkdir()
+    (project / "pyproject.toml").write_text(pyproject)
+    with open(project / "uv.toml", "wb") as f:
+        tomli_w.dump({"index": [{"name": "other", "url": OTHER_SERVICE}]}, f)
+
+    assert _netrc.index_urls(project) == [OTHER_SERVICE]
+    assert f"Unable to parse {project / 'pyproject.toml'}" in caplog.text
+
+
+def test_default_path(
+    user_config: Path, netrc_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("NETRC", str(netrc_file))
+    assert main(["netrc", SERVICE]) == 0
+    assert authenticators(netrc_file, "gitlab.example.com") is not None
+
+
+def test_missing_credentials(
+    user_config: Path, netrc_file: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    service = "https://unknown.example.com/api/v4/projects/1/packages/pypi/simple"
+    assert main(["netrc", SERVICE, service, "--file", str(netrc_file)]) == 1
+    assert f"No credentials for {service}" in caplog.text
+    assert authenticators(netrc_file, "gitlab.example.com") is not None
+
+
+def test_different_credentials_for_host(
+    user_config_file: Path, netrc_file: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(
+            {
+                "gitlab.example.com": {"token": "token1"},
+                "gitlab.example.com/api/v4/projects/2": {"token": "token2"},
+            },
+            f,
+        )
+    project_2 = SERVICE.replace("/projects/1/", "/projects/2/")
+    assert main(["netrc", SERVICE, project_2, "--file", str(netrc_file)]) == 0
+    assert authenticators(netrc_file, "gitlab.example.com") == ("__token__", "token1")
+    assert "only the first is written" in caplog.text
+
+
+def test_replace_block_in_middle() -> None:
+    content = (
+        "machine a.example.com login a password a\n"
+        f"{_netrc.BEGIN}\nmachine old.example.com login x password y\n{_netrc.END}\n"
+        "machine b.example.com login b password b\n"
+    )
+    block = _netrc.render_block({"new.example.com": ("__token__", "t")})
+    assert _netrc.replace_block(content, block) == (
+        "machine a.example.com login a password a\n"
+        f"{block}"
+        "machine b.example.com login b password b\n"
+    )
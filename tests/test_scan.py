@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import io
+import os
+import sys
+from pathlib import Path
+from typing import Any
+
+import pytest
+import tomli_w
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import (
+    GitlabPypi,
+    _index_config,
+    _parse_config_key,
+    _PathTrie,
+    _scan,
+)
+
+if sys.version_info < (3, 11):
+    import tomli as tomllib
+else:
+    import tomllib
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+ORIGIN = ("https", "gitlab.example.com", 443)
+
+# Documents the scanner must give the same tokens for as a full parse.
+SUPPORTED = {
+    "empty": "",
+    "simple": '["gitlab.example.com"]\ntoken = "secret"\n',
+    "bare key": "[localhost]\ntoken = 'secret'\n",
+    "no trailing newline": '["gitlab.example.com"]\ntoken = "secret"',
+    "crlf": '["gitlab.example.com"]\r\ntoken = "secret"\r\n',
+    "whitespace and comments": (
+        '# tokens\n\n  [ "gitlab.example.com" ]  # comment\n'
+        '\ttoken\t=\t"secret"   # comment\n'
+    ),
+    "escapes": '["gitlab.example.com"]\ntoken = "a\\"b\\\\c\\td"\n',
+    "literal key": "['gitlab.example.com']\ntoken = 'C:\\secret'\n",
+    "other keys": (
+        '["gitlab.example.com"]\nname = "work"\nport = 4_43\nenabled = true\n'
+        'token = "secret"\n'
+    ),
+    "root keys": 'version = 1\n["gitlab.example.com"]\ntoken = "secret"\n',
+    "non-string token": '["gitlab.example.com"]\ntoken = 123\n',
+    "blank token": '["gitlab.example.com"]\ntoken = ""\n',
+    "no token": '["gitlab.example.com"]\n',
+    "other hosts": (
+        '["https://other.example.com"]\ntoken = "other"\n'
+        '["gitlab.example.com.evil"]\ntoken = "evil"\n'
+        '["gitlab.example.com"]\ntoken = "secret"\n'
+    ),
+    "conflicting spellings": (
+        '["gitlab.example.com/"]\ntoken = "slash"\n'
+        '["https://gitlab.example.com:443"]\ntoken = "port"\n'
+        '["GITLAB.example.com"]\ntoken = "upper"\n'
+        '["https://gitlab.example.com"]\ntoken = "scheme"\n'
+        '["https://Gitlab.example.com"]\ntoken = "scheme upper"\n'
+    ),
+    "token command": (
+        '["gitlab.example.com"]\ntoken_command = "pass show gitlab"\ntoken_ttl = -1\n'
+    ),
+    "other port": '["gitlab.example.com:8443"]\ntoken = "secret"\n',
+    "http": '["http://gitlab.example.com"]\ntoken = "secret"\n',
+}
+
+# Documents the scanner must reject. Some are valid TOML it doesn't handle,
+# the rest are invalid TOML.
+UNSUPPORTED = {
+    "dotted key": '["gitlab.example.com"]\ntoken.value = "secret"\n',
+    "dotted table": "[gitlab.example.com]\ntoken = 'secret'\n",
+    "inline table": '"gitlab.example.com" = { token = "secret" }\n',
+    "array of tables": '[["gitlab.example.com"]]\ntoken = "secret"\n',
+    "multiline string": '["gitlab.example.com"]\ntoken = """\nsecret"""\n',
+    "unicode escape in key": '["gitlab.exa\\u006dple.com"]\ntoken = "secret"\n',
+    "unicode escape": '["gitlab.example.com"]\ntoken = "\\u0041"\n',
+    "non-ascii": '["gitlab.example.com"]\ntoken = "s\u00e9cret"\n',
+    "float": '["gitlab.example.com"]\ntimeout = 1.5\n',
+    "array": '["gitlab.example.com"]\nscopes = ["api"]\n',
+    "bom": '\ufeff["gitlab.example.com"]\ntoken = "secret"\n',
+    "duplicate table": (
+        '["gitlab.example.com"]\ntoken = "a"\n["gitlab.example.com"]\ntoken = "b"\n'
+    ),
+    "duplicate key": '["gitlab.example.com"]\ntoken = "a"\ntoken = "b"\n',
+    "duplicate spelling of key": '["gitlab.example.com"]\ntoken = "a"\n"token" = "b"\n',
+    "table redefines root key": '"gitlab.example.com" = 1\n["gitlab.example.com"]\n',
+    "unterminated header": '["gitlab.example.com"\ntoken = "secret"\n',
+    "unterminated string": '["gitlab.example.com"]\ntoken = "secret\n',
+    "invalid escape": '["gitlab.example.com"]\ntoken = "\\x41"\n',
+    "leading zero": '["gitlab.example.com"]\nport = 0443\n',
+    "missing value": '["gitlab.example.com"]\ntoken =\n',
+    "two values": '["gitlab.example.com"]\ntoken = "a" "b"\n',
+    "bare cr": '["gitlab.example.com"]\rtoken = "secret"\n',
+    "control character in comment": '# \x7f\n["gitlab.example.com"]\n',
+}
+
+
+def wanted(key: str) -> bool:
+    parsed = _parse_config_key(key)
+    return parsed is not None and parsed[0] == ORIGIN
+
+
+def scan(doc: str) -> dict[tuple[str, str, int], _PathTrie]:
+    f = io.BytesIO(doc.encode())
+    return _index_config(Path("gitlab-pypi.toml"), _scan.scan(f, wanted))
+
+
+@pytest.fixture(params=list(SUPPORTED.values()), ids=list(SUPPORTED))
+def supported(request: pytest.FixtureRequest) -> str:
+    return str(request.param)
+
+
+@pytest.fixture(params=list(UNSUPPORTED.values()), ids=list(UNSUPPORTED))
+def unsupported(request: pytest.FixtureRequest) -> str:
+    return str(request.param)
+
+
+def test_same_as_parse(supported: str) -> None:
+    index = _index_config(Path("gitlab-pypi.toml"), tomllib.loads(supported))
+    expected = {origin: index[origin] for origin in index if origin == ORIGIN}
+    assert scan(supported) == expected
+
+
+def test_same_tables(supported: str) -> None:
+    expected = {
+        key: table for key, table in tomllib.loads(supported).items() if wanted(key)
+    }
+    assert _scan.scan(io.BytesIO(supported.encode()), wanted) == expected
+
+
+def test_unsupported(unsupported: str) -> None:
+    with pytest.raises(_scan.Unsupported):
+        scan(unsupported)
+
+
+def test_only_wanted_tables() -> None:
+    doc = '["other.example.com"]\ntoken = "other"\n["gitlab.example.com"]\n'
+    assert _scan.scan(io.BytesIO(doc.encode()), wanted) == {"gitlab.example.com": {}}
+
+
+@pytest.fixture
+def scan_all(monkeypatch: pytest.MonkeyPatch) -> list[Path]:
+    """Scan config files regardless of size, and record the files that are
+    parsed instead.
+    """
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_SCAN_MIN_SIZE", 0)
+    calls: list[Path] = []
+    read_config = keyrings.gitlab_pypi._read_config
+
+    def wrapper(file: Path) -> Any:
+        calls.append(file)
+        return read_config(file)
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_read_config", wrapper)
+    return calls
+
+
+def write_hosts(path: Path, hosts: dict[str, str]) -> None:
+    with open(path, "wb") as f:
+        tomli_w.dump({host: {"token": token} for host, token in hosts.items()}, f)
+
+
+def test_large_file_is_scanned(
+    backend: GitlabPypi, user_config_file: Path, scan_all: list[Path]
+) -> None:
+    write_hosts(user_config_file, {"other.example.com": "a", "gitlab.example.com": "b"})
+    for _ in range(2):
+        assert backend.get_password(SERVICE, "__token__") == "b"
+    assert scan_all == []
+
+
+def test_changed_file_is_rescanned(
+    backend: GitlabPypi, user_config_file: Path, scan_all: list[Path]
+) -> None:
+    write_hosts(user_config_file, {"gitlab.example.com": "token1"})
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+
+    write_hosts(user_config_file, {"gitlab.example.com": "token2"})
+    st = user_config_file.stat()
+    os.utime(user_config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert backend.get_password(SERVICE, "__token__") == "token2"
+
+    user_config_file.unlink()
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert scan_all == []
+
+
+def test_unsupported_file_is_parsed(
+    backend: GitlabPypi, user_config_file: Path, scan_all: list[Path]
+) -> None:
+    user_config_file.write_text('"gitlab.example.com" = { token = "secret" }\n')
+    for _ in range(2):
+        assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert scan_all == [user_config_file]
+
+
+def test_invalid_file_is_parsed(
+    backend: GitlabPypi, user_config_file: Path, scan_all: list[Path]
+) -> None:
+    user_config_file.write_text('["gitlab.example.com"]\ntoken = "secret"\n[invalid')
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert scan_all == [user_config_file]
+
+
+def test_many_hosts_parse_file(
+    backend: GitlabPypi, user_config_file: Path, scan_all: list[Path]
+) -> None:
+    hosts = {f"host-{i}.example.com": f"token-{i}" for i in range(10)}
+    write_hosts(user_config_file, hosts)
+    for host, token in hosts.items():
+        service = SERVICE.replace("gitlab.example.com", host)
+        assert backend.get_password(service, "__token__") == token
+    assert scan_all == [user_config_file]
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import os
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+import tomli_w
+
+from keyrings.gitlab_pypi import (
+    GitlabPypi,
+    clear_config_cache,
+    compile_config_snapshot,
+)
+from keyrings.gitlab_pypi._snapshot import snapshot_path
+from keyrings.gitlab_pypi.cli import main
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+def new_process() -> None:
+    """Forget everything a new process wouldn't know."""
+    clear_config_cache()
+
+
+def test_no_snapshot_by_default(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert not snapshot_path().exists()
+
+
+def test_compile(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    assert compile_config_snapshot() == snapshot_path()
+    assert read_count == [user_config_file]
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert backend.get_credentials([SERVICE])[SERVICE] is not None
+    assert read_count == [user_config_file]
+
+
+def test_compile_path_prefixes(
+    backend: GitlabPypi, user_config_file: Path, read_count: list[Path]
+) -> None:
+    with open(user_config_file, "wb") as f:
+        tomli_w.dump(
+            {
+                "gitlab.example.com": {"token": "host"},
+                "gitlab.example.com/api/v4/projects/1": {"token": "project"},
+            },
+            f,
+        )
+    compile_config_snapshot()
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") == "project"
+    other = SERVICE.replace("/projects/1/", "/projects/2/")
+    assert backend.get_password(other, "__token__") == "host"
+    assert read_count == [user_config_file]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires POSIX permissions")
+def test_snapshot_permissions(
+    user_config_file: Path, write_token: Callable[[Path, str], None]
+) -> None:
+    write_token(user_config_file, "token1")
+    path = compile_config_snapshot()
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires POSIX permissions")
+def test_snapshot_ignored_if_not_private(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    compile_config_snapshot().chmod(0o644)
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert read_count == [user_config_file, user_config_file]
+    # Replaced with a private snapshot
+    assert snapshot_path().stat().st_mode & 0o777 == 0o600
+
+
+def test_changed_file_updates_snapshot(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    read_count: list[Path],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    compile_config_snapshot()
+
+    write_token(user_config_file, "token2")
+    st = user_config_file.stat()
+    os.utime(user_config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") == "token2"
+    assert len(read_count) == 2
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") == "token2"
+    assert len(read_count) == 2
+
+
+def test_deleted_file_updates_snapshot(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    compile_config_snapshot()
+    user_config_file.unlink()
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert str(user_config_file) not in snapshot_path().read_text()
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "not json",
+        "[]",
+        '{"version": 0}',
+        '{"version": 1}',
+        '{"version": 2, "files": {"f": {"signature": [0, 0, 0], "index": [[0]]}}}',
+        '{"version": 2, "files": {"f": {"signature": [0, 0, 0], '
+        '"index": [["https", "gitlab.example.com", 443, 0, "token"]]}}}',
+    ],
+)
+def test_invalid_snapshot(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    content: str,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    path = compile_config_snapshot()
+    path.write_text(content)
+
+    new_process()
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert str(user_config_file) in path.read_text()
+
+
+def test_cli(
+    backend: GitlabPypi,
+    user_config_file: Path,
+    capsys: pytest.CaptureFixture[str],
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "token1")
+    assert main(["compile"]) == 0
+    assert capsys.readouterr().out == f"{snapshot_path()}\n"
+    assert snapshot_path().exists()
+
+    assert main(["clear-cache"]) == 0
+    assert not snapshot_path().exists()
+    assert main(["clear-cache"]) == 0
+
+    assert backend.get_password(SERVICE, "__token__") == "token1"
+    assert not snapshot_path().exists()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import pytest
+import tomli_w
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import (
+    GitlabPypi,
+    _ConfigIndex,
+    _load_config,
+    compile_config_snapshot,
+)
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+OTHER_SERVICE = "https://other.example.com/api/v4/projects/1/packages/pypi/simple"
+TEAM_SERVICE = "https://team.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture(params=[False, True], ids=["no-snapshot", "snapshot"])
+def snapshot(request: pytest.FixtureRequest) -> bool:
+    """Whether the snapshot exists, in which case lookups write it back
+    concurrently as files change.
+    """
+    return bool(request.param)
+
+
+def write_generation(
+    path: Path, generation: int, hosts: tuple[str, ...] = ("gitlab", "other")
+) -> None:
+    """Atomically replace a config file with a token for each host that names
+    the generation.
+    """
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "wb") as f:
+        tomli_w.dump(
+            {
+                f"{host}.example.com": {"token": f"{host}-{generation}"}
+                for host in hosts
+            },
+            f,
+        )
+    os.replace(tmp, path)
+
+
+def generation(token: str | None, prefix: str) -> int:
+    assert token is not None
+    assert token.startswith(prefix)
+    return int(token[len(prefix) :])
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="locates cache with XDG variables")
+def test_lookups_while_config_is_rewritten(
+    backend: GitlabPypi, real_config_dir: Path, snapshot: bool
+) -> None:
+    config_file = real_config_dir / "gitlab-pypi.toml"
+    fragment = real_config_dir / "gitlab-pypi.d" / "team.toml"
+    fragment.parent.mkdir()
+    write_generation(config_file, 0)
+    write_generation(fragment, 0, hosts=("team",))
+    if snapshot:
+        compile_config_snapshot()
+    generations = 200
+    stop = threading.Event()
+
+    def reader() -> tuple[list[int], list[int]]:
+        seen: list[int] = []
+        seen_in_fragment: list[int] = []
+        while not stop.is_set():
+            credentials = backend.get_credentials([SERVICE, OTHER_SERVICE])
+            gitlab, other = credentials[SERVICE], credentials[OTHER_SERVICE]
+            assert gitlab is not None
+            assert other is not None
+            # Both tokens come from the same version of the file.
+            n = generation(gitlab.password, "gitlab-")
+            assert generation(other.password, "other-") == n
+            seen.append(n)
+            token = backend.get_password(SERVICE, "__token__")
+            seen.append(generation(token, "gitlab-"))
+            token = backend.get_password(TEAM_SERVICE, "__token__")
+            seen_in_fragment.append(generation(token, "team-"))
+        return seen, seen_in_fragment
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(reader) for _ in range(8)]
+        try:
+            for n in range(1, generations + 1):
+                write_generation(config_file, n)
+                if n % 10 == 0:
+                    # Fragments are listed and reloaded concurrently too.
+                    write_generation(fragment, n, hosts=("team",))
+                # A lookup that starts after a rewrite sees it.
+                token = backend.get_password(SERVICE, "__token__")
+                assert token == f"gitlab-{n}"
+                token = backend.get_password(TEAM_SERVICE, "__token__")
+                assert token == f"team-{n - n % 10}"
+        finally:
+            stop.set()
+        results = [future.result() for future in futures]
+
+    for seen, seen_in_fragment in results:
+        assert seen
+        # Each thread only ever moves forward through the versions of a file.
+        assert seen == sorted(seen)
+        assert seen_in_fragment == sorted(seen_in_fragment)
+
+    for _ in range(8):
+        assert backend.get_password(SERVICE, "__token__") == f"gitlab-{generations}"
+        assert backend.get_password(TEAM_SERVICE, "__token__") == f"team-{generations}"
+
+
+def test_changed_file_is_parsed_once(
+    backend: GitlabPypi,
+    real_config_dir: Path,
+    read_count: list[Path],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    config_file = real_config_dir / "gitlab-pypi.toml"
+    write_generation(config_file, 0)
+    assert backend.get_password(SERVICE, "__token__") == "gitlab-0"
+    read_count.clear()
+
+    read_config = keyrings.gitlab_pypi._read_config
+
+    def slow_read_config(file: Path) -> Any:
+        time.sleep(0.1)
+        return read_config(file)
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_read_config", slow_read_config)
+    write_generation(config_file, 1)
+    start = threading.Barrier(16)
+
+    def lookup(_: int) -> str | None:
+        start.wait()
+        return backend.get_password(SERVICE, "__token__")
+
+    with ThreadPoolExecutor(16) as executor:
+        tokens = list(executor.map(lookup, range(16)))
+    assert tokens == ["gitlab-1"] * 16
+    assert read_count == [config_file]
+
+
+def test_reload_does_not_block_other_files(
+    real_config_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    slow_file = real_config_dir / "slow.toml"
+    fast_file = real_config_dir / "fast.toml"
+    write_generation(slow_file, 0)
+    write_generation(fast_file, 0)
+
+    reading = threading.Event()
+    release = threading.Event()
+    read_config = keyrings.gitlab_pypi._read_config
+
+    def blocking_read_config(file: Path) -> Any:
+        if file == slow_file:
+            reading.set()
+            assert release.wait(10)
+        return read_config(file)
+
+    monkeypatch.setattr(keyrings.gitlab_pypi, "_read_config", blocking_read_config)
+    with ThreadPoolExecutor(1) as executor:
+        slow = executor.submit(_load_config, slow_file)
+        try:
+            assert reading.wait(10)
+            fast: _ConfigIndex = _load_config(fast_file)
+            assert fast
+        finally:
+            release.set()
+        assert slow.result()
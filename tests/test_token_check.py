@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from collections.abc import Callable, Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import NoReturn
+
+import pytest
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import GitlabPypi, _token_check
+from keyrings.gitlab_pypi.cli import main
+
+pytestmark = pytest.mark.skipif(
+    sys.platform != "linux", reason="locates config and cache with XDG variables"
+)
+
+# What the stand-in answers for each token.
+RESPONSES: dict[str, tuple[int, dict[str, object]]] = {
+    "active": (
+        200,
+        {
+            "active": True,
+            "revoked": False,
+            "expires_at": "2999-01-01",
+            "scopes": ["api"],
+        },
+    ),
+    "expired": (
+        401,
+        {"error": "invalid_token", "error_description": "Token has expired."},
+    ),
+    "revoked": (
+        200,
+        {"active": False, "revoked": True, "expires_at": None, "scopes": ["api"]},
+    ),
+    "past-expiry": (
+        200,
+        {"active": True, "revoked": False, "expires_at": "2000-01-01", "scopes": []},
+    ),
+    "deploy": (401, {"message": "401 Unauthorized"}),
+}
+
+
+class GitLab(ThreadingHTTPServer):
+    """Stand-in for GitLab's token self-introspection endpoint."""
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), GitLabHandler)
+        self.connections = 0
+        self.requests: list[str] = []
+
+    @property
+    def origin(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def service(self) -> str:
+        return f"{self.origin}/api/v4/projects/1/packages/pypi/simple"
+
+
+class GitLabHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: GitLab
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:
+        token = self.headers.get("PRIVATE-TOKEN", "")
+        self.server.requests.append(token)
+        if self.path == "/api/v4/personal_access_tokens/self":
+            status, data = RESPONSES.get(token, (401, {}))
+        else:
+            status, data = 404, {}
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def gitlab() -> Iterator[GitLab]:
+    server = GitLab()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def metadata(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Forget token metadata and connections kept in memory by other tests."""
+    monkeypatch.setattr(_token_check, "_metadata", (None, {}))
+    monkeypatch.setattr(_token_check, "_pool", _token_check.ConnectionPool())
+
+
+@pytest.fixture
+def system_config_dir(
+    real_config_dir: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    """Add a system config directory, with lower precedence than
+    real_config_dir.
+    """
+    system_dir = tmp_path / "system"
+    monkeypatch.setattr(
+        keyrings.gitlab_pypi, "system_config_paths", lambda: [system_dir]
+    )
+    return system_dir
+
+
+def test_check(
+    write_config: Callable[..., Path],
+    gitlab: GitLab,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    file = write_config(
+        {
+            gitlab.origin: {"token": "active"},
+            f"{gitlab.origin}/api/v4/projects/1": {"token": "expired"},
+            f"{gitlab.origin}/api/v4/projects/2": {"tokens": ["revoked", "deploy"]},
+            f"{gitlab.origin}/api/v4/projects/3": {"token": "active"},
+        },
+    )
+    assert main(["check"]) == 1
+
+    assert capsys.readouterr().out.splitlines() == [
+        f"{file}: {gitlab.origin}: active, expires 2999-01-01, scopes: api",
+        f"{file}: {gitlab.origin}/api/v4/projects/1: expired",
+        f"{file}: {gitlab.origin}/api/v4/projects/2 tokens[0]: revoked, scopes: api",
+        f"{file}: {gitlab.origin}/api/v4/projects/2 tokens[1]: rejected",
+        f"{file}: {gitlab.origin}/api/v4/projects/3: active, expires 2999-01-01, "
+        "scopes: api",
+    ]
+    # Each token is checked once, over a single connection.
+    assert sorted(gitlab.requests) == ["active", "deploy", "expired", "revoked"]
+    assert gitlab.connections == 1
+
+    path = _token_check.metadata_path()
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert "expired" in path.read_text()
+    assert '"active"' in path.read_text()
+    assert "deploy" not in path.read_text()
+
+
+def test_check_all_active(
+    write_config: Callable[..., Path],
+    gitlab: GitLab,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    write_config({gitlab.origin: {"token": "active"}})
+    assert main(["check"]) == 0
+
+
+def test_check_unreachable(
+    write_config: Callable[..., Path], capsys: pytest.CaptureFixture[str]
+) -> None:
+    write_config({"http://127.0.0.1:1": {"token": "active"}})
+    assert main(["check"]) == 1
+    assert "unable to check" in capsys.readouterr().out
+
+
+@pytest.fixture(params=["expired", "revoked", "past-expiry"])
+def bad_token(request: pytest.FixtureRequest) -> str:
+    return str(request.param)
+
+
+def test_cached_policy_skips_bad_token(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    system_config_dir: Path,
+    gitlab: GitLab,
+    bad_token: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({gitlab.origin: {"token": bad_token}})
+    write_config({gitlab.origin: {"token": "active"}}, system_config_dir)
+    main(["check"])
+    requests = len(gitlab.requests)
+
+    assert backend.get_password(gitlab.service, "__token__") == bad_token
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "cached")
+    assert backend.get_password(gitlab.service, "__token__") == "active"
+    assert len(gitlab.requests) == requests
+
+
+def test_cached_policy_falls_through_to_ci_job_token(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    gitlab: GitLab,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({gitlab.origin: {"token": "expired"}})
+    main(["check"])
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "cached")
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", f"{gitlab.origin}/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "job-token")
+
+    credential = backend.get_credential(gitlab.service, None)
+    assert credential is not None
+    assert credential.username == "gitlab-ci-token"
+    credential = backend.get_credentials([gitlab.service])[gitlab.service]
+    assert credential is not None
+    assert credential.username == "gitlab-ci-token"
+
+
+def test_cached_policy_keeps_unchecked_and_rejected_tokens(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    gitlab: GitLab,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({gitlab.origin: {"token": "deploy"}})
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "cached")
+    assert backend.get_password(gitlab.service, "__token__") == "deploy"
+    main(["check"])
+    assert backend.get_password(gitlab.service, "__token__") == "deploy"
+
+
+def test_online_policy(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    system_config_dir: Path,
+    gitlab: GitLab,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({gitlab.origin: {"token": "expired"}})
+    write_config({gitlab.origin: {"token": "active"}}, system_config_dir)
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "online")
+
+    for _ in range(3):
+        assert backend.get_password(gitlab.service, "__token__") == "active"
+    # Each token is checked once, and the connection is kept open between
+    # lookups.
+    assert gitlab.requests == ["expired", "active"]
+    assert gitlab.connections == 1
+
+
+def test_online_policy_rechecks_active_tokens(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    gitlab: GitLab,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({gitlab.origin: {"token": "active"}})
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "online")
+    backend.get_password(gitlab.service, "__token__")
+    monkeypatch.setattr(_token_check, "RECHECK_AFTER", -1)
+    backend.get_password(gitlab.service, "__token__")
+    assert gitlab.requests == ["active", "active"]
+
+
+def test_online_policy_unreachable(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    origin = "http://127.0.0.1:1"
+    write_config({origin: {"token": "active"}})
+    monkeypatch.setenv("KEYRING_GITLAB_PYPI_TOKEN_CHECK", "online")
+    service = f"{origin}/api/v4/projects/1/packages/pypi/simple"
+    assert backend.get_password(service, "__token__") == "active"
+    assert "Unable to check a token" in caplog.text
+
+    # The failure is saved, so the next lookup, even in a new process,
+    # doesn't wait for GitLab again until the back-off has passed.
+    checks: list[str] = []
+
+    def check(pool: object, origin: object, token: str) -> NoReturn:
+        checks.append(token)
+        raise _token_check.CheckError("unreachable")
+
+    monkeypatch.setattr(_token_check, "check", check)
+    monkeypatch.setattr(_token_check, "_metadata", (None, {}))
+    assert backend.get_password(service, "__token__") == "active"
+    assert checks == []
+
+    monkeypatch.setattr(_token_check, "CHECK_BACKOFF", -1)
+    assert backend.get_password(service, "__token__") == "active"
+    assert checks == ["active"]
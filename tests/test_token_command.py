@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import keyrings.gitlab_pypi
+from keyrings.gitlab_pypi import (
+    GitlabPypi,
+    _token_command,
+    clear_config_cache,
+    compile_config_snapshot,
+)
+
+pytestmark = pytest.mark.skipif(
+    sys.platform != "linux", reason="locates config and cache with XDG variables"
+)
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+
+# Prints a token after appending a line to a file, to count how many times it
+# runs.
+SCRIPT = """\
+import sys, time
+with open(sys.argv[1], "a") as f:
+    f.write("run\\n")
+time.sleep(float(sys.argv[2]))
+print(sys.argv[3])
+sys.exit(int(sys.argv[4]))
+"""
+
+
+class Command:
+    def __init__(self, root: Path) -> None:
+        self.script = root / "token.py"
+        self.script.write_text(SCRIPT)
+        self.runs_file = root / "runs"
+
+    def argv(
+        self, token: str = "secret", *, sleep: float = 0, status: int = 0
+    ) -> list[str]:
+        return [
+            sys.executable,
+            str(self.script),
+            str(self.runs_file),
+            str(sleep),
+            token,
+            str(status),
+        ]
+
+    @property
+    def runs(self) -> int:
+        try:
+            return len(self.runs_file.read_text().splitlines())
+        except FileNotFoundError:
+            return 0
+
+
+@pytest.fixture(autouse=True)
+def memory(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Forget tokens cached in memory by other tests."""
+    monkeypatch.setattr(_token_command, "_memory", {})
+
+
+@pytest.fixture
+def command(tmp_path: Path) -> Command:
+    return Command(tmp_path)
+
+
+def forget_memory(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Forget tokens cached in memory, like a new process."""
+    monkeypatch.setattr(_token_command, "_memory", {})
+
+
+def test_token_command(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    command: Command,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": command.argv()}})
+
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    forget_memory(monkeypatch)
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert command.runs == 1
+
+    path = _token_command.cache_path()
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+    assert "secret" in path.read_text()
+    assert str(command.script) not in path.read_text()
+
+
+def test_snapshot(
+    backend: GitlabPypi, write_config: Callable[..., Path], command: Command
+) -> None:
+    write_config(
+        {"gitlab.example.com": {"token_command": command.argv(), "token_ttl": 60}},
+    )
+    compile_config_snapshot()
+    clear_config_cache()
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert command.runs == 1
+
+
+def test_string_command(
+    backend: GitlabPypi, write_config: Callable[..., Path], command: Command
+) -> None:
+    argv = " ".join(f"'{arg}'" for arg in command.argv("from string"))
+    write_config({"gitlab.example.com": {"token_command": argv}})
+    assert backend.get_password(SERVICE, "__token__") == "from string"
+
+
+def test_ttl(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    command: Command,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config(
+        {"gitlab.example.com": {"token_command": command.argv(), "token_ttl": 0.1}},
+    )
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    time.sleep(0.2)
+    forget_memory(monkeypatch)
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert command.runs == 2
+
+
+def test_ttl_zero_disables_cache(
+    backend: GitlabPypi, write_config: Callable[..., Path], command: Command
+) -> None:
+    write_config(
+        {"gitlab.example.com": {"token_command": command.argv(), "token_ttl": 0}}
+    )
+    for _ in range(2):
+        assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert command.runs == 2
+    assert not _token_command.cache_path().exists()
+
+
+def test_token_takes_precedence(
+    backend: GitlabPypi, write_config: Callable[..., Path], command: Command
+) -> None:
+    write_config(
+        {"gitlab.example.com": {"token": "plain", "token_command": command.argv()}},
+    )
+    assert backend.get_password(SERVICE, "__token__") == "plain"
+    assert command.runs == 0
+
+
+@pytest.fixture(params=[1, 0], ids=["exit-status", "empty-output"])
+def failing_argv(request: pytest.FixtureRequest, command: Command) -> list[str]:
+    status = int(request.param)
+    return command.argv("" if status == 0 else "secret", status=status)
+
+
+def test_failing_command(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    command: Command,
+    failing_argv: list[str],
+    caplog: pytest.LogCaptureFixture,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": failing_argv}})
+    system_dir = tmp_path / "system"
+    monkeypatch.setattr(
+        keyrings.gitlab_pypi, "system_config_paths", lambda: [system_dir]
+    )
+    write_config({"gitlab.example.com": {"token": "system"}}, system_dir)
+
+    # Falls through to the next config file, and isn't cached.
+    for _ in range(2):
+        assert backend.get_password(SERVICE, "__token__") == "system"
+    assert command.runs == 2
+    assert "token_command" in caplog.text
+
+
+def test_missing_command(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": ["/nonexistent"]}})
+    assert backend.get_password(SERVICE, "__token__") is None
+    assert "Unable to run token_command" in caplog.text
+
+
+def test_cache_not_private(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    command: Command,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": command.argv()}})
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    _token_command.cache_path().chmod(0o644)
+
+    forget_memory(monkeypatch)
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert command.runs == 2
+    assert "other users can access" in caplog.text
+
+
+def test_invalid_cache(
+    backend: GitlabPypi, write_config: Callable[..., Path], command: Command
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": command.argv()}})
+    path = _token_command.cache_path()
+    path.parent.mkdir(parents=True)
+    path.write_text("not json")
+    path.chmod(0o600)
+
+    assert backend.get_password(SERVICE, "__token__") == "secret"
+    assert command.runs == 1
+
+
+def test_single_flight_threads(
+    backend: GitlabPypi, write_config: Callable[..., Path], command: Command
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": command.argv(sleep=0.2)}})
+    with ThreadPoolExecutor(16) as executor:
+        tokens = list(
+            executor.map(
+                lambda _: backend.get_password(SERVICE, "__token__"), range(16)
+            )
+        )
+    assert tokens == ["secret"] * 16
+    assert command.runs == 1
+
+
+def test_single_flight_processes(
+    write_config: Callable[..., Path], command: Command
+) -> None:
+    write_config({"gitlab.example.com": {"token_command": command.argv(sleep=0.5)}})
+    get = [sys.executable, "-m", "keyrings.gitlab_pypi.cli", "get", SERVICE]
+    start = threading.Barrier(8)
+
+    def run(_: int) -> str:
+        start.wait()
+        return subprocess.run(
+            [*get, "__token__"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+    with ThreadPoolExecutor(8) as executor:
+        outputs = list(executor.map(run, range(8)))
+    assert outputs == ["secret\n"] * 8
+    assert command.runs == 1
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import io
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from keyrings.gitlab_pypi import (
+    GitlabPypi,
+    _token_pool,
+    clear_config_cache,
+    compile_config_snapshot,
+    cool_down_token,
+)
+from keyrings.gitlab_pypi.cli import main
+
+pytestmark = pytest.mark.skipif(
+    sys.platform != "linux", reason="locates config and cache with XDG variables"
+)
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture(autouse=True)
+def memory(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Forget token pool state kept in memory by other tests."""
+    monkeypatch.setattr(_token_pool, "_memory", _token_pool._State())
+
+
+def lookups(backend: GitlabPypi, n: int) -> list[str | None]:
+    return [backend.get_password(SERVICE, "__token__") for _ in range(n)]
+
+
+def test_round_robin(backend: GitlabPypi, write_config: Callable[..., Path]) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b", "c"]}})
+    assert lookups(backend, 6) == ["a", "b", "c", "a", "b", "c"]
+
+    path = _token_pool.state_path()
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert '"a"' not in path.read_text()
+
+
+def test_weighted(backend: GitlabPypi, write_config: Callable[..., Path]) -> None:
+    write_config(
+        {
+            "gitlab.example.com": {
+                "tokens": [{"token": "a", "weight": 3}, {"token": "b"}, "c"]
+            }
+        },
+    )
+    # The picks for the heavier token are spread out.
+    assert lookups(backend, 5) == ["a", "b", "a", "c", "a"]
+    assert Counter(lookups(backend, 500)) == {"a": 300, "b": 100, "c": 100}
+
+
+def test_token_takes_precedence(
+    backend: GitlabPypi, write_config: Callable[..., Path]
+) -> None:
+    write_config({"gitlab.example.com": {"token": "plain", "tokens": ["a"]}})
+    assert backend.get_password(SERVICE, "__token__") == "plain"
+
+
+@pytest.fixture(
+    params=[[], ["a", ""], ["a", 1], [{"token": "a", "weight": 0}], [{"weight": 1}]]
+)
+def invalid_tokens(request: pytest.FixtureRequest) -> list[object]:
+    return list(request.param)
+
+
+def test_invalid_tokens(
+    backend: GitlabPypi, write_config: Callable[..., Path], invalid_tokens: list[object]
+) -> None:
+    write_config({"gitlab.example.com": {"tokens": invalid_tokens}})
+    assert backend.get_password(SERVICE, "__token__") is None
+
+
+def test_snapshot(backend: GitlabPypi, write_config: Callable[..., Path]) -> None:
+    write_config(
+        {"gitlab.example.com": {"tokens": ["a", {"token": "b", "weight": 2}]}},
+    )
+    compile_config_snapshot()
+    clear_config_cache()
+    assert lookups(backend, 3) == ["b", "a", "b"]
+
+
+def test_cool_down(backend: GitlabPypi, write_config: Callable[..., Path]) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b", "c"]}})
+    cool_down_token("b", 0.2)
+    assert lookups(backend, 4) == ["a", "c", "a", "c"]
+    time.sleep(0.3)
+    assert set(lookups(backend, 3)) == {"a", "b", "c"}
+
+
+def test_all_cooling_down(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b"]}})
+    cool_down_token("a", 60)
+    cool_down_token("b", 30)
+    assert backend.get_password(SERVICE, "__token__") == "b"
+    assert "Every token for the host is cooling down" in caplog.text
+
+
+def test_cool_down_command(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b"]}})
+    monkeypatch.setattr("sys.stdin", io.StringIO("a\n"))
+    assert main(["cool-down", "--seconds", "60"]) == 0
+    assert lookups(backend, 2) == ["b", "b"]
+
+    monkeypatch.setattr("sys.stdin", io.StringIO(""))
+    assert main(["cool-down"]) == 1
+
+
+def test_state_not_private(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b"]}})
+    assert lookups(backend, 1) == ["a"]
+    _token_pool.state_path().chmod(0o644)
+
+    # The rotation continues in memory.
+    assert lookups(backend, 2) == ["a", "b"]
+    assert "other users can access" in caplog.text
+
+
+def test_unusable_cache_dir(
+    backend: GitlabPypi,
+    write_config: Callable[..., Path],
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b", "c"]}})
+    path = _token_pool.state_path()
+    path.parent.parent.mkdir(parents=True)
+    path.parent.write_text("not a directory")
+
+    # Cooling down continues in memory.
+    cool_down_token("a", 60)
+    monkeypatch.setattr("sys.stdin", io.StringIO("b\n"))
+    assert main(["cool-down", "--seconds", "60"]) == 0
+    assert lookups(backend, 2) == ["c", "c"]
+    assert f"Unable to use {path}" in caplog.text
+
+
+def test_invalid_state(backend: GitlabPypi, write_config: Callable[..., Path]) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b"]}})
+    path = _token_pool.state_path()
+    path.parent.mkdir(parents=True)
+    path.write_text('{"pools": []}')
+    path.chmod(0o600)
+    assert lookups(backend, 2) == ["a", "b"]
+
+
+def test_threads_spread_evenly(
+    backend: GitlabPypi, write_config: Callable[..., Path]
+) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b", "c", "d"]}})
+    with ThreadPoolExecutor(16) as executor:
+        tokens = list(
+            executor.map(
+                lambda _: backend.get_password(SERVICE, "__token__"), range(64)
+            )
+        )
+    assert Counter(tokens) == {"a": 16, "b": 16, "c": 16, "d": 16}
+
+
+def test_processes_spread_evenly(write_config: Callable[..., Path]) -> None:
+    write_config({"gitlab.example.com": {"tokens": ["a", "b", "c", "d"]}})
+    get = [sys.executable, "-m", "keyrings.gitlab_pypi.cli", "get", SERVICE]
+    start = threading.Barrier(8)
+
+    def run(_: int) -> str:
+        start.wait()
+        return subprocess.run(
+            [*get, "__token__"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    with ThreadPoolExecutor(8) as executor:
+        tokens = list(executor.map(run, range(8)))
+    assert Counter(tokens) == {"a": 2, "b": 2, "c": 2, "d": 2}
+
+
+class RateLimitedServer(ThreadingHTTPServer):
+    """Answers with 429 when a token is used more than `limit` times."""
+
+    def __init__(self, limit: int) -> None:
+        super().__init__(("127.0.0.1", 0), RateLimitedHandler)
+        self.limit = limit
+        self.requests: Counter[str] = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/simple/"
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    server: RateLimitedServer
+
+    def do_GET(self) -> None:
+        token = self.headers.get("Private-Token", "")
+        with self.server.lock:
+            self.server.requests[token] += 1
+            limited = self.server.requests[token] > self.server.limit
+        self.send_response(429 if limited else 200)
+        if limited:
+            self.send_header("Retry-After", "60")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[RateLimitedServer]:
+    server = RateLimitedServer(limit=5)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_rate_limited_server(
+    backend: GitlabPypi, write_config: Callable[..., Path], server: RateLimitedServer
+) -> None:
+    """A client that cools a token down when it gets a 429 keeps getting
+    answers while any token has requests left.
+    """
+    write_config({"gitlab.example.com": {"tokens": ["a", "b", "c"]}})
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    def fetch() -> int:
+        token = backend.get_password(SERVICE, "__token__")
+        assert token is not None
+        request = urllib.request.Request(server.url, headers={"Private-Token": token})
+        try:
+            with opener.open(request):
+                return 200
+        except urllib.error.HTTPError as e:
+            cool_down_token(token, float(e.headers["Retry-After"]))
+            return e.code
+
+    statuses = [fetch() for _ in range(18)]
+    assert statuses.count(200) == 15
+    # Each token is rate limited once and then skipped.
+    assert statuses.count(429) == 3
+    assert sum(server.requests.values()) == 18
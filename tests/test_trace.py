@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+from pyfakefs.fake_filesystem import FakeFilesystem
+
+from keyrings.gitlab_pypi import GitlabPypi, iter_config_paths, set_trace_hook
+from keyrings.gitlab_pypi._trace import ENV_VAR
+
+SERVICE = "https://gitlab.example.com/api/v4/projects/1/packages/pypi/simple"
+CI_SERVICE = "https://ci.example.com/api/v4/projects/1/packages/pypi/simple"
+
+
+@pytest.fixture
+def records() -> Iterator[list[dict[str, Any]]]:
+    records: list[dict[str, Any]] = []
+    set_trace_hook(records.append)
+    yield records
+    set_trace_hook(None)
+
+
+@pytest.fixture
+def system_config_file(
+    fs: FakeFilesystem, write_token: Callable[[Path, str], None]
+) -> Path:
+    """Return the lowest-precedence config file, with a token for SERVICE."""
+    path = next(iter_config_paths()) / "gitlab-pypi.toml"
+    write_token(path, "secret-system-token")
+    return path
+
+
+@pytest.fixture(
+    params=[
+        (None, "missing"),
+        ('["gitlab.example.com"', "parse_error"),
+        ('["other.example.com"]\ntoken = "secret"\n', "miss"),
+    ],
+    ids=["missing", "parse_error", "miss"],
+)
+def user_config_outcome(request: pytest.FixtureRequest, user_config_file: Path) -> str:
+    """Write the user config file and return its expected outcome."""
+    content, outcome = request.param
+    if content is not None:
+        user_config_file.write_text(content)
+    return str(outcome)
+
+
+def test_files(
+    backend: GitlabPypi,
+    records: list[dict[str, Any]],
+    user_config_file: Path,
+    user_config_outcome: str,
+    system_config_file: Path,
+) -> None:
+    assert backend.get_password(SERVICE, "__token__") == "secret-system-token"
+
+    [record] = records
+    assert record["event"] == "lookup"
+    assert record["operation"] == "get_password"
+    assert record["service"] == SERVICE
+    assert record["username"] == "__token__"
+    assert record["source"] == "config"
+    assert record["source_file"] == str(system_config_file)
+
+    files = record["files"]
+    assert files[0] == {
+        "path": str(user_config_file),
+        "outcome": user_config_outcome,
+        "cached": False,
+    }
+    assert files[-1] == {
+        "path": str(system_config_file),
+        "outcome": "hit",
+        "cached": False,
+    }
+    assert record["cache_hits"] == 0
+
+    assert {"path_discovery", "file_open", "key_matching"} <= record["phases_us"].keys()
+    if user_config_outcome != "missing":
+        assert "toml_parse" in record["phases_us"]
+    assert "secret" not in json.dumps(record)
+
+
+def test_cache_hits(
+    backend: GitlabPypi,
+    records: list[dict[str, Any]],
+    user_config_file: Path,
+    write_token: Callable[[Path, str], None],
+) -> None:
+    write_token(user_config_file, "secret-user-token")
+
+    backend.get_password(SERVICE, "__token__")
+    backend.get_password(SERVICE, "__token__")
+
+    assert [file["cached"] for file in records[0]["files"]] == [False]
+    assert [file["cached"] for file in records[1]["files"]] == [True]
+    assert records[1]["cache_hits"] == 1
+    assert "toml_parse" not in records[1]["phases_us"]
+
+
+def test_ci_job_token(
+    backend: GitlabPypi,
+    records: list[dict[str, Any]],
+    fs: FakeFilesystem,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("GITLAB_CI", "true")
+    monkeypatch.setenv("CI_API_V4_URL", "https://ci.example.com/api/v4")
+    monkeypatch.setenv("CI_JOB_TOKEN", "secret-ci-token")
+
+    assert backend.get_credential(CI_SERVICE, None) is not None
+
+    [record] = records
+    assert record["operation"] == "get_credential"
+    assert record["source"] == "ci"
+    assert record["source_file"] is None
+    assert all(file["outcome"] == "missing" for file in record["files"])
+    assert "ci_env_check" in record["phases_us"]
+    assert "secret" not in json.dumps(record)
+
+
+def test_not_found(
+    backend: GitlabPypi, records: list[dict[str, Any]], fs: FakeFilesystem
+) -> None:
+    assert backend.get_password("https://pypi.org/simple", "__token__") is None
+    assert backend.get_password(SERVICE, "__token__") is None
+
+    assert [record["source"] for record in records] == [None, None]
+    # Config files aren't tried for URLs that aren't GitLab package indexes.
+    assert records[0]["files"] == []
+    assert records[1]["files"] != []
+
+
+def test_get_credentials(
+    backend: GitlabPypi,
+    records: list[dict[str, Any]],
+    system_config_file: Path,
+) -> None:
+    services = [SERVICE, "https://pypi.org/simple"]
+    backend.get_credentials(iter(services))
+
+    [record] = records
+    assert record["operation"] == "get_credentials"
+    assert record["services"] == services
+    assert record["source"] == "config"
+
+
+def test_redact_user_info(
+    backend: GitlabPypi, records: list[dict[str, Any]], fs: FakeFilesystem
+) -> None:
+    service = SERVICE.replace("https://", "https://user:secret@")
+    backend.get_password(service, "__token__")
+    assert records[0]["service"] == SERVICE.replace("https://", "https://***@")
+
+
+@pytest.mark.parametrize("value", ["1", "stderr"])
+def test_env_var_stderr(
+    backend: GitlabPypi,
+    system_config_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    value: str,
+) -> None:
+    monkeypatch.setenv(ENV_VAR, value)
+    backend.get_password(SERVICE, "__token__")
+    backend.get_password(SERVICE, "__token__")
+
+    lines = capsys.readouterr().err.splitlines()
+    assert [json.loads(line)["source"] for line in lines] == ["config", "config"]
+
+
+def test_env_var_file(
+    backend: GitlabPypi,
+    system_config_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    trace_file = Path("/var/log/gitlab-pypi.jsonl")
+    trace_file.parent.mkdir(parents=True, exist_ok=True)
+    monkeypatch.setenv(ENV_VAR, str(trace_file))
+    backend.get_password(SERVICE, "__token__")
+    backend.get_password(SERVICE, "__token__")
+
+    lines = trace_file.read_text().splitlines()
+    assert [json.loads(line)["source"] for line in lines] == ["config", "config"]
+
+
+def test_disabled(
+    backend: GitlabPypi,
+    system_config_file: Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    assert backend.get_password(SERVICE, "__token__") == "secret-system-token"
+    assert capsys.readouterr().err == ""